@@ -2,9 +2,10 @@
 数据集分析脚本 - 诊断变化像素分布问题
 """
 import numpy as np
-from PIL import Image
 import os
 
+from datasets.tile_index import load_tile_index
+
 def analyze_current_dataset():
     """分析当前数据集的变化像素分布"""
     dataset_path = "./datasets/CD/LEVIR-CD-256"
@@ -18,37 +19,24 @@ def analyze_current_dataset():
             print(f"❌ {split}.txt 不存在")
             continue
             
-        with open(list_file, 'r') as f:
-            files = [line.strip() for line in f.readlines()]
+        # 每个样本的统计来自索引 (datasets/tile_index.py), 列表文件改变时并行重建
+        index = load_tile_index(dataset_path, split)
+        files = index.names
         
         print(f"\n📊 {split.upper()} 集分析:")
         print(f"样本数量: {len(files)}")
         
-        change_ratios = []
-        valid_samples = 0
+        has_label = index.exists[:, 2]
+        for filename in files[~has_label]:
+            print(f"  ❌ 标签文件不存在或无法读取: {filename}")
         
-        for i, filename in enumerate(files):
-            label_path = f"{dataset_path}/label/{filename}"
-            
-            if os.path.exists(label_path):
-                try:
-                    label = np.array(Image.open(label_path))
-                    
-                    # 计算变化像素比例
-                    total_pixels = label.size
-                    change_pixels = np.sum(label > 0)
-                    change_ratio = change_pixels / total_pixels * 100
-                    
-                    change_ratios.append(change_ratio)
-                    valid_samples += 1
-                    
-                    if i < 5:  # 显示前5个样本的详细信息
-                        print(f"  样本 {i+1} ({filename}): {change_ratio:.3f}% 变化")
-                        
-                except Exception as e:
-                    print(f"  ❌ 无法读取 {filename}: {e}")
-            else:
-                print(f"  ❌ 标签文件不存在: {filename}")
+        # 计算变化像素比例
+        change_ratios = (index.change_ratio[has_label] * 100).tolist()
+        valid_samples = len(change_ratios)
+        
+        for i, (filename, change_ratio) in enumerate(zip(files[has_label][:5], change_ratios)):
+            # 显示前5个样本的详细信息
+            print(f"  样本 {i+1} ({filename}): {change_ratio:.3f}% 变化")
         
         if change_ratios:
             print(f"  📈 统计结果:")
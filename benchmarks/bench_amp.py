@@ -0,0 +1,100 @@
+"""
+Training step time and final mF1 of ELGCNet with --amp off | bf16 | fp16 on a synthetic change task
+(random pre-change images, post-change images with pasted rectangles, label = the rectangles).
+Every mode starts from the same initialization and sees the same batches.
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import utils
+from models.elgcnet import ELGCNet
+from models.losses import cross_entropy
+from misc.metric_tool import TorchConfuseMatrixMeter
+
+
+def make_batch(batch_size, img_size, generator):
+    a = torch.rand(batch_size, 3, img_size, img_size, generator=generator)
+    b = a.clone()
+    label = torch.zeros(batch_size, 1, img_size, img_size)
+    for i in range(batch_size):
+        for _ in range(3):
+            h, w = torch.randint(img_size // 8, img_size // 3, (2,), generator=generator).tolist()
+            y = torch.randint(0, img_size - h, (1,), generator=generator).item()
+            x = torch.randint(0, img_size - w, (1,), generator=generator).item()
+            b[i, :, y:y + h, x:x + w] = torch.rand(3, 1, 1, generator=generator)
+            label[i, :, y:y + h, x:x + w] = 1
+    # same normalization as CDDataAugmentation (mean=0.5, std=0.5)
+    return {'A': (a - 0.5) / 0.5, 'B': (b - 0.5) / 0.5, 'L': label}
+
+
+def run(amp, state_dict, train_batches, val_batches, lr, device):
+    net = ELGCNet().to(device)
+    net.load_state_dict(state_dict)
+    optimizer = torch.optim.AdamW(net.parameters(), lr=lr, betas=(0.9, 0.999), weight_decay=0.01)
+    scaler = torch.amp.GradScaler(torch.device(device).type, enabled=amp == 'fp16')
+
+    net.train()
+    times = []
+    for batch in train_batches:
+        start = time.perf_counter()
+        with utils.get_autocast(device, amp):
+            pred = net(batch['A'].to(device), batch['B'].to(device))[-1]
+            loss = cross_entropy(pred, batch['L'].to(device))
+        optimizer.zero_grad()
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+
+    net.eval()
+    running_metric = TorchConfuseMatrixMeter(n_class=2)
+    with torch.no_grad(), utils.get_autocast(device, amp):
+        for batch in val_batches:
+            pred = net(batch['A'].to(device), batch['B'].to(device))[-1]
+            running_metric.update_cm(pr=torch.argmax(pred, dim=1), gt=batch['L'].to(device))
+    return np.asarray(times), running_metric.get_scores(), loss.item()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=64, type=int)
+    parser.add_argument('--batch_size', default=4, type=int)
+    parser.add_argument('--steps', default=30, type=int)
+    parser.add_argument('--val_batches', default=4, type=int)
+    parser.add_argument('--lr', default=0.00031, type=float)
+    parser.add_argument('--modes', default=None, type=str,
+                        help='comma separated amp modes (default: off,bf16 on CPU, off,bf16,fp16 on CUDA)')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    args = parser.parse_args()
+
+    modes = args.modes.split(',') if args.modes else \
+        ['off', 'bf16', 'fp16'] if torch.device(args.device).type == 'cuda' else ['off', 'bf16']
+
+    generator = torch.Generator().manual_seed(0)
+    train_batches = [make_batch(args.batch_size, args.img_size, generator) for _ in range(args.steps)]
+    val_batches = [make_batch(args.batch_size, args.img_size, generator) for _ in range(args.val_batches)]
+    torch.manual_seed(0)
+    state_dict = ELGCNet().state_dict()
+
+    print('%-6s %14s %10s %10s %10s' % ('amp', 'step (ms)', 'speedup', 'mF1', 'last loss'))
+    base = None
+    for amp in modes:
+        times, scores, loss = run(amp, state_dict, train_batches, val_batches, args.lr, args.device)
+        # the first steps include allocator/kernel warmup
+        step_time = np.median(times[min(3, len(times) - 1):])
+        base = step_time if base is None else base
+        print('%-6s %14.1f %9.2fx %10.5f %10.4f' % (amp, 1000 * step_time, base / step_time, scores['mf1'], loss))
+
+
+if __name__ == '__main__':
+    main()
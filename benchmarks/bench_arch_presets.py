@@ -0,0 +1,57 @@
+"""
+Parameters, FLOPs and CPU latency of the ELGCNet architecture presets (models.networks.ARCH_PRESETS),
+to pick a latency tier. FLOPs are counted by torch.utils.flop_counter (convolutions and matmuls,
+2 FLOPs per multiply-add) for one pair of images.
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from models.networks import ARCH_PRESETS
+from misc.benchmark_tool import time_fn
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--iters', default=10, type=int)
+    parser.add_argument('--threads', default=None, type=int, help='torch intra-op threads (default: torch default)')
+    parser.add_argument('--presets', default=','.join(ARCH_PRESETS), type=str)
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    x1 = torch.randn(args.batch_size, 3, args.img_size, args.img_size)
+    x2 = torch.randn(args.batch_size, 3, args.img_size, args.img_size)
+    print('input %s, cpu, %d threads' % (list(x1.shape), torch.get_num_threads()))
+    rows = []
+    for name in args.presets.split(','):
+        torch.manual_seed(0)
+        net = ELGCNet(**ARCH_PRESETS[name]).eval()
+        params = sum(p.numel() for p in net.parameters())
+        with torch.no_grad():
+            counter = FlopCounterMode(display=False)
+            with counter:
+                net(x1[:1], x2[:1])
+            times = np.asarray(time_fn(lambda: net(x1, x2), warmup=2, iters=args.iters))
+        rows.append((name, params, counter.get_total_flops(), float(np.median(times)), times.min()))
+
+    base = dict((row[0], row[3]) for row in rows).get('base', rows[0][3])
+    print('%-8s %10s %10s %14s %14s %12s' % ('preset', 'params (M)', 'GFLOPs', 'p50 (ms)', 'min (ms)',
+                                             'vs base'))
+    for name, params, flops, latency, fastest in rows:
+        print('%-8s %10.2f %10.2f %14.1f %14.1f %11.2fx' % (name, params / 1e6, flops / 1e9, 1000 * latency,
+                                                          1000 * fastest, base / latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare the PIL (per-sample) and the tensor (per-batch) training augmentation:
+throughput and summary statistics of the augmented batches (statistical equivalence check)
+Both paths augment the same batches, every statistic is compared on the per-batch differences:
+    |mean(d)| <= z * std(d) / sqrt(n) + atol
+n: number of augmented batches (num_batches * rounds), the check fails (exit code 1) otherwise.
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+from datasets.batch_augmentation import get_train_batch_augmentation
+
+
+def batch_stats(batch):
+    A, B, L = batch['A'].float(), batch['B'].float(), batch['L'].float()
+    valid = L != 255
+    return np.array([A.mean().item(), A.std().item(), B.mean().item(), B.std().item(),
+                     (A - B).abs().mean().item(),
+                     # local smoothness (blur) and label statistics
+                     (A[..., 1:] - A[..., :-1]).abs().mean().item(),
+                     L[valid].mean().item(), (~valid).float().mean().item()])
+
+
+STAT_NAMES = ['A mean', 'A std', 'B mean', 'B std', '|A-B| mean', 'A grad mean', 'L change ratio',
+              'L ignore ratio']
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--num_batches', default=8, type=int)
+    parser.add_argument('--rounds', default=5, type=int, help='augmentation draws per batch')
+    parser.add_argument('--z', default=4.0, type=float, help='tolerance in standard errors of the mean difference')
+    parser.add_argument('--atol', default=1e-3, type=float, help='absolute tolerance added to every statistic')
+    args = parser.parse_args()
+
+    dataConfig = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = dataConfig.root_dir if args.root_dir is None else args.root_dir
+    kwargs = dict(root_dir=root_dir, img_size=args.img_size, split=args.split, is_train=True,
+                  label_transform=dataConfig.label_transform)
+    pil_set = CDDataset(augm_backend='pil', **kwargs)
+    raw_set = CDDataset(augm_backend='tensor', **kwargs)
+    batch_augm = get_train_batch_augmentation(args.img_size)
+
+    n = min(len(pil_set), args.batch_size * args.num_batches)
+    indices = [list(range(i, min(i + args.batch_size, n))) for i in range(0, n, args.batch_size)]
+
+    # decoded samples are shared by both paths so that only the augmentation is timed
+    raw_samples = [raw_set[i] for i in range(n)]
+    pil_inputs = [(np.asarray(s['A'].permute(1, 2, 0)), np.asarray(s['B'].permute(1, 2, 0)),
+                   np.asarray(s['L'][0])) for s in raw_samples]
+
+    stats = {'pil': [], 'tensor': []}
+    times = {'pil': 0.0, 'tensor': 0.0}
+    for _ in range(args.rounds):
+        for idx in indices:
+            start = time.perf_counter()
+            samples = []
+            for i in idx:
+                [img, img_B], [label] = pil_set.augm.transform([pil_inputs[i][0], pil_inputs[i][1]],
+                                                               [pil_inputs[i][2]])
+                samples.append({'A': img, 'B': img_B, 'L': label})
+            batch = default_collate(samples)
+            times['pil'] += time.perf_counter() - start
+            stats['pil'].append(batch_stats(batch))
+
+            start = time.perf_counter()
+            batch = batch_augm(default_collate([raw_samples[i] for i in idx]))
+            times['tensor'] += time.perf_counter() - start
+            stats['tensor'].append(batch_stats(batch))
+
+    total = n * args.rounds
+    print('samples: %d, rounds: %d, threads: %d' % (n, args.rounds, torch.get_num_threads()))
+    print('pil:    %.1f samples/s' % (total / times['pil']))
+    print('tensor: %.1f samples/s (%.2fx)' % (total / times['tensor'], times['pil'] / times['tensor']))
+    print('%-16s %12s %12s %12s %12s' % ('statistic', 'pil', 'tensor', 'abs. diff', 'tolerance'))
+    pil_stats, tensor_stats = np.mean(stats['pil'], axis=0), np.mean(stats['tensor'], axis=0)
+    diffs = np.asarray(stats['pil']) - np.asarray(stats['tensor'])
+    std_err = diffs.std(axis=0, ddof=1) / np.sqrt(len(diffs)) if len(diffs) > 1 else np.full(len(STAT_NAMES), np.inf)
+    ok = True
+    for name, p, t, se in zip(STAT_NAMES, pil_stats, tensor_stats, std_err):
+        tol = args.z * se + args.atol
+        passed = abs(p - t) <= tol
+        ok = ok and passed
+        print('%-16s %12.5f %12.5f %12.3f %12.3f%s' % (name, p, t, abs(p - t), tol, '' if passed else '  FAIL'))
+    print('statistical equivalence: %s' % ('OK' if ok else 'FAILED'))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Steps to a target val mF1 of training runs, e.g. uniform vs change-aware sampling (datasets.change_sampler).
+Reads val_acc.npy and val_steps.npy (optimizer steps at every val epoch) of each checkpoint dir.
+e.g.
+  python main_cd.py --project_name uniform --epoch_samples 2048 --max_epochs 50 --target_mf1 0.85
+  python main_cd.py --project_name change --epoch_samples 2048 --max_epochs 50 --target_mf1 0.85 --sampler change
+  python benchmarks/bench_change_sampler.py --checkpoint_dirs checkpoints/uniform,checkpoints/change --target_mf1 0.85
+Without --checkpoint_dirs, prints the sampling statistics of a split for a few temperatures.
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.tile_index import load_tile_index
+from datasets.change_sampler import get_change_weights
+
+
+def steps_to_target(checkpoint_dir, target_mf1):
+    val_acc = np.load(os.path.join(checkpoint_dir, 'val_acc.npy'))
+    val_steps = np.load(os.path.join(checkpoint_dir, 'val_steps.npy'))
+    reached = np.nonzero(val_acc >= target_mf1)[0]
+    steps = int(val_steps[reached[0]]) if len(reached) else None
+    return steps, float(val_acc.max()), int(val_steps[val_acc.argmax()]), int(val_steps[-1])
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--checkpoint_dirs', default=None, type=str, help='comma separated, the first is the baseline')
+    parser.add_argument('--target_mf1', default=0.85, type=float)
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train', type=str)
+    parser.add_argument('--temperatures', default='1,2,4,8', type=str)
+    parser.add_argument('--floor', default=0.01, type=float)
+    args = parser.parse_args()
+
+    if args.checkpoint_dirs is None:
+        root_dir = args.root_dir
+        if root_dir is None:
+            root_dir = data_config.DataConfig().get_data_config(args.data_name).root_dir
+        ratio = load_tile_index(root_dir, args.split).change_ratio
+        print('%s split of %s: %d tiles, %.1f%% without change' % (args.split, root_dir, len(ratio),
+                                                                   100 * (ratio == 0).mean()))
+        print('%-12s %22s %16s %16s' % ('temperature', 'mean change ratio', 'empty draws', 'max/min prob'))
+        print('%-12s %22.4f %15.1f%% %16.1f' % ('uniform', ratio.mean(), 100 * (ratio == 0).mean(), 1))
+        for t in args.temperatures.split(','):
+            p = get_change_weights(ratio, float(t), args.floor)
+            print('%-12s %22.4f %15.1f%% %16.1f' % (t, (p * ratio).sum(), 100 * p[ratio == 0].sum(),
+                                                    p.max() / p.min()))
+        return
+
+    rows = [(path,) + steps_to_target(path, args.target_mf1) for path in args.checkpoint_dirs.split(',')]
+    print('optimizer steps to val mF1 >= %.4f' % args.target_mf1)
+    print('%-32s %16s %10s %10s %14s %12s' % ('run', 'steps to target', 'vs first', 'best mF1', 'at step',
+                                              'total steps'))
+    for path, steps, best, best_steps, total in rows:
+        ratio = '%9.2fx' % (rows[0][1] / steps) if steps and rows[0][1] else '%10s' % '-'
+        print('%-32s %16s %s %10.5f %14d %12d' % (path[-32:], steps if steps is not None else 'not reached',
+                                                   ratio, best, best_steps, total))
+
+
+if __name__ == '__main__':
+    main()
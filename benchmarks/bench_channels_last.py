@@ -0,0 +1,137 @@
+"""
+Latency and memory-format copies of ELGCNet in NCHW vs channels_last (NHWC), for inference and a
+training step (forward + backward).
+Copies are read from a torch.profiler trace (strides of every aten::copy_) and attributed to the
+innermost module (forward) or autograd node (backward) they run in:
+  layout conversion: the destination has another dimension order than the source (NCHW <-> NHWC)
+  dense copy:        same dimension order, a strided view made dense (e.g. a channel slice)
+Only copies of 4-d tensors are counted, without broadcasts (conv bias init); size-1 dims are ignored.
+"""
+import os
+import sys
+import json
+import tempfile
+from collections import Counter
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.profiler import profile, record_function, ProfilerActivity
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from misc.benchmark_tool import time_fn
+
+
+def annotate_modules(net):
+    # record_function range around the forward of every module
+    def pre_hook(module, inputs):
+        module._profile_range = record_function('module::%s' % module._profile_name)
+        module._profile_range.__enter__()
+
+    def hook(module, inputs, output):
+        module._profile_range.__exit__(None, None, None)
+
+    for name, module in net.named_modules():
+        module._profile_name = name or type(module).__name__
+        module.register_forward_pre_hook(pre_hook)
+        module.register_forward_hook(hook)
+
+
+def dim_order(dims, strides):
+    # order of the non-trivial dims from outermost to innermost
+    return tuple(sorted([i for i in range(len(dims)) if dims[i] > 1], key=lambda i: -strides[i]))
+
+
+def classify_copies(trace_path):
+    """
+    (layout conversions, dense copies): Counters of (innermost range, copied shape) -> count
+    """
+    with open(trace_path) as f:
+        events = [e for e in json.load(f)['traceEvents'] if e.get('ph') == 'X']
+    conversions, dense = Counter(), Counter()
+    for tid in set(e['tid'] for e in events):
+        stack = []
+        for e in sorted([e for e in events if e['tid'] == tid], key=lambda e: (e['ts'], -e['dur'])):
+            while stack and stack[-1]['ts'] + stack[-1]['dur'] <= e['ts']:
+                stack.pop()
+            name = e['name']
+            if name == 'aten::copy_':
+                dims = e['args'].get('Input Dims', [])
+                strides = e['args'].get('Input Strides', [])
+                # 4-d activations/weights only, no broadcasts
+                if len(dims) < 2 or dims[0] != dims[1] or len(dims[0]) != 4 or 0 in strides[1]:
+                    continue
+                scope = [s['name'] for s in stack if s['name'].startswith(('module::', 'autograd::engine'))]
+                key = (scope[-1].split(': ')[-1].replace('module::', '') if scope else '-', str(dims[0]))
+                if dim_order(dims[0], strides[0]) != dim_order(dims[1], strides[1]):
+                    conversions[key] += 1
+                else:
+                    dense[key] += 1
+            stack.append(e)
+    return conversions, dense
+
+
+def profile_copies(fn, tmp_dir, name):
+    fn()
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+        fn()
+    path = os.path.join(tmp_dir, '%s.json' % name)
+    prof.export_chrome_trace(path)
+    return classify_copies(path)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=2, type=int)
+    parser.add_argument('--iters', default=5, type=int)
+    parser.add_argument('--top', default=5, type=int, help='copy sites listed per mode')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    state_dict = ELGCNet().state_dict()
+    shape = (args.batch_size, 3, args.img_size, args.img_size)
+    x1, x2 = torch.randn(shape), torch.randn(shape)
+    gt = torch.randint(0, 2, (args.batch_size, args.img_size, args.img_size))
+
+    print('input %s, cpu' % list(shape))
+    print('%-14s %-10s %12s %10s %12s %12s' % ('format', 'pass', 'latency (ms)', 'speedup', 'conversions',
+                                             'dense copies'))
+    base = {}
+    sites = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for channels_last in [False, True]:
+            fmt = 'channels_last' if channels_last else 'nchw'
+            net = ELGCNet(channels_last=channels_last)
+            net.load_state_dict(state_dict)
+            annotate_modules(net)
+
+            def infer():
+                with torch.no_grad():
+                    net(x1, x2)
+
+            def train_step():
+                net.zero_grad(set_to_none=False)
+                F.cross_entropy(net(x1, x2)[-1], gt).backward()
+
+            for name, fn, mode in [('inference', infer, net.eval), ('train', train_step, net.train)]:
+                mode()
+                latency = float(np.median(time_fn(fn, warmup=1, iters=args.iters)))
+                base.setdefault(name, latency)
+                conversions, dense = profile_copies(fn, tmp_dir, '%s_%s' % (fmt, name))
+                print('%-14s %-10s %12.1f %9.2fx %12d %12d' % (fmt, name, 1000 * latency, base[name] / latency,
+                                                            sum(conversions.values()), sum(dense.values())))
+                sites.append((fmt, name, conversions, dense))
+
+    for fmt, name, conversions, dense in sites:
+        for kind, counter in [('conversion', conversions), ('dense copy', dense)]:
+            for (scope, dims), n in counter.most_common(args.top):
+                print('  %s %s %s: %dx %s in %s' % (fmt, name, kind, n, dims, scope))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Per-batch inference latency of ELGCNet: eager vs torch.compile vs frozen TorchScript,
+plus the setup time of the compiled paths with a cold and a warm artifact cache.
+Every run is a fresh process; the cold and warm runs of a mode share the cache dir of models.compile.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+
+import numpy as np
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from models.compile import CompiledForward
+from misc.benchmark_tool import time_fn
+
+
+def measure(mode, shape, cache_dir, iters, device):
+    torch.manual_seed(0)
+    net = ELGCNet().to(device).eval()
+    x1 = torch.randn(shape, device=device)
+    x2 = torch.randn(shape, device=device)
+    with torch.no_grad():
+        ref = net(x1, x2)[-1]
+        start = time.perf_counter()
+        forward = CompiledForward(net, shape, mode=mode, cache_dir=cache_dir, device=device)
+        out = forward(x1, x2)[-1]
+        forward(x1, x2)
+        setup = time.perf_counter() - start
+        times = time_fn(lambda: forward(x1, x2), warmup=1, iters=iters, device=device)
+    return {'setup': setup, 'latency': float(np.median(times)), 'cache_hit': forward.cache_hit,
+            'mode': forward.mode, 'diff': (out - ref).abs().max().item()}
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--iters', default=10, type=int)
+    parser.add_argument('--modes', default='off,script,compile', type=str)
+    parser.add_argument('--device', default='cpu', type=str)
+    parser.add_argument('--_measure', default=None, type=str, help=SUPPRESS)
+    parser.add_argument('--_cache_dir', default=None, type=str, help=SUPPRESS)
+    args = parser.parse_args()
+    shape = (args.batch_size, 3, args.img_size, args.img_size)
+
+    if args._measure is not None:
+        print(json.dumps(measure(args._measure, shape, args._cache_dir, args.iters, args.device)))
+        return
+
+    print('input %s, %s' % (list(shape), args.device))
+    print('%-8s %-6s %12s %14s %10s %10s' % ('mode', 'cache', 'setup (s)', 'latency (ms)', 'speedup',
+                                             'max diff'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base = None
+        for mode in args.modes.split(','):
+            for run in range(1 if mode == 'off' else 2):
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--device', args.device,
+                                      '--img_size', str(args.img_size), '--batch_size', str(args.batch_size),
+                                      '--iters', str(args.iters), '--_measure', mode,
+                                      '--_cache_dir', os.path.join(tmp_dir, 'cache')],
+                                     check=True, capture_output=True, text=True).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                base = r['latency'] if base is None else base
+                cache = '-' if mode == 'off' else 'warm' if r['cache_hit'] else 'cold'
+                name = mode if r['mode'] == mode else '%s->%s' % (mode, r['mode'])
+                print('%-8s %-6s %12.1f %14.1f %9.2fx %10.1e' % (name, cache, r['setup'], 1000 * r['latency'],
+                                                              base / r['latency'], r['diff']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Peak memory of the decoder with and without low_memory fusion at several input sizes.
+Every measurement runs in a fresh process: on CUDA the peak comes from max_memory_allocated,
+on CPU (Linux) from the peak resident set size (VmHWM, reset before the measured call) with
+large allocations served by mmap so that freed tensors leave the resident set.
+"""
+import os
+import sys
+import json
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from misc.benchmark_tool import measure_peak_memory
+
+
+def get_features(net, img_size, batch_size, device):
+    # encoder output shapes of an img_size input: 1/4 ... 1/32 scale
+    return [torch.randn(batch_size, c, img_size // s, img_size // s, device=device)
+            for c, s in zip(net.embed_dims, [4, 8, 16, 32])]
+
+
+def measure(low_memory, img_size, batch_size, train, device):
+    torch.manual_seed(0)
+    net = ELGCNet(low_memory_decoder=low_memory).to(device)
+    net.train(train)
+    f1 = get_features(net, img_size, batch_size, device)
+    f2 = get_features(net, img_size, batch_size, device)
+    if train:
+        for f in f1 + f2:
+            f.requires_grad_(True)
+
+    def step():
+        with torch.set_grad_enabled(train):
+            out = net.dec(f1, f2)[-1]
+            if train:
+                out.mean().backward()
+
+    return measure_peak_memory(step, device)
+
+
+def check_numerics(device):
+    torch.manual_seed(0)
+    net = ELGCNet().to(device).eval()
+    low = ELGCNet(low_memory_decoder=True).to(device).eval()
+    low.load_state_dict(net.state_dict())
+    f1 = get_features(net, 256, 2, device)
+    f2 = get_features(net, 256, 2, device)
+    with torch.no_grad():
+        ref, out = net.dec(f1, f2)[-1], low.dec(f1, f2)[-1]
+    return (ref - out).abs().max().item(), ref.abs().max().item()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--sizes', default='256,512,1024', type=str)
+    parser.add_argument('--train_sizes', default='256,512', type=str,
+                        help='sizes measured with a backward pass (more memory)')
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument('--_measure', default=None, type=str, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args._measure is not None:
+        low_memory, img_size, train = json.loads(args._measure)
+        print(json.dumps(measure(low_memory, img_size, args.batch_size, train, args.device)))
+        return
+
+    diff, scale = check_numerics(args.device)
+    print('low_memory vs concat: max abs. diff %.2e (output max %.2e)' % (diff, scale))
+
+    print('%-10s %6s %14s %14s %10s' % ('mode', 'size', 'concat (MB)', 'low_mem (MB)', 'reduction'))
+    for train, sizes in [(False, args.sizes), (True, args.train_sizes)]:
+        for img_size in [int(s) for s in sizes.split(',') if s]:
+            peaks = []
+            for low_memory in [False, True]:
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--device', args.device,
+                                      '--batch_size', str(args.batch_size),
+                                      '--_measure', json.dumps([low_memory, img_size, train])],
+                                     env=dict(os.environ, MALLOC_MMAP_THRESHOLD_='65536'),
+                                     check=True, capture_output=True, text=True).stdout
+                peaks.append(json.loads(out.strip().splitlines()[-1]))
+            print('%-10s %6d %14.1f %14.1f %9.1f%%' % ('train' if train else 'inference', img_size,
+                                                        peaks[0], peaks[1], 100 * (1 - peaks[1] / peaks[0])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Throughput and latency of ChangeDetector under concurrent callers, with and without dynamic batching.
+Also checks that batched results match single-pair forward passes and that the asyncio API works.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from models.export import export_weights
+from models.detector import ChangeDetector
+
+
+def run_clients(detector, pairs, num_clients):
+    def client(i):
+        return [detector.predict(*pairs[j]) for j in range(i, len(pairs), num_clients)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(num_clients) as pool:
+        list(pool.map(client, range(num_clients)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--requests', default=64, type=int)
+    parser.add_argument('--clients', default='1,4,16', type=str)
+    parser.add_argument('--max_batch_size', default=8, type=int)
+    parser.add_argument('--max_wait_ms', default=5.0, type=float)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    s = args.img_size
+    pairs = [(rng.randint(0, 256, (s, s, 3), dtype=np.uint8),
+              rng.randint(0, 256, (s, s, 3), dtype=np.uint8)) for _ in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        net = ELGCNet()
+        weights = export_weights(net.state_dict(), net.get_config(), os.path.join(tmp_dir, 'net_G.weights'))
+
+        with ChangeDetector(weights, device=args.device, max_batch_size=args.max_batch_size,
+                            max_wait_ms=args.max_wait_ms) as detector:
+            # batched results vs one forward pass per pair
+            futures = [detector.submit(*p, return_prob=True) for p in pairs[:args.max_batch_size]]
+            batched = [f.result() for f in futures]
+            single = [detector.predict(*p, return_prob=True) for p in pairs[:args.max_batch_size]]
+            diff = max(np.abs(a - b).max() for a, b in zip(batched, single))
+            print('batched vs single max abs. diff of the change probability: %.2e' % diff)
+
+            async def run_async():
+                return await asyncio.gather(*[detector.predict_async(*p) for p in pairs[:4]])
+            maps = asyncio.run(run_async())
+            print('asyncio: %d change maps of shape %s' % (len(maps), maps[0].shape))
+
+        print('%-10s %8s %10s %10s %10s %12s' % ('batching', 'clients', 'req/s', 'p50 (ms)', 'p99 (ms)',
+                                                  'mean batch'))
+        for max_batch_size in [1, args.max_batch_size]:
+            for num_clients in [int(c) for c in args.clients.split(',')]:
+                with ChangeDetector(weights, device=args.device, max_batch_size=max_batch_size,
+                                    max_wait_ms=args.max_wait_ms) as detector:
+                    run_clients(detector, pairs[:num_clients], num_clients)  # warmup
+                    detector.reset_metrics()
+                    elapsed = run_clients(detector, pairs, num_clients)
+                    metrics = detector.get_metrics()
+                print('%-10s %8d %10.1f %10.2f %10.2f %12.2f' % (
+                    'off' if max_batch_size == 1 else 'max %d' % max_batch_size, num_clients,
+                    args.requests / elapsed, metrics['latency_p50_ms'], metrics['latency_p99_ms'],
+                    metrics['mean_batch_size']))
+        print('batch size histogram of the last run: %s' % metrics['batch_size_hist'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Teacher vs distilled students side by side: params, FLOPs, CPU latency and mF1 on a dataset split.
+Models are training checkpoints or exported weights; their architecture is read from the file.
+e.g. python benchmarks/bench_distill.py --models checkpoints/elgcnet_levir/best_ckpt.pt,checkpoints/tiny_kd/best_ckpt.pt
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import utils
+from models.export import load_model
+from misc.metric_tool import TorchConfuseMatrixMeter
+from misc.benchmark_tool import time_fn
+
+
+def evaluate(net, dataloader, max_batches=None):
+    running_metric = TorchConfuseMatrixMeter(n_class=2)
+    with torch.no_grad():
+        for i, batch in enumerate(dataloader):
+            if max_batches is not None and i >= max_batches:
+                break
+            pred = net(batch['A'], batch['B'])[-1]
+            running_metric.update_cm(pr=torch.argmax(pred, dim=1), gt=batch['L'])
+    return running_metric.get_scores()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--models', required=True, type=str,
+                        help='comma separated checkpoints or exported weights, the first one is the teacher')
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--dataset', default='CDDataset', type=str)
+    parser.add_argument('--split', default='test', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--max_batches', default=None, type=int, help='evaluate on the first batches only')
+    parser.add_argument('--iters', default=10, type=int)
+    args = parser.parse_args()
+
+    dataloader = utils.get_loader(args.data_name, img_size=args.img_size, batch_size=args.batch_size,
+                                  is_train=False, split=args.split, dataset=args.dataset)
+    x = torch.randn(1, 3, args.img_size, args.img_size)
+
+    rows = []
+    for path in args.models.split(','):
+        net = load_model(path)
+        params = sum(p.numel() for p in net.parameters())
+        with torch.no_grad():
+            counter = FlopCounterMode(display=False)
+            with counter:
+                net(x, x)
+            latency = float(np.median(time_fn(lambda: net(x, x), warmup=2, iters=args.iters)))
+        scores = evaluate(net, dataloader, args.max_batches)
+        rows.append((path, params, counter.get_total_flops(), latency, scores))
+
+    print('%s split of %s, latency of 1x3x%dx%d on cpu (%d threads)' % (args.split, args.data_name, args.img_size,
+                                                                       args.img_size, torch.get_num_threads()))
+    print('%-40s %10s %8s %12s %9s %9s %9s %9s' % ('model', 'params (M)', 'GFLOPs', 'latency (ms)', 'speedup',
+                                                   'mF1', 'F1_1', 'mIoU'))
+    for path, params, flops, latency, scores in rows:
+        print('%-40s %10.2f %8.2f %12.1f %8.2fx %9.5f %9.5f %9.5f' % (
+            path[-40:], params / 1e6, flops / 1e9, 1000 * latency, rows[0][3] / latency, scores['mf1'],
+            scores['F1_1'], scores['miou']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Numerical equivalence and latency of ELGCNet before and after fuse_for_inference
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from models.fuse import fuse_for_inference
+from misc.benchmark_tool import time_fn, format_latency
+
+
+def count_params(net):
+    return sum(p.numel() for p in net.parameters())
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=4, type=int)
+    parser.add_argument('--iters', default=10, type=int)
+    parser.add_argument('--atol', default=1e-4, type=float)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = ELGCNet().to(args.device).eval()
+    # non-trivial BatchNorm statistics, a freshly initialized BN is an identity map
+    bn = net.dec.linear_fuse[1]
+    with torch.no_grad():
+        bn.running_mean.normal_(0, 0.1)
+        bn.running_var.uniform_(0.5, 2.0)
+        bn.weight.normal_(1, 0.1)
+        bn.bias.normal_(0, 0.1)
+    fused = fuse_for_inference(net)
+
+    ok = True
+    for stack_siamese in [False, True]:
+        net.stack_siamese = fused.stack_siamese = stack_siamese
+        for s in [args.img_size // 2, args.img_size]:
+            x1 = torch.randn(2, 3, s, s, device=args.device)
+            x2 = torch.randn(2, 3, s, s, device=args.device)
+            with torch.no_grad():
+                ref = net(x1, x2)[-1]
+                out = fused(x1, x2)[-1]
+            diff = (ref - out).abs().max().item()
+            agree = (ref.argmax(dim=1) == out.argmax(dim=1)).float().mean().item()
+            ok = ok and diff <= args.atol * max(1.0, ref.abs().max().item())
+            print('stack_siamese=%d %4dpx: max abs. diff %.2e, label agreement %.5f'
+                  % (stack_siamese, s, diff, agree))
+    net.stack_siamese = fused.stack_siamese = False
+
+    print('parameters: %d -> %d' % (count_params(net), count_params(fused)))
+    x1 = torch.randn(args.batch_size, 3, args.img_size, args.img_size, device=args.device)
+    x2 = torch.randn(args.batch_size, 3, args.img_size, args.img_size, device=args.device)
+    with torch.no_grad():
+        f1, f2 = net.enc(x1), net.enc(x2)
+    for name, model in [('original', net), ('fused', fused)]:
+        with torch.no_grad():
+            times = time_fn(lambda: model(x1, x2), iters=args.iters, device=args.device)
+            dec_times = time_fn(lambda: model.dec(f1, f2), iters=args.iters, device=args.device)
+        print('%-8s full model %s' % (name, format_latency(times)))
+        print('%-8s decoder    %s' % (name, format_latency(dec_times)))
+
+    print('equivalence: %s' % ('OK' if ok else 'FAILED'))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
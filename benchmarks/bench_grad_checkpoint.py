@@ -0,0 +1,79 @@
+"""
+Peak memory and step time of a training step (forward + backward) with activation checkpointing
+of the encoder stages. Every setting runs in a fresh process (see misc.benchmark_tool.measure_peak_memory).
+"""
+import os
+import sys
+import json
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from misc.benchmark_tool import measure_peak_memory, time_fn
+
+# (name, checkpoint_stages, checkpoint_every)
+SETTINGS = [
+    ('off', (), 1),
+    ('stage 1', (1,), 1),
+    ('stages 1,2', (1, 2), 1),
+    ('all', (1, 2, 3, 4), 1),
+    ('all, every 2', (1, 2, 3, 4), 2),
+]
+
+
+def measure(stages, every, img_size, batch_size, iters, device):
+    torch.manual_seed(0)
+    net = ELGCNet(checkpoint_stages=stages, checkpoint_every=every).to(device).train()
+    x1 = torch.randn(batch_size, 3, img_size, img_size, device=device)
+    x2 = torch.randn(batch_size, 3, img_size, img_size, device=device)
+    gt = torch.randint(0, 2, (batch_size, img_size, img_size), device=device)
+
+    def step():
+        net.zero_grad(set_to_none=False)
+        F.cross_entropy(net(x1, x2)[-1], gt).backward()
+
+    # gradient buffers are allocated by a first step, the peak then measures activations
+    step()
+    peak = measure_peak_memory(step, device)
+    times = time_fn(step, warmup=0, iters=iters, device=device)
+    return peak, float(np.median(times))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=2, type=int)
+    parser.add_argument('--iters', default=3, type=int)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument('--_measure', default=None, type=int, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args._measure is not None:
+        _, stages, every = SETTINGS[args._measure]
+        print(json.dumps(measure(stages, every, args.img_size, args.batch_size, args.iters, args.device)))
+        return
+
+    print('img_size %d, batch_size %d, %s' % (args.img_size, args.batch_size, args.device))
+    print('%-14s %12s %10s %14s %10s' % ('checkpointing', 'peak (MB)', 'memory', 'step (ms)', 'overhead'))
+    base = None
+    for i, (name, _, _) in enumerate(SETTINGS):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--device', args.device,
+                              '--img_size', str(args.img_size), '--batch_size', str(args.batch_size),
+                              '--iters', str(args.iters), '--_measure', str(i)],
+                             env=dict(os.environ, MALLOC_MMAP_THRESHOLD_='65536'),
+                             check=True, capture_output=True, text=True).stdout
+        peak, step_time = json.loads(out.strip().splitlines()[-1])
+        base = (peak, step_time) if base is None else base
+        print('%-14s %12.1f %9.1f%% %14.1f %9.1f%%' % (name, peak, 100 * peak / base[0], 1000 * step_time,
+                                                       100 * (step_time / base[1] - 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Cold-start time of the evaluation model: full training checkpoint vs exported inference weights
+"""
+import os
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from models.export import export_weights, load_exported
+
+
+def load_checkpoint(path):
+    net = ELGCNet()
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+    net.load_state_dict(checkpoint['model_G_state_dict'])
+    return net.eval()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--checkpoint', default=None, type=str,
+                        help='training checkpoint (a randomly initialized one is written if omitted)')
+    parser.add_argument('--repeats', default=5, type=int)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint = args.checkpoint
+        if checkpoint is None:
+            net = ELGCNet()
+            optimizer = torch.optim.AdamW(net.parameters())
+            net(torch.randn(1, 3, 64, 64), torch.randn(1, 3, 64, 64))[-1].mean().backward()
+            optimizer.step()
+            checkpoint = os.path.join(tmp_dir, 'last_ckpt.pt')
+            torch.save({'model_G_state_dict': net.state_dict(),
+                        'optimizer_G_state_dict': optimizer.state_dict()}, checkpoint)
+        net = load_checkpoint(checkpoint)
+
+        paths = {'checkpoint': checkpoint}
+        for dtype in ['fp32', 'fp16', 'bf16']:
+            paths[dtype] = export_weights(net.state_dict(), net.get_config(),
+                                          os.path.join(tmp_dir, 'net_G_%s.weights' % dtype), dtype=dtype)
+
+        x = torch.randn(1, 3, 256, 256)
+        with torch.no_grad():
+            reference = net(x, x)[-1]
+        for name, path in paths.items():
+            times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                model = load_checkpoint(path) if name == 'checkpoint' else load_exported(path)[0]
+                times.append(time.perf_counter() - start)
+            with torch.no_grad():
+                diff = (model(x, x)[-1] - reference).abs().max().item()
+            print('%-10s size: %7.2f MB, load: %7.1f ms (min %7.1f ms), max abs diff: %.2e' %
+                  (name, os.path.getsize(path) / 2**20, 1000 * sum(times) / len(times),
+                   1000 * min(times), diff))
+
+
+if __name__ == '__main__':
+    main()
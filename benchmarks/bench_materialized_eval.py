@@ -0,0 +1,74 @@
+"""
+Validation epoch wall time with the DataLoader of CDDataset (decode + evaluation transform every epoch) vs
+a materialized split (datasets.materialized_dataset, uint8 or float) read in contiguous batches, split into
+data time (waiting for the next batch) and model time (ELGCNet forward).
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+from datasets.materialized_dataset import get_materialized_loader
+from models.elgcnet import ELGCNet
+from models.networks import ARCH_PRESETS
+
+
+def run_epoch(loader, net):
+    data_time, model_time = 0.0, 0.0
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in loader:
+            t = time.perf_counter()
+            data_time += t - start
+            if net is not None:
+                net(batch['A'], batch['B'])
+            start = time.perf_counter()
+            model_time += start - t
+    return data_time, model_time
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='val', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--num_workers', default=4, type=int)
+    parser.add_argument('--epochs', default=2, type=int)
+    parser.add_argument('--arch', default='tiny', type=str, help='model preset, none: data only')
+    args = parser.parse_args()
+
+    config = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = config.root_dir if args.root_dir is None else args.root_dir
+    data_set = CDDataset(root_dir=root_dir, split=args.split, img_size=args.img_size, is_train=False,
+                         label_transform=config.label_transform)
+    net = None if args.arch == 'none' else ELGCNet(**ARCH_PRESETS[args.arch]).eval()
+
+    loaders = [('dataloader (%d workers)' % args.num_workers,
+                torch.utils.data.DataLoader(data_set, batch_size=args.batch_size, num_workers=args.num_workers))]
+    for fmt in ['uint8', 'float']:
+        start = time.perf_counter()
+        loader = get_materialized_loader(data_set, args.batch_size, fmt=fmt, num_workers=args.num_workers)
+        loaders.append(('materialized %s (%.1f s once)' % (fmt, time.perf_counter() - start), loader))
+
+    print('%s split of %s (%d samples), batch %d, model %s' % (args.split, root_dir, len(data_set), args.batch_size,
+                                                               args.arch))
+    print('%-34s %-6s %10s %10s %10s %10s' % ('loader', 'epoch', 'total (s)', 'data (s)', 'model (s)', 'data %'))
+    for name, loader in loaders:
+        for epoch in range(args.epochs):
+            data_time, model_time = run_epoch(loader, net)
+            total = data_time + model_time
+            print('%-34s %-6d %10.3f %10.3f %10.3f %9.1f%%' % (name, epoch, total, data_time, model_time,
+                                                               100 * data_time / total))
+
+
+if __name__ == '__main__':
+    main()
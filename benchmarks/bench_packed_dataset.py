@@ -0,0 +1,59 @@
+"""
+Compare the read throughput (samples/s) of the PNG CDDataset and the packed PackedCDDataset
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from torch.utils.data import DataLoader
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+from datasets.packed_dataset import PackedCDDataset, pack_split, get_packed_dir
+
+
+def measure(data_set, num_workers, batch_size, max_samples):
+    loader = DataLoader(data_set, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    n = 0
+    start = time.perf_counter()
+    for batch in loader:
+        n += batch['A'].shape[0]
+        if n >= max_samples:
+            break
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--num_workers', default='0,4,8', type=str)
+    parser.add_argument('--max_samples', default=2048, type=int)
+    parser.add_argument('--is_train', action='store_true', help='include the training augmentation')
+    args = parser.parse_args()
+
+    dataConfig = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = dataConfig.root_dir if args.root_dir is None else args.root_dir
+    if not os.path.exists(os.path.join(get_packed_dir(root_dir, args.split), 'index.npy')):
+        pack_split(root_dir, args.split)
+
+    kwargs = dict(root_dir=root_dir, img_size=args.img_size, split=args.split, is_train=args.is_train,
+                  label_transform=dataConfig.label_transform)
+    data_sets = {'png': CDDataset(**kwargs), 'packed': PackedCDDataset(**kwargs)}
+
+    print('split: %s, is_train: %s, batch_size: %d' % (args.split, args.is_train, args.batch_size))
+    for num_workers in [int(n) for n in args.num_workers.split(',')]:
+        rates = {k: measure(v, num_workers, args.batch_size, args.max_samples) for k, v in data_sets.items()}
+        print('num_workers: %d, png: %.1f samples/s, packed: %.1f samples/s, speedup: %.2fx' %
+              (num_workers, rates['png'], rates['packed'], rates['packed'] / rates['png']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Data wait per training step (time blocked on the next batch) of the CDDataset DataLoader as built by
+utils.get_loaders: plain, with persistent workers, and wrapped in the PrefetchLoader (K batches staged on
+the device by a background thread). The step is a forward + backward of an ELGCNet preset.
+Also reports the wait for the first batch of every epoch (worker start-up without persistent workers).
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+from datasets.prefetch_loader import PrefetchLoader
+from models.elgcnet import ELGCNet
+from models.networks import ARCH_PRESETS
+
+
+def run_epoch(loader, net, optimizer, device):
+    waits = []
+    start = time.perf_counter()
+    for batch in loader:
+        waits.append(time.perf_counter() - start)
+        pred = net(batch['A'].to(device), batch['B'].to(device))[-1]
+        loss = F.cross_entropy(pred, batch['L'].to(device).long().squeeze(1))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+    return waits
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--num_workers', default=4, type=int)
+    parser.add_argument('--prefetch_batches', default=3, type=int)
+    parser.add_argument('--epochs', default=2, type=int)
+    parser.add_argument('--max_steps', default=None, type=int, help='steps per epoch (default: the whole split)')
+    parser.add_argument('--arch', default='tiny', type=str)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    args = parser.parse_args()
+
+    config = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = config.root_dir if args.root_dir is None else args.root_dir
+    device = torch.device(args.device)
+    data_set = CDDataset(root_dir=root_dir, split=args.split, img_size=args.img_size, is_train=True,
+                         label_transform=config.label_transform)
+    if args.max_steps is not None:
+        data_set = torch.utils.data.Subset(data_set, range(min(len(data_set), args.max_steps * args.batch_size)))
+    pin = device.type == 'cuda'
+
+    def loader(persistent):
+        kwargs = {'persistent_workers': persistent} if args.num_workers > 0 else {}
+        return DataLoader(data_set, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                          pin_memory=pin, **kwargs)
+
+    variants = [('dataloader', loader(False)), ('persistent workers', loader(True)),
+                ('persistent + prefetch K=%d' % args.prefetch_batches,
+                 PrefetchLoader(loader(True), device, num_prefetch=args.prefetch_batches))]
+
+    print('%s split of %s, batch %d, %d workers, %s, model %s' % (args.split, root_dir, args.batch_size,
+                                                                 args.num_workers, device, args.arch))
+    print('%-28s %-6s %14s %18s %14s' % ('loader', 'epoch', 'first batch (ms)', 'wait/step (ms)', 'wait %'))
+    for name, dataloader in variants:
+        torch.manual_seed(0)
+        net = ELGCNet(**ARCH_PRESETS[args.arch]).to(device).train()
+        optimizer = torch.optim.AdamW(net.parameters(), lr=1e-4)
+        for epoch in range(args.epochs):
+            start = time.perf_counter()
+            waits = run_epoch(dataloader, net, optimizer, device)
+            total = time.perf_counter() - start
+            print('%-28s %-6d %14.1f %18.1f %13.1f%%' % (name, epoch, 1000 * waits[0],
+                                                        1000 * sum(waits[1:]) / max(len(waits) - 1, 1),
+                                                        100 * sum(waits) / total))
+
+
+if __name__ == '__main__':
+    main()
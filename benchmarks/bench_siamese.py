@@ -0,0 +1,52 @@
+"""
+Compare the two-pass and the stacked single-pass Siamese encoding of ELGCNet
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from models.elgcnet import ELGCNet
+from misc.benchmark_tool import time_fn, format_latency
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--iters', default=10, type=int)
+    parser.add_argument('--threads', default=0, type=int, help='torch intra-op threads (0: default)')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+    model = ELGCNet().eval()
+    x1 = torch.randn(args.batch_size, 3, args.img_size, args.img_size)
+    x2 = torch.randn(args.batch_size, 3, args.img_size, args.img_size)
+
+    results = {}
+    outputs = {}
+    with torch.no_grad():
+        for stack in [False, True]:
+            model.stack_siamese = stack
+            outputs[stack] = model(x1, x2)[-1]
+            results[stack] = time_fn(lambda: model(x1, x2), iters=args.iters)
+
+    print('batch_size: %d, img_size: %d, threads: %d' %
+          (args.batch_size, args.img_size, torch.get_num_threads()))
+    print('two-pass     %s' % format_latency(results[False]))
+    print('single-pass  %s' % format_latency(results[True]))
+    print('speedup: %.2fx' % (results[False].mean() / results[True].mean()))
+    print('bit-identical change maps: %s (max abs diff %.3e)' %
+          (torch.equal(outputs[False], outputs[True]),
+           (outputs[False] - outputs[True]).abs().max().item()))
+
+
+if __name__ == '__main__':
+    main()
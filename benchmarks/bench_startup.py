@@ -0,0 +1,65 @@
+"""
+Startup-time guard: time the import of the inference and training entry points in fresh
+interpreters and check that the inference path does not import training/visualization packages.
+Exits with status 1 if the import budget or the dependency guard is violated.
+"""
+import os
+import sys
+import json
+import subprocess
+from argparse import ArgumentParser
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# packages that must not be imported by the inference entry point
+FORBIDDEN = ['cv2', 'matplotlib', 'tqdm', 'scipy', 'timm', 'torchvision', 'sklearn']
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'modules': sorted(m.split('.')[0] for m in sys.modules)}))
+'''
+
+
+def probe(module, base=None):
+    code = PROBE % module
+    if base is not None:
+        # exclude the time spent importing a shared base module (e.g. torch)
+        code = 'import %s\n' % base + code
+    out = subprocess.run([sys.executable, '-c', code], cwd=project_root, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--budget', default=0.5, type=float,
+                        help='max seconds to import predict on top of torch')
+    parser.add_argument('--repeats', default=3, type=int)
+    args = parser.parse_args()
+
+    ok = True
+    # some torch builds import e.g. tqdm themselves, only packages added on top of torch count
+    torch_modules = set(probe('torch')['modules'])
+    for module in ['torch', 'predict', 'models.trainer', 'models.evaluator']:
+        base = None if module == 'torch' else 'torch'
+        results = [probe(module, base) for _ in range(args.repeats)]
+        seconds = min(r['seconds'] for r in results)
+        extra = '' if base is None else ' (on top of torch)'
+        print('import %-18s %7.1f ms%s' % (module, 1000 * seconds, extra))
+        if module == 'predict':
+            loaded = sorted((set(FORBIDDEN) & set(results[0]['modules'])) - torch_modules)
+            if loaded:
+                print('  FAIL: predict imports %s' % ', '.join(loaded))
+                ok = False
+            if seconds > args.budget:
+                print('  FAIL: predict import exceeds the %.2fs budget' % args.budget)
+                ok = False
+    print('import budget: %s' % ('OK' if ok else 'VIOLATED'))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
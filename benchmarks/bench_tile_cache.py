@@ -0,0 +1,64 @@
+"""
+Read throughput (samples/s) of CDDataset over several epochs without and with the shared-memory tile cache
+(datasets.tile_cache), and its hit/miss counters over all DataLoader workers.
+With a budget smaller than the split, LRU eviction keeps the most recently read tiles.
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from torch.utils.data import DataLoader
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='val', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--num_workers', default=4, type=int)
+    parser.add_argument('--epochs', default=3, type=int)
+    parser.add_argument('--cache_mb', default='0,64,1024', type=str, help='comma separated budgets (0: no cache)')
+    parser.add_argument('--is_train', action='store_true', help='include the training augmentation')
+    args = parser.parse_args()
+
+    config = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = config.root_dir if args.root_dir is None else args.root_dir
+
+    print('%s split of %s, %d workers' % (args.split, root_dir, args.num_workers))
+    print('%-10s %-6s %14s %8s %8s %10s %8s' % ('cache (MB)', 'epoch', 'samples/s', 'hits', 'misses', 'evictions',
+                                              'cached'))
+    for cache_mb in [float(x) for x in args.cache_mb.split(',')]:
+        data_set = CDDataset(root_dir=root_dir, split=args.split, img_size=args.img_size, is_train=args.is_train,
+                             label_transform=config.label_transform, cache_bytes=int(cache_mb * 2 ** 20))
+        loader = DataLoader(data_set, batch_size=args.batch_size, shuffle=args.is_train,
+                            num_workers=args.num_workers)
+        last = {'hits': 0, 'misses': 0, 'evictions': 0}
+        for epoch in range(args.epochs):
+            n = 0
+            start = time.perf_counter()
+            for batch in loader:
+                n += batch['A'].shape[0]
+            rate = n / (time.perf_counter() - start)
+            if data_set.cache is None:
+                print('%-10g %-6d %14.1f %8s %8s %10s %8s' % (cache_mb, epoch, rate, '-', '-', '-', '-'))
+                continue
+            stats = data_set.cache.stats()
+            print('%-10g %-6d %14.1f %8d %8d %10d %8d' % (
+                cache_mb, epoch, rate, stats['hits'] - last['hits'], stats['misses'] - last['misses'],
+                stats['evictions'] - last['evictions'], stats['cached']))
+            last = stats
+        if data_set.cache is not None:
+            data_set.cache.close()
+
+
+if __name__ == '__main__':
+    main()
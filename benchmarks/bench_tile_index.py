@@ -0,0 +1,66 @@
+"""
+Startup cost of the class occurrences of a split: two passes of the augmented training DataLoader
+(models.losses.count_classes, the former get_alpha) vs building the tile index serially, with a process
+pool, and loading it back. Also checks that the class counts of the index match a pass over the
+non-augmented samples (img_size must be the native tile size for that check).
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from torch.utils.data import DataLoader
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+from datasets.tile_index import build_tile_index, load_tile_index
+from models.losses import count_classes
+
+
+def timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--loader_workers', default=4, type=int, help='DataLoader workers of the loader passes')
+    parser.add_argument('--num_workers', default=None, type=int, help='indexing processes (default: cpu count)')
+    args = parser.parse_args()
+
+    config = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = config.root_dir if args.root_dir is None else args.root_dir
+
+    def loader(is_train):
+        data_set = CDDataset(root_dir=root_dir, split=args.split, img_size=args.img_size, is_train=is_train,
+                             label_transform=config.label_transform)
+        return DataLoader(data_set, batch_size=args.batch_size, shuffle=is_train, num_workers=args.loader_workers)
+
+    _, t_loader = timed(lambda: count_classes(loader(True)))
+    _, t_serial = timed(lambda: build_tile_index(root_dir, args.split, num_workers=0))
+    index, t_pool = timed(lambda: build_tile_index(root_dir, args.split, num_workers=args.num_workers))
+    _, t_load = timed(lambda: load_tile_index(root_dir, args.split, build=False))
+
+    print('%s split of %s (%d tiles, %d cpus)' % (args.split, root_dir, len(index), os.cpu_count()))
+    print('%-36s %10s %10s' % ('class counts from', 'time (s)', 'speedup'))
+    for name, t in [('augmented loader, 2 passes', t_loader), ('tile index, serial build', t_serial),
+                    ('tile index, pool build', t_pool), ('tile index, load', t_load)]:
+        print('%-36s %10.3f %9.1fx' % (name, t, t_loader / t))
+
+    counts = index.class_counts(config.label_transform)
+    expected = count_classes(loader(False))
+    print('class counts: index %s, non-augmented loader %s, %s' % (counts, expected,
+                                                                   'match' if counts == expected else 'MISMATCH'))
+
+
+if __name__ == '__main__':
+    main()
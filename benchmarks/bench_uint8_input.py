@@ -0,0 +1,96 @@
+"""
+uint8 inputs end to end (--uint8_input): the loaders yield unnormalized uint8 A/B and ELGCNet folds the
+input normalization into its first convolution (OverlapPatchEmbed._proj_raw).
+  parity:  logits of the same weights on normalized float inputs vs the raw uint8 inputs (NCHW and channels_last)
+  loader:  bytes per collated batch, DataLoader throughput (worker -> main process IPC) and host to device
+           copy time of float vs uint8 samples of a CDDataset split
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import torch
+from torch.utils.data import DataLoader
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import data_config
+from datasets.CD_dataset import CDDataset
+from datasets.materialized_dataset import normalize_uint8
+from models.elgcnet import ELGCNet
+from models.networks import ARCH_PRESETS
+
+
+def check_parity(arch, img_size, device):
+    torch.manual_seed(0)
+    x1 = torch.randint(0, 256, (2, 3, img_size, img_size), dtype=torch.uint8, device=device)
+    x2 = torch.randint(0, 256, (2, 3, img_size, img_size), dtype=torch.uint8, device=device)
+    for channels_last in [False, True]:
+        net = ELGCNet(**ARCH_PRESETS[arch], channels_last=channels_last).to(device).eval()
+        net_uint8 = ELGCNet(**ARCH_PRESETS[arch], channels_last=channels_last, uint8_input=True).to(device).eval()
+        net_uint8.load_state_dict(net.state_dict())
+        with torch.no_grad():
+            ref = net(normalize_uint8(x1), normalize_uint8(x2))[-1]
+            out = net_uint8(x1, x2)[-1]
+        print('parity %-14s max abs logit diff %.2e (logits max %.2f), same predictions %.4f%%' % (
+            'channels_last' if channels_last else 'NCHW', (out - ref).abs().max().item(), ref.abs().max().item(),
+            100 * (out.argmax(1) == ref.argmax(1)).float().mean().item()))
+
+
+def batch_nbytes(batch):
+    return sum(v.numel() * v.element_size() for v in batch.values() if torch.is_tensor(v))
+
+
+def run_loader(data_set, batch_size, num_workers, device, epochs):
+    kwargs = {'persistent_workers': True} if num_workers > 0 else {}
+    loader = DataLoader(data_set, batch_size=batch_size, shuffle=False, num_workers=num_workers,
+                        pin_memory=device.type == 'cuda', **kwargs)
+    nbytes, num_samples, load_time, copy_time = 0, 0, 0.0, 0.0
+    for _ in range(epochs):
+        start = time.perf_counter()
+        for batch in loader:
+            load_time += time.perf_counter() - start
+            nbytes = max(nbytes, batch_nbytes(batch))
+            num_samples += batch['A'].shape[0]
+            start = time.perf_counter()
+            for k in ['A', 'B', 'L']:
+                batch[k].to(device, non_blocking=True)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            copy_time += time.perf_counter() - start
+            start = time.perf_counter()
+    return nbytes, num_samples / load_time, 1000 * copy_time / max(num_samples // batch_size, 1)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='val', type=str)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--num_workers', default=4, type=int)
+    parser.add_argument('--epochs', default=2, type=int)
+    parser.add_argument('--arch', default='tiny', type=str)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    check_parity(args.arch, args.img_size, device)
+
+    config = data_config.DataConfig().get_data_config(args.data_name)
+    root_dir = config.root_dir if args.root_dir is None else args.root_dir
+    print('%s split of %s, batch %d, %d workers, %s' % (args.split, root_dir, args.batch_size,
+                                                       args.num_workers, device))
+    print('%-8s %16s %18s %18s' % ('samples', 'batch (MB)', 'loader (img/s)', 'copy/batch (ms)'))
+    for uint8 in [False, True]:
+        data_set = CDDataset(root_dir=root_dir, split=args.split, img_size=args.img_size, is_train=False,
+                             label_transform=config.label_transform, uint8=uint8)
+        nbytes, throughput, copy_ms = run_loader(data_set, args.batch_size, args.num_workers, device, args.epochs)
+        print('%-8s %16.2f %18.1f %18.2f' % ('uint8' if uint8 else 'float', nbytes / 2**20, throughput, copy_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,19 @@
 改进的数据集准备脚本 - 平衡变化样本分布
 """
 import os
+import sys
 import time
 import shutil
 import argparse
 import random
 import numpy as np
 from pathlib import Path
-from PIL import Image
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from datasets.tile_index import load_tile_index
 
 def prepare_balanced_colab_dataset(train_samples=200, val_samples=50, test_samples=50):
     """准备平衡的Colab训练数据集"""
@@ -28,29 +34,13 @@ def prepare_balanced_colab_dataset(train_samples=200, val_samples=50, test_sampl
     
     def analyze_and_select_samples(split_name, target_count):
         """分析并智能选择样本"""
-        src_list = drive_dataset_path / 'list' / f'{split_name}.txt'
-        
         print(f"\n分析 {split_name} 集...")
         
-        # 读取所有样本
-        with open(src_list, 'r') as f:
-            all_files = f.read().strip().split('\n')
-        
-        # 分析每个样本的变化比例
-        samples_with_ratio = []
-        
-        for i, filename in enumerate(all_files):
-            if i % 100 == 0:
-                print(f"  分析进度: {i}/{len(all_files)}")
-                
-            label_path = drive_dataset_path / 'label' / filename
-            if label_path.exists():
-                try:
-                    label = np.array(Image.open(label_path))
-                    change_ratio = np.sum(label > 0) / label.size * 100
-                    samples_with_ratio.append((filename, change_ratio))
-                except:
-                    continue
+        # 每个样本的变化比例来自索引 (datasets/tile_index.py), 首次运行时并行建立
+        index = load_tile_index(str(drive_dataset_path), split_name)
+        has_label = index.exists[:, 2]
+        samples_with_ratio = list(zip(index.names[has_label].tolist(),
+                                      (index.change_ratio[has_label] * 100).tolist()))
         
         print(f"  成功分析 {len(samples_with_ratio)} 个样本")
         
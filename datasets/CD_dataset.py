@@ -51,8 +51,11 @@ class ImageDataset(data.Dataset):
     """
     Base Dataset Class
     root_dir: folder path of the dataset
+    augm_backend: pil (per-sample augmentation in __getitem__) | tensor (uint8 samples, augmented per batch)
+    uint8: samples are unnormalized uint8 tensors (for ELGCNet(uint8_input=True), 1/4 of the float bytes)
     """
-    def __init__(self, root_dir, split='train', img_size=256, is_train=True, to_tensor=True):
+    def __init__(self, root_dir, split='train', img_size=256, is_train=True, to_tensor=True,
+                 augm_backend='pil', uint8=False):
         super(ImageDataset, self).__init__()
         self.root_dir = root_dir
         self.img_size = img_size
@@ -62,7 +65,14 @@ class ImageDataset(data.Dataset):
 
         self.A_size = len(self.img_name_list)  # get the size of dataset A
         self.to_tensor = to_tensor
-        if is_train:
+        # the tensor backend only resizes here, random augmentation runs on whole batches
+        # (see datasets.batch_augmentation)
+        self.augm_backend = augm_backend
+        self.normalize = not (is_train and augm_backend == 'tensor')
+        self.uint8 = uint8
+        if not self.normalize:
+            self.augm = CDDataAugmentation(img_size=self.img_size)
+        elif is_train:
             self.augm = CDDataAugmentation(
                 img_size=self.img_size,
                 with_random_hflip=True,
@@ -85,7 +95,8 @@ class ImageDataset(data.Dataset):
         img = np.asarray(Image.open(A_path).convert('RGB'))
         img_B = np.asarray(Image.open(B_path).convert('RGB'))
 
-        [img, img_B], _ = self.augm.transform([img, img_B],[], to_tensor=self.to_tensor)
+        [img, img_B], _ = self.augm.transform([img, img_B],[], to_tensor=self.to_tensor,
+                                              normalize=self.normalize and not self.uint8)
 
         return {'A': img, 'B': img_B, 'name': name}
 
@@ -99,29 +110,50 @@ class CDDataset(ImageDataset):
     Change detection dataset class
     root_dir: folder path of the dataset
     img_size: spatial size of the images (input to the model)
+    cache_bytes: budget of the shared-memory cache of decoded tiles (0: off, see datasets.tile_cache);
+        augmentation runs after the cache lookup
     """
 
     def __init__(self, root_dir, img_size, split='train', is_train=True, label_transform=None,
-                 to_tensor=True):
+                 to_tensor=True, augm_backend='pil', cache_bytes=0, uint8=False):
         super(CDDataset, self).__init__(root_dir, img_size=img_size, split=split, is_train=is_train,
-                                        to_tensor=to_tensor)
+                                        to_tensor=to_tensor, augm_backend=augm_backend, uint8=uint8)
         self.label_transform = label_transform
+        self.cache = None
+        if cache_bytes > 0:
+            from datasets.tile_index import load_tile_index
+            from datasets.tile_cache import SharedTileCache
+            # slots fit the largest tile of the split
+            size = load_tile_index(self.root_dir, self.split).size
+            self.cache = SharedTileCache(self.A_size, max(size[:, 0].max(), 1), max(size[:, 1].max(), 1),
+                                         cache_bytes)
+
+    def load_sample(self, index):
+        """
+        Decoded uint8 A, B (h x w x 3) and raw label (h x w), from the tile cache if enabled
+        """
+        index = index % self.A_size
+        if self.cache is not None:
+            sample = self.cache.get(index)
+            if sample is not None:
+                return sample
+        img = np.asarray(Image.open(get_img_path(self.root_dir, self.img_name_list[index])).convert('RGB'))
+        img_B = np.asarray(Image.open(get_img_post_path(self.root_dir, self.img_name_list[index])).convert('RGB'))
+        label = np.array(Image.open(get_label_path(self.root_dir, self.img_name_list[index])), dtype=np.uint8)
+        if self.cache is not None:
+            self.cache.put(index, img, img_B, label)
+        return img, img_B, label
 
     def __getitem__(self, index):
         name = self.img_name_list[index]
-        A_path = get_img_path(self.root_dir, self.img_name_list[index % self.A_size])
-        B_path = get_img_post_path(self.root_dir, self.img_name_list[index % self.A_size])
-        img = np.asarray(Image.open(A_path).convert('RGB'))
-        img_B = np.asarray(Image.open(B_path).convert('RGB'))
-        L_path = get_label_path(self.root_dir, self.img_name_list[index % self.A_size])
-
-        label = np.array(Image.open(L_path), dtype=np.uint8)
+        img, img_B, label = self.load_sample(index)
         # if you are getting error because of dim mismatch ad [:,:,0] at the end
         # Note: label should be grayscale (single channel image)
         if self.label_transform == 'norm':
             label = label // 255
         
-        [img, img_B], [label] = self.augm.transform([img, img_B], [label], to_tensor=self.to_tensor)
+        [img, img_B], [label] = self.augm.transform([img, img_B], [label], to_tensor=self.to_tensor,
+                                                     normalize=self.normalize and not self.uint8)
         
         return {'name': name, 'A': img, 'B': img_B, 'L': label}
 
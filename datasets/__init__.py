@@ -1,4 +1,5 @@
 # datasets package initialization 
 from .CD_dataset import CDDataset 
+from .packed_dataset import PackedCDDataset
 
-__all__ = ['CDDataset']
\ No newline at end of file
+__all__ = ['CDDataset', 'PackedCDDataset']
\ No newline at end of file
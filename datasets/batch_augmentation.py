@@ -0,0 +1,199 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.data.dataloader import default_collate
+
+
+"""
+Tensor-native augmentation of collated uint8 batches.
+It mirrors the random ops of CDDataAugmentation (flips, rescale-crop, blur and color jitter) with
+per-sample random parameters; A, B and the label of a sample share the geometric parameters.
+"""
+
+
+def rgb_to_grayscale(x):
+    # ITU-R 601-2 luma transform, same weights as PIL and torchvision
+    r, g, b = x.unbind(dim=1)
+    return (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(dim=1)
+
+
+def rgb_to_hsv(x):
+    r, g, b = x.unbind(dim=1)
+    maxc, max_idx = x.max(dim=1)
+    minc, _ = x.min(dim=1)
+    cr = maxc - minc
+    eqc = cr == 0
+    s = cr / torch.where(eqc, torch.ones_like(maxc), maxc)
+    # hue sector relative to the dominant channel: (g-b)/cr, (b-r)/cr + 2, (r-g)/cr + 4
+    num = torch.stack((g - b, b - r, r - g), dim=1).gather(1, max_idx.unsqueeze(dim=1)).squeeze(dim=1)
+    h = (num / torch.where(eqc, torch.ones_like(cr), cr) + 2.0 * max_idx) / 6.0
+    h = torch.remainder(h, 1.0).masked_fill_(eqc, 0.0)
+    return torch.stack((h, s, maxc), dim=1)
+
+
+def hsv_to_rgb(x):
+    h, s, v = x.unbind(dim=1)
+    # f(n) = v - v*s*max(0, min(k, 4-k, 1)) with k = (n + 6h) mod 6, for n = 5, 3, 1 (R, G, B)
+    k = torch.remainder(torch.tensor([5.0, 3.0, 1.0], device=x.device, dtype=x.dtype).view(1, 3, 1, 1)
+                        + 6.0 * h.unsqueeze(dim=1), 6.0)
+    k = torch.minimum(k, 4.0 - k).clamp_(0.0, 1.0)
+    return v.unsqueeze(dim=1) - (v * s).unsqueeze(dim=1) * k
+
+
+def uniform(n, low, high, device):
+    return torch.empty(n, device=device).uniform_(low, high)
+
+
+class BatchCDAugmentation:
+    """
+    Augmentation of a collated batch {'A': N*3*H*W uint8, 'B': N*3*H*W uint8, 'L': N*1*H*W uint8}.
+    Returns the batch with A and B normalized to float (mean=0.5, std=0.5) as CDDataAugmentation does,
+    or rounded back to uint8 with normalize=False (for ELGCNet(uint8_input=True)).
+    """
+
+    def __init__(
+            self,
+            img_size,
+            with_random_hflip=False,
+            with_random_vflip=False,
+            with_scale_random_crop=False,
+            with_random_blur=False,
+            random_color_tf=False,
+            normalize=True
+    ):
+        self.img_size = img_size
+        self.normalize = normalize
+        self.with_random_hflip = with_random_hflip
+        self.with_random_vflip = with_random_vflip
+        self.with_scale_random_crop = with_scale_random_crop
+        self.with_random_blur = with_random_blur
+        self.random_color_tf = random_color_tf
+
+    def __call__(self, batch):
+        imgs = torch.cat([batch['A'], batch['B']], dim=0).float()
+        labels = batch['L'].float()
+        n = labels.shape[0]
+        device = imgs.device
+
+        if self.with_random_hflip:
+            flip = torch.nonzero(torch.rand(n, device=device) > 0.5).flatten()
+            imgs[flip] = imgs[flip].flip(-1)
+            imgs[flip + n] = imgs[flip + n].flip(-1)
+            labels[flip] = labels[flip].flip(-1)
+
+        if self.with_random_vflip:
+            flip = torch.nonzero(torch.rand(n, device=device) > 0.5).flatten()
+            imgs[flip] = imgs[flip].flip(-2)
+            imgs[flip + n] = imgs[flip + n].flip(-2)
+            labels[flip] = labels[flip].flip(-2)
+
+        if self.with_scale_random_crop:
+            imgs, labels = self._scale_random_crop(imgs, labels)
+
+        if self.with_random_blur:
+            # same radius for A and B, as in CDDataAugmentation
+            imgs = self._gaussian_blur(imgs, torch.rand(n, device=device).repeat(2))
+
+        imgs = imgs.div_(255)
+        if self.random_color_tf:
+            # A and B are jittered independently, as in CDDataAugmentation
+            imgs = self._color_jitter(imgs)
+
+        if self.normalize:
+            imgs = imgs.sub_(0.5).div_(0.5)
+        else:
+            imgs = imgs.mul_(255).round_().clamp_(0, 255).to(torch.uint8)
+
+        batch = dict(batch)
+        batch['A'], batch['B'] = imgs[:n], imgs[n:]
+        batch['L'] = labels.round().to(torch.uint8)
+        return batch
+
+    def _scale_random_crop(self, imgs, labels):
+        n, _, h, w = labels.shape
+        device = labels.device
+        size = self.img_size
+        # rescale by a factor in [1, 1.2] and crop a img_size window at a random position
+        scale = uniform(n, 1.0, 1.2, device)
+        scaled_h = torch.round(h * scale)
+        scaled_w = torch.round(w * scale)
+        top = torch.floor(torch.rand(n, device=device) * (scaled_h - size + 1))
+        left = torch.floor(torch.rand(n, device=device) * (scaled_w - size + 1))
+
+        # affine map from normalized output coordinates to normalized input coordinates
+        sx = scaled_w / w
+        sy = scaled_h / h
+        theta = torch.zeros(n, 2, 3, device=device)
+        theta[:, 0, 0] = size / (sx * w)
+        theta[:, 0, 2] = (size + 2 * left) / (sx * w) - 1
+        theta[:, 1, 1] = size / (sy * h)
+        theta[:, 1, 2] = (size + 2 * top) / (sy * h) - 1
+        grid = F.affine_grid(theta, [n, 1, size, size], align_corners=False)
+
+        imgs = F.grid_sample(imgs, grid.repeat(2, 1, 1, 1), mode='bicubic', padding_mode='border',
+                             align_corners=False).clamp_(0, 255)
+        labels = F.grid_sample(labels, grid, mode='nearest', padding_mode='border', align_corners=False)
+        return imgs, labels
+
+    def _gaussian_blur(self, imgs, sigma):
+        n, c, h, w = imgs.shape
+        radius = 3
+        idx = torch.arange(-radius, radius + 1, device=imgs.device, dtype=imgs.dtype)
+        kernel = torch.exp(-idx.view(1, -1) ** 2 / (2 * sigma.clamp(min=1e-3).view(-1, 1) ** 2))
+        kernel = (kernel / kernel.sum(dim=1, keepdim=True)).repeat_interleave(c, dim=0)
+
+        x = imgs.reshape(1, n * c, h, w)
+        x = F.pad(x, [radius, radius, radius, radius], mode='replicate')
+        x = F.conv2d(x, kernel.view(n * c, 1, 1, -1), groups=n * c)
+        x = F.conv2d(x, kernel.view(n * c, 1, -1, 1), groups=n * c)
+        return x.reshape(n, c, h, w)
+
+    def _color_jitter(self, imgs):
+        # ColorJitter(brightness=0.3, contrast=0.3, saturation=0.2, hue=0.1) with per-sample factors;
+        # the order of the four ops is drawn once per batch
+        n = imgs.shape[0]
+        device = imgs.device
+        brightness = uniform(n, 0.7, 1.3, device).view(-1, 1, 1, 1)
+        contrast = uniform(n, 0.7, 1.3, device).view(-1, 1, 1, 1)
+        saturation = uniform(n, 0.8, 1.2, device).view(-1, 1, 1, 1)
+        hue = uniform(n, -0.1, 0.1, device).view(-1, 1, 1)
+
+        for fn_id in torch.randperm(4).tolist():
+            if fn_id == 0:
+                imgs = (imgs * brightness).clamp_(0, 1)
+            elif fn_id == 1:
+                mean = rgb_to_grayscale(imgs).mean(dim=(-3, -2, -1), keepdim=True)
+                imgs = (contrast * imgs + (1 - contrast) * mean).clamp_(0, 1)
+            elif fn_id == 2:
+                gray = rgb_to_grayscale(imgs)
+                imgs = (saturation * imgs + (1 - saturation) * gray).clamp_(0, 1)
+            elif fn_id == 3:
+                hsv = rgb_to_hsv(imgs)
+                h = torch.remainder(hsv[:, 0] + hue, 1.0)
+                imgs = hsv_to_rgb(torch.stack((h, hsv[:, 1], hsv[:, 2]), dim=1))
+        return imgs
+
+
+def get_train_batch_augmentation(img_size, normalize=True):
+    """
+    Batch counterpart of the training augmentation of CDDataset
+    """
+    return BatchCDAugmentation(
+        img_size=img_size,
+        normalize=normalize,
+        with_random_hflip=True,
+        with_random_vflip=True,
+        with_scale_random_crop=True,
+        with_random_blur=True,
+        random_color_tf=True
+    )
+
+
+class BatchAugmentationCollate:
+    """
+    collate_fn applying a BatchCDAugmentation inside the DataLoader workers
+    """
+    def __init__(self, augm):
+        self.augm = augm
+
+    def __call__(self, samples):
+        return self.augm(default_collate(samples))
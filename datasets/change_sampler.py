@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+from datasets.tile_index import load_tile_index
+
+
+"""
+Change-aware sampling of training tiles: most tiles of LEVIR/DSIFN contain little or no change, this
+sampler draws tiles (with replacement) with a probability that grows with their change ratio
+    p_i ~ max(change_ratio_i, floor) ^ (1 / temperature)
+temperature 1: proportional to the change ratio, large temperatures tend to uniform sampling
+floor: change ratio given to empty tiles (they keep a non-zero probability)
+The change ratios are read from the tile index of the split (datasets.tile_index, built once).
+"""
+
+
+def get_change_weights(change_ratio, temperature=1.0, floor=0.01):
+    if temperature <= 0:
+        raise ValueError('sampler temperature must be > 0, got %s' % temperature)
+    if floor <= 0:
+        raise ValueError('sampler floor must be > 0, got %s' % floor)
+    weights = np.maximum(np.asarray(change_ratio, dtype=np.float64), floor) ** (1.0 / temperature)
+    return weights / weights.sum()
+
+
+class ChangeAwareSampler(Sampler):
+    """
+    Sampler of a CDDataset / PackedCDDataset drawing num_samples tiles per epoch by change ratio
+    num_samples: epoch length (None: size of the dataset)
+    seed: seed of the first epoch, incremented every epoch (None: drawn from the torch RNG)
+    """
+    def __init__(self, dataset, temperature=1.0, floor=0.01, num_samples=None, seed=None):
+        index = load_tile_index(dataset.root_dir, dataset.split)
+        if len(index) != len(dataset):
+            raise ValueError('tile index of %s has %d tiles, the dataset %d' % (dataset.split, len(index),
+                                                                                 len(dataset)))
+        self.change_ratio = index.change_ratio
+        self.temperature = temperature
+        self.floor = floor
+        self.weights = torch.from_numpy(get_change_weights(self.change_ratio, temperature, floor))
+        self.num_samples = len(dataset) if num_samples is None else num_samples
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        generator = torch.Generator()
+        if self.seed is None:
+            generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+        else:
+            generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        indices = torch.multinomial(self.weights, self.num_samples, replacement=True, generator=generator)
+        return iter(indices.tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+    def describe(self):
+        # expected change ratio of a drawn tile vs a uniformly drawn one
+        empty = self.change_ratio == 0
+        return ('change-aware sampler: temperature %.2f, floor %.4f, %d tiles per epoch, mean change ratio '
+                '%.4f (uniform %.4f), empty tiles %.1f%% of draws (%.1f%% of the split)' %
+                (self.temperature, self.floor, self.num_samples,
+                 float((self.weights.numpy() * self.change_ratio).sum()), self.change_ratio.mean(),
+                 100 * float(self.weights.numpy()[empty].sum()), 100 * empty.mean()))
@@ -48,10 +48,11 @@ class CDDataAugmentation:
         self.random_color_tf=random_color_tf
         self.is_evaluation = is_evaluation
 
-    def transform(self, imgs, labels, to_tensor=True):
+    def transform(self, imgs, labels, to_tensor=True, normalize=True):
         """
         :param imgs: [ndarray,] (list of images)
         :param labels: [ndarray,] (list of label images)
+        :param normalize: if False, images are returned as uint8 tensors (C*H*W) without normalization
         :return: [ndarray,],[ndarray,]
         """
         # resize image and covert to tensor
@@ -135,7 +136,13 @@ class CDDataAugmentation:
                 imgs_tf.append(tf(img))
             imgs = imgs_tf
             
-        if to_tensor:
+        if to_tensor and not normalize:
+            imgs = [torch.from_numpy(np.array(img, np.uint8)).permute(2, 0, 1).contiguous()
+                    for img in imgs]
+            labels = [torch.from_numpy(np.array(img, np.uint8)).unsqueeze(dim=0)
+                      for img in labels]
+
+        elif to_tensor:
             # to tensor
             imgs = [TF.to_tensor(img) for img in imgs]
             labels = [torch.from_numpy(np.array(img, np.uint8)).unsqueeze(dim=0)
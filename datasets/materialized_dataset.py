@@ -0,0 +1,186 @@
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import torch
+from torch.utils import data
+
+from datasets.CD_dataset import get_img_path, get_img_post_path, get_label_path
+
+
+"""
+Materialized evaluation split: the deterministic evaluation transform (resize, to_tensor, normalize) of a
+split is computed once and stored as contiguous arrays, then streamed back in contiguous batches
+├─materialized
+│  └─<split>_<img_size>_<format>_<key>
+│     ├─meta.json
+│     ├─names.txt
+│     ├─A.npy      N x 3 x S x S (uint8, or float32 normalized)
+│     ├─B.npy
+│     └─L.npy      N x 1 x H x W uint8 (label_transform applied, not resized as in evaluation)
+key: sha1 of the list file, size and mtime of every A/B/label file, img_size, label_transform and format,
+so a changed split or image size is materialized again.
+format uint8: 1/4 of the size, normalized per batch (same operations as TF.to_tensor and TF.normalize),
+or returned as uint8 for models that normalize their input (ELGCNet(uint8_input=True))
+format float: the final normalized tensors
+"""
+MATERIALIZED_FOLDER_NAME = 'materialized'
+MATERIALIZED_FORMATS = ['uint8', 'float']
+
+
+def normalize_uint8(x):
+    # TF.to_tensor followed by TF.normalize(mean=0.5, std=0.5) of a uint8 N x C x H x W tensor
+    return x.float().div(255).sub(0.5).div(0.5)
+
+
+def get_split_key(dataset, fmt):
+    """
+    Hash of the contents of the split of a CDDataset / PackedCDDataset and of the evaluation settings
+    """
+    h = hashlib.sha1()
+    with open(os.path.join(dataset.root_dir, 'list', dataset.split + '.txt'), 'rb') as f:
+        h.update(f.read())
+    for name in dataset.img_name_list:
+        for path in [get_img_path(dataset.root_dir, name), get_img_post_path(dataset.root_dir, name),
+                     get_label_path(dataset.root_dir, name)]:
+            try:
+                st = os.stat(path)
+                h.update(('%s %d %d\n' % (path, st.st_size, st.st_mtime_ns)).encode())
+            except FileNotFoundError:
+                h.update(('%s -\n' % path).encode())
+    if hasattr(dataset, 'packed_dir'):
+        st = os.stat(os.path.join(dataset.packed_dir, 'index.npy'))
+        h.update(('packed %d %d\n' % (st.st_size, st.st_mtime_ns)).encode())
+    h.update(('%s %s %s' % (dataset.img_size, getattr(dataset, 'label_transform', None), fmt)).encode())
+    return h.hexdigest()[:16]
+
+
+def materialize_split(dataset, fmt='uint8', out_root=None, num_workers=0):
+    """
+    Write the evaluation samples of dataset (is_train=False) once, return the folder
+    fmt: uint8 | float (see MATERIALIZED_FORMATS)
+    out_root: parent folder (defaults to <root_dir>/materialized)
+    num_workers: DataLoader workers decoding the samples
+    """
+    if fmt not in MATERIALIZED_FORMATS:
+        raise NotImplementedError('materialized format [%s] is not implemented (choose one from %s)'
+                                  % (fmt, MATERIALIZED_FORMATS))
+    out_root = os.path.join(dataset.root_dir, MATERIALIZED_FOLDER_NAME) if out_root is None else out_root
+    prefix = '%s_%d_%s_' % (dataset.split, dataset.img_size, fmt)
+    out_dir = os.path.join(out_root, prefix + get_split_key(dataset, fmt))
+    if os.path.exists(os.path.join(out_dir, 'meta.json')):
+        return out_dir
+
+    # uint8 samples of the evaluation transform (resized, not normalized)
+    normalize, dataset.normalize = dataset.normalize, False
+    try:
+        tmp_dir = out_dir + '.tmp%d' % os.getpid()
+        os.makedirs(tmp_dir, exist_ok=True)
+        arrays, names = {}, []
+        loader = data.DataLoader(dataset, batch_size=None, shuffle=False, num_workers=num_workers)
+        for i, sample in enumerate(loader):
+            if not arrays:
+                for k in ['A', 'B', 'L']:
+                    dtype = np.float32 if fmt == 'float' and k != 'L' else np.uint8
+                    arrays[k] = np.lib.format.open_memmap(os.path.join(tmp_dir, k + '.npy'), mode='w+',
+                                                          dtype=dtype, shape=(len(dataset),) + tuple(sample[k].shape))
+            for k in ['A', 'B', 'L']:
+                if tuple(sample[k].shape) != arrays[k].shape[1:]:
+                    raise ValueError('%s of %s has shape %s, expected %s (labels are not resized in evaluation)'
+                                     % (k, sample['name'], tuple(sample[k].shape), arrays[k].shape[1:]))
+                x = sample[k]
+                if fmt == 'float' and k != 'L':
+                    x = normalize_uint8(x[None])[0]
+                arrays[k][i] = x.numpy()
+            names.append(str(sample['name']))
+            if i % 1000 == 0:
+                print('materializing %s: %d/%d' % (dataset.split, i, len(dataset)))
+        for k in arrays:
+            arrays[k].flush()
+        arrays.clear()
+        with open(os.path.join(tmp_dir, 'names.txt'), 'w') as f:
+            f.write('\n'.join(names))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'split': dataset.split, 'img_size': dataset.img_size, 'format': fmt,
+                       'num_samples': len(names)}, f)
+        os.replace(tmp_dir, out_dir)
+    finally:
+        dataset.normalize = normalize
+
+    # older materializations of the same split and size
+    for name in os.listdir(out_root):
+        if name.startswith(prefix) and os.path.join(out_root, name) != out_dir:
+            shutil.rmtree(os.path.join(out_root, name), ignore_errors=True)
+    print('materialized %d samples of %s at %s' % (len(names), dataset.split, out_dir))
+    return out_dir
+
+
+class MaterializedCDDataset(data.Dataset):
+    """
+    Evaluation samples of a materialized split (see materialize_split), memory-mapped
+    normalize: normalize uint8 A/B (False: batches keep the uint8 images, uint8 format only)
+    """
+    def __init__(self, materialized_dir, normalize=True):
+        super(MaterializedCDDataset, self).__init__()
+        self.materialized_dir = materialized_dir
+        self.normalize = normalize
+        with open(os.path.join(materialized_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(materialized_dir, 'names.txt')) as f:
+            self.img_name_list = np.asarray(f.read().split('\n'))
+        self.arrays = {k: np.load(os.path.join(materialized_dir, k + '.npy'), mmap_mode='r')
+                       for k in ['A', 'B', 'L']}
+        if not normalize and self.meta['format'] != 'uint8':
+            raise ValueError('unnormalized samples need the uint8 format, %s is %s'
+                             % (materialized_dir, self.meta['format']))
+        self.split = self.meta['split']
+        self.img_size = self.meta['img_size']
+        self.A_size = len(self.img_name_list)
+
+    def get_batch(self, start, stop):
+        """
+        Samples start..stop-1 as one batch (contiguous reads)
+        """
+        batch = {'name': list(self.img_name_list[start:stop])}
+        for k, arr in self.arrays.items():
+            x = torch.from_numpy(np.array(arr[start:stop]))
+            if k != 'L' and x.dtype == torch.uint8 and self.normalize:
+                x = normalize_uint8(x)
+            batch[k] = x
+        return batch
+
+    def __getitem__(self, index):
+        batch = self.get_batch(index, index + 1)
+        return {k: v[0] for k, v in batch.items()}
+
+    def __len__(self):
+        return self.A_size
+
+
+class ContiguousBatchLoader():
+    """
+    Sequential loader of a MaterializedCDDataset, yields the batches of the DataLoader (no shuffling)
+    """
+    def __init__(self, dataset, batch_size):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.sampler = None
+
+    def __iter__(self):
+        for start in range(0, len(self.dataset), self.batch_size):
+            yield self.dataset.get_batch(start, min(start + self.batch_size, len(self.dataset)))
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+
+def get_materialized_loader(dataset, batch_size, fmt='uint8', num_workers=0):
+    """
+    ContiguousBatchLoader of the evaluation samples of dataset, materialized on first use
+    (uint8 batches if the dataset yields uint8 samples)
+    """
+    materialized_dir = materialize_split(dataset, fmt, num_workers=num_workers)
+    return ContiguousBatchLoader(MaterializedCDDataset(materialized_dir, normalize=not getattr(dataset, 'uint8', False)),
+                                 batch_size)
@@ -0,0 +1,208 @@
+import os
+import json
+
+from PIL import Image
+import numpy as np
+
+from torch.utils import data
+
+from datasets.data_utils import CDDataAugmentation
+from datasets.CD_dataset import LIST_FOLDER_NAME, load_img_name_list, get_img_path, \
+    get_img_post_path, get_label_path
+
+
+"""
+Packed CD data set: every split is converted once into contiguous uint8 shards
+├─packed
+│  └─<split>
+│     ├─meta.json
+│     ├─names.txt
+│     ├─index.npy        (shard, offset, height, width) per sample
+│     └─shard_XXXXX.bin  [A (h*w*3) | B (h*w*3) | bit-packed label (ceil(h*w/8))] per sample
+Samples are read back as zero-copy np.memmap views, so all DataLoader workers share the page cache.
+Labels are stored as change bits, meta.json keeps the raw value of the change pixels (label_value, 1 or 255)
+so that the labels are read back as CDDataset reads the PNGs (raw values, // 255 for label_transform 'norm').
+"""
+PACKED_FOLDER_NAME = 'packed'
+PAGE_SIZE = 4096
+
+INDEX_DTYPE = np.dtype([('shard', np.int32), ('offset', np.int64),
+                        ('height', np.int32), ('width', np.int32)])
+
+
+def get_packed_dir(root_dir, split):
+    return os.path.join(root_dir, PACKED_FOLDER_NAME, split)
+
+
+def get_sample_nbytes(height, width):
+    npix = height * width
+    return 2 * npix * 3 + (npix + 7) // 8
+
+
+def pack_split(root_dir, split, out_dir=None, shard_size_mb=512):
+    """
+    Convert the A/B/label PNGs of a split into packed shards
+    root_dir: folder path of the dataset
+    split: name of the list file (train | val | test)
+    out_dir: output folder (defaults to <root_dir>/packed/<split>)
+    shard_size_mb: approximate size of each shard file
+    """
+    out_dir = get_packed_dir(root_dir, split) if out_dir is None else out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    img_name_list = load_img_name_list(os.path.join(root_dir, LIST_FOLDER_NAME, split + '.txt'))
+    shard_bytes = shard_size_mb * 1024 * 1024
+
+    index = np.zeros(len(img_name_list), dtype=INDEX_DTYPE)
+    label_value = None
+    shard_id, shard_pos, f = -1, shard_bytes, None
+    for i, name in enumerate(img_name_list):
+        img = np.asarray(Image.open(get_img_path(root_dir, name)).convert('RGB'))
+        img_B = np.asarray(Image.open(get_img_post_path(root_dir, name)).convert('RGB'))
+        label = np.array(Image.open(get_label_path(root_dir, name)), dtype=np.uint8)
+        if label.ndim == 3:
+            label = label[:, :, 0]
+        if img.shape != img_B.shape or img.shape[:2] != label.shape:
+            raise ValueError('size mismatch between A, B and label of %s' % name)
+        values = np.unique(label)
+        if not (np.all(np.isin(values, [0, 255])) or np.all(np.isin(values, [0, 1]))):
+            raise ValueError('label of %s is not binary (values %s), it cannot be bit-packed'
+                             % (name, values))
+        if values.max() > 0:
+            if label_value is not None and values.max() != label_value:
+                raise ValueError('label of %s marks change with %d, previous labels of %s with %d'
+                                 % (name, values.max(), split, label_value))
+            label_value = int(values.max())
+
+        h, w = label.shape
+        nbytes = get_sample_nbytes(h, w)
+        if shard_pos + nbytes > shard_bytes and shard_pos > 0:
+            if f is not None:
+                f.close()
+            shard_id += 1
+            shard_pos = 0
+            f = open(os.path.join(out_dir, 'shard_%05d.bin' % shard_id), 'wb')
+
+        index[i] = (shard_id, shard_pos, h, w)
+        f.write(img.tobytes())
+        f.write(img_B.tobytes())
+        f.write(np.packbits(label.flatten() > 0).tobytes())
+        # align every sample on a page boundary
+        pad = -nbytes % PAGE_SIZE
+        f.write(b'\0' * pad)
+        shard_pos += nbytes + pad
+
+        if i % 1000 == 0:
+            print('packing %s: %d/%d' % (split, i, len(img_name_list)))
+    if f is not None:
+        f.close()
+
+    np.save(os.path.join(out_dir, 'index.npy'), index)
+    with open(os.path.join(out_dir, 'names.txt'), 'w') as fn:
+        fn.write('\n'.join(img_name_list))
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as fm:
+        json.dump({'split': split, 'num_samples': len(img_name_list), 'num_shards': shard_id + 1,
+                   'label_value': 255 if label_value is None else label_value}, fm)
+    print('packed %d samples of %s into %d shards at %s' %
+          (len(img_name_list), split, shard_id + 1, out_dir))
+    return out_dir
+
+
+class PackedCDDataset(data.Dataset):
+    """
+    Change detection dataset reading samples from packed shards (see pack_split)
+    root_dir: folder path of the dataset
+    img_size: spatial size of the images (input to the model)
+    augm_backend: pil | tensor (see CDDataset)
+    uint8: samples are unnormalized uint8 tensors (see CDDataset)
+    packed_dir: folder of the packed split (defaults to <root_dir>/packed/<split>)
+    """
+
+    def __init__(self, root_dir, img_size, split='train', is_train=True, label_transform=None,
+                 to_tensor=True, augm_backend='pil', packed_dir=None, uint8=False):
+        super(PackedCDDataset, self).__init__()
+        self.root_dir = root_dir
+        self.img_size = img_size
+        self.split = split
+        self.packed_dir = get_packed_dir(root_dir, split) if packed_dir is None else packed_dir
+        if not os.path.exists(os.path.join(self.packed_dir, 'index.npy')):
+            raise FileNotFoundError('no packed split at %s, run: python pack_dataset.py '
+                                    '--root_dir %s --split %s' % (self.packed_dir, root_dir, split))
+        self.index = np.load(os.path.join(self.packed_dir, 'index.npy'))
+        with open(os.path.join(self.packed_dir, 'names.txt')) as f:
+            self.img_name_list = np.asarray(f.read().split('\n'))
+
+        self.A_size = len(self.index)
+        self.to_tensor = to_tensor
+        self.label_transform = label_transform
+        # value of the change pixels as CDDataset reads them (splits packed without label_value: 255)
+        with open(os.path.join(self.packed_dir, 'meta.json')) as f:
+            self.label_value = json.load(f).get('label_value', 255)
+        self.change_value = self.label_value // 255 if label_transform == 'norm' else self.label_value
+        if self.change_value == 0:
+            raise ValueError('labels of %s mark change with %d, label_transform %s maps them to 0'
+                             % (self.packed_dir, self.label_value, label_transform))
+        # shards are mapped lazily so that every DataLoader worker maps them after fork
+        self._shards = {}
+        # the tensor backend only resizes here, random augmentation runs on whole batches
+        # (see datasets.batch_augmentation)
+        self.augm_backend = augm_backend
+        self.normalize = not (is_train and augm_backend == 'tensor')
+        self.uint8 = uint8
+        if not self.normalize:
+            self.augm = CDDataAugmentation(img_size=self.img_size)
+        elif is_train:
+            self.augm = CDDataAugmentation(
+                img_size=self.img_size,
+                with_random_hflip=True,
+                with_random_vflip=True,
+                with_scale_random_crop=True,
+                with_random_blur=True,
+                random_color_tf=True
+            )
+        else:
+            self.augm = CDDataAugmentation(
+                img_size=self.img_size,
+                is_evaluation=True
+            )
+
+    def _get_shard(self, shard_id):
+        if shard_id not in self._shards:
+            self._shards[shard_id] = np.memmap(
+                os.path.join(self.packed_dir, 'shard_%05d.bin' % shard_id), dtype=np.uint8, mode='r')
+        return self._shards[shard_id]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def read_sample(self, index):
+        """
+        Return zero-copy views of A and B (h x w x 3) and the unpacked label (h x w)
+        """
+        shard_id, offset, h, w = self.index[index % self.A_size].tolist()
+        shard = self._get_shard(shard_id)
+        npix = h * w
+        img = shard[offset:offset + npix * 3].reshape(h, w, 3)
+        offset += npix * 3
+        img_B = shard[offset:offset + npix * 3].reshape(h, w, 3)
+        offset += npix * 3
+        label = np.unpackbits(shard[offset:offset + (npix + 7) // 8], count=npix).reshape(h, w)
+        return img, img_B, label
+
+    def __getitem__(self, index):
+        name = self.img_name_list[index % self.A_size]
+        img, img_B, label = self.read_sample(index)
+        # labels are stored as change bits, mapped to the values CDDataset reads
+        if self.change_value != 1:
+            label = label * np.uint8(self.change_value)
+
+        [img, img_B], [label] = self.augm.transform([img, img_B], [label], to_tensor=self.to_tensor,
+                                                     normalize=self.normalize and not self.uint8)
+
+        return {'name': name, 'A': img, 'B': img_B, 'L': label}
+
+    def __len__(self):
+        """Return the total number of images in the dataset."""
+        return self.A_size
+
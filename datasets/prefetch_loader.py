@@ -0,0 +1,111 @@
+import time
+import queue
+import threading
+
+import torch
+
+
+"""
+Prefetching wrapper of a DataLoader: a background thread keeps up to num_prefetch batches in flight,
+pinned (CUDA) and copied to the device with non_blocking transfers on a side stream, so the trainer
+receives ready-to-use device tensors and the host to device copies overlap the previous step.
+On the CPU the thread only overlaps the collation and IPC of the DataLoader with the training step.
+"""
+
+
+def _to_device(batch, device, pin_memory, non_blocking):
+    out = {}
+    for k, v in batch.items():
+        if torch.is_tensor(v):
+            if pin_memory and not v.is_pinned():
+                v = v.pin_memory()
+            v = v.to(device, non_blocking=non_blocking)
+        out[k] = v
+    return out
+
+
+class PrefetchLoader():
+    """
+    Iterates loader on a background thread and yields its batches with the tensors on device
+    num_prefetch: batches in flight (K)
+    pin_memory: pin the host tensors before the copy (CUDA only, skipped for tensors pinned by the DataLoader)
+    wait_time: seconds the consumer waited for batches in the last iteration
+    """
+    def __init__(self, loader, device, num_prefetch=2, pin_memory=True):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_prefetch = max(1, num_prefetch)
+        self.is_cuda = self.device.type == 'cuda'
+        self.pin_memory = pin_memory and self.is_cuda
+        self.wait_time = 0.0
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def sampler(self):
+        return getattr(self.loader, 'sampler', None)
+
+    @property
+    def batch_size(self):
+        return self.loader.batch_size
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _produce(self, out, stop):
+        stream = torch.cuda.Stream(self.device) if self.is_cuda else None
+        try:
+            for batch in self.loader:
+                if stop.is_set():
+                    break
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = _to_device(batch, self.device, self.pin_memory, True)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = _to_device(batch, self.device, False, False)
+                self._put(out, stop, (batch, event))
+        except Exception as e:
+            self._put(out, stop, e)
+        self._put(out, stop, None)
+
+    @staticmethod
+    def _put(out, stop, item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        out = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(out, stop), daemon=True)
+        thread.start()
+        self.wait_time = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                item = out.get()
+                self.wait_time += time.perf_counter() - start
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch, event = item
+                if event is not None:
+                    # the copies ran on the side stream, keep their memory alive on the current stream
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    for v in batch.values():
+                        if torch.is_tensor(v) and v.is_cuda:
+                            v.record_stream(current)
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
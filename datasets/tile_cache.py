@@ -0,0 +1,144 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+"""
+Shared-memory LRU cache of decoded tiles (uint8 A, B and label arrays) for CDDataset.
+The arena is one shared memory block created in the main process and attached by every DataLoader
+worker, so a tile decoded by any worker is reused by all of them in the following epochs.
+├─header   slot_key, slot_tick (last use), slot_shape per slot, slot_of per tile, counters
+└─slots    [A (h*w*3) | B (h*w*3) | label (h*w)] per slot
+Slots have a fixed size (the largest tile of the split, from datasets.tile_index), the number of slots
+is given by the byte budget. When all slots are used the least recently used tile is evicted.
+"""
+HITS, MISSES, EVICTIONS, CLOCK = range(4)
+
+
+def get_tile_nbytes(height, width):
+    return height * width * 7
+
+
+class SharedTileCache():
+    """
+    LRU cache of num_tiles tiles of at most max_height x max_width pixels in budget_bytes of shared memory
+    """
+    def __init__(self, num_tiles, max_height, max_width, budget_bytes):
+        self.num_tiles = num_tiles
+        self.max_shape = (int(max_height), int(max_width))
+        self.slot_nbytes = get_tile_nbytes(*self.max_shape)
+        self.num_slots = int(min(num_tiles, budget_bytes // max(self.slot_nbytes, 1)))
+        self.budget_bytes = budget_bytes
+        self.lock = multiprocessing.Lock()
+        nbytes = self._header_nbytes() + self.num_slots * self.slot_nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self.owner_pid = os.getpid()
+        self._map()
+        self.slot_key[:] = -1
+        self.slot_tick[:] = 0
+        self.slot_of[:] = -1
+        self.counters[:] = 0
+
+    def _header_nbytes(self):
+        return 8 * (2 * self.num_slots + 4) + 4 * (2 * self.num_slots + self.num_tiles)
+
+    def _map(self):
+        buf, offset = self.shm.buf, 0
+
+        def view(dtype, count):
+            nonlocal offset
+            arr = np.ndarray((count,), dtype=dtype, buffer=buf, offset=offset)
+            offset += arr.nbytes
+            return arr
+
+        self.counters = view(np.int64, 4)
+        self.slot_key = view(np.int64, self.num_slots)
+        self.slot_tick = view(np.int64, self.num_slots)
+        self.slot_shape = view(np.int32, 2 * self.num_slots).reshape(self.num_slots, 2)
+        self.slot_of = view(np.int32, self.num_tiles)
+        self.slots = np.ndarray((self.num_slots, self.slot_nbytes), dtype=np.uint8, buffer=buf, offset=offset)
+
+    def __getstate__(self):
+        # workers started with spawn attach the arena by name
+        state = self.__dict__.copy()
+        for k in ['shm', 'counters', 'slot_key', 'slot_tick', 'slot_shape', 'slot_of', 'slots']:
+            state.pop(k)
+        state['shm_name'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('shm_name')
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=name)
+        self._map()
+
+    def get(self, key):
+        """
+        (A, B, label) copies of a cached tile, None on a miss
+        """
+        with self.lock:
+            slot = self.slot_of[key]
+            if slot < 0:
+                self.counters[MISSES] += 1
+                return None
+            self.counters[HITS] += 1
+            self.counters[CLOCK] += 1
+            self.slot_tick[slot] = self.counters[CLOCK]
+            h, w = self.slot_shape[slot]
+            data = self.slots[slot, :get_tile_nbytes(h, w)].copy()
+        npix = h * w
+        return (data[:npix * 3].reshape(h, w, 3), data[npix * 3:npix * 6].reshape(h, w, 3),
+                data[npix * 6:].reshape(h, w))
+
+    def put(self, key, img, img_B, label):
+        """
+        Store a decoded tile, evicting the least recently used one if the cache is full.
+        Returns False if the tile cannot be cached (no slots, larger than a slot or not h x w x 3 / h x w).
+        """
+        h, w = label.shape[:2]
+        if (self.num_slots == 0 or label.ndim != 2 or img.shape != (h, w, 3) or img_B.shape != (h, w, 3)
+                or h * w > self.max_shape[0] * self.max_shape[1]):
+            return False
+        with self.lock:
+            if self.slot_of[key] >= 0:
+                return True
+            free = np.nonzero(self.slot_key < 0)[0]
+            if len(free):
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self.slot_tick))
+                self.slot_of[self.slot_key[slot]] = -1
+                self.counters[EVICTIONS] += 1
+            npix = h * w
+            data = self.slots[slot]
+            data[:npix * 3] = img.reshape(-1)
+            data[npix * 3:npix * 6] = img_B.reshape(-1)
+            data[npix * 6:npix * 7] = label.reshape(-1)
+            self.slot_shape[slot] = (h, w)
+            self.slot_key[slot] = key
+            self.slot_of[key] = slot
+            self.counters[CLOCK] += 1
+            self.slot_tick[slot] = self.counters[CLOCK]
+        return True
+
+    def stats(self):
+        with self.lock:
+            hits, misses, evictions = self.counters[[HITS, MISSES, EVICTIONS]].tolist()
+            cached = int((self.slot_key >= 0).sum())
+        return {'hits': hits, 'misses': misses, 'evictions': evictions, 'cached': cached,
+                'slots': self.num_slots, 'nbytes': self.num_slots * self.slot_nbytes}
+
+    def close(self):
+        for k in ['counters', 'slot_key', 'slot_tick', 'slot_shape', 'slot_of', 'slots']:
+            self.__dict__.pop(k, None)
+        self.shm.close()
+        if os.getpid() == self.owner_pid:
+            self.shm.unlink()
+
+    def __del__(self):
+        try:
+            self.close()
+        except (AttributeError, FileNotFoundError, BufferError):
+            pass
@@ -0,0 +1,168 @@
+import os
+import hashlib
+from multiprocessing import Pool
+
+from PIL import Image
+import numpy as np
+
+from datasets.CD_dataset import LIST_FOLDER_NAME, load_img_name_list, get_img_path, \
+    get_img_post_path, get_label_path
+
+
+"""
+Per-tile statistics of a CD data set split, computed once with a process pool and stored next to the data
+├─index
+│  └─<split>.npz
+    list_sha1   sha1 of the list file the index was built from (a changed list triggers a rebuild)
+    names       tile names in list order
+    exists      (A, B, label) present and readable per tile
+    size        (height, width) of A per tile, -1 if missing
+    size_match  A, B and label have the same size
+    hist        histogram of the raw label values (256 bins) per tile
+Class counts, change ratios and the balanced selection of a split are read from the index instead of
+decoding every label again (see models.losses.get_alpha, analyze_dataset.py, colab/prepare_data_balanced.py).
+"""
+INDEX_FOLDER_NAME = 'index'
+
+
+def get_index_path(root_dir, split):
+    return os.path.join(root_dir, INDEX_FOLDER_NAME, split + '.npz')
+
+
+def get_list_path(root_dir, split):
+    return os.path.join(root_dir, LIST_FOLDER_NAME, split + '.txt')
+
+
+def hash_list_file(list_path):
+    with open(list_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _image_size(path):
+    # (height, width) from the image header, None if missing or unreadable
+    try:
+        with Image.open(path) as img:
+            return img.size[::-1]
+    except (OSError, ValueError):
+        return None
+
+
+def index_tile(root_dir, name):
+    """
+    Statistics of one tile: (exists (3,), size (2,), size_match, label histogram (256,))
+    """
+    size_A = _image_size(get_img_path(root_dir, name))
+    size_B = _image_size(get_img_post_path(root_dir, name))
+    hist = np.zeros(256, dtype=np.int64)
+    label = None
+    try:
+        label = np.array(Image.open(get_label_path(root_dir, name)), dtype=np.uint8)
+        if label.ndim == 3:
+            label = label[:, :, 0]
+        hist = np.bincount(label.ravel(), minlength=256)
+    except (OSError, ValueError):
+        pass
+    exists = (size_A is not None, size_B is not None, label is not None)
+    size = size_A if size_A is not None else (-1, -1)
+    size_match = all(exists) and size_A == size_B == label.shape
+    return exists, size, size_match, hist
+
+
+def _index_tile(job):
+    return index_tile(*job)
+
+
+def build_tile_index(root_dir, split, num_workers=None, out_path=None):
+    """
+    Index the tiles of a split with a pool of num_workers processes (None: os.cpu_count(), 0: serial)
+    root_dir: folder path of the dataset
+    split: name of the list file (train | val | test)
+    out_path: output file (defaults to <root_dir>/index/<split>.npz)
+    """
+    list_path = get_list_path(root_dir, split)
+    out_path = get_index_path(root_dir, split) if out_path is None else out_path
+    list_sha1 = hash_list_file(list_path)
+    names = load_img_name_list(list_path)
+    jobs = [(root_dir, name) for name in names]
+
+    if num_workers == 0:
+        results = [index_tile(*job) for job in jobs]
+    else:
+        with Pool(num_workers) as pool:
+            results = pool.map(_index_tile, jobs, chunksize=max(1, len(jobs) // (8 * (num_workers or
+                                                                                      os.cpu_count() or 1))))
+    exists, size, size_match, hist = zip(*results) if results else ([], [], [], [])
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    index = {'list_sha1': np.asarray(list_sha1), 'names': np.asarray(names, dtype=str),
+             'exists': np.asarray(exists, dtype=bool).reshape(-1, 3),
+             'size': np.asarray(size, dtype=np.int32).reshape(-1, 2),
+             'size_match': np.asarray(size_match, dtype=bool),
+             'hist': np.asarray(hist, dtype=np.int64).reshape(-1, 256)}
+    # np.savez appends .npz to names without it, write through a file object
+    with open(out_path, 'wb') as f:
+        np.savez_compressed(f, **index)
+    tile_index = TileIndex(index, path=out_path)
+    print('indexed %d tiles of %s (%d incomplete) at %s' % (len(names), split, (~tile_index.valid).sum(),
+                                                           out_path))
+    return tile_index
+
+
+def load_tile_index(root_dir, split, build=True, num_workers=None):
+    """
+    TileIndex of a split, rebuilt if the list file changed since it was indexed
+    build: build a missing or outdated index (otherwise return None)
+    """
+    path = get_index_path(root_dir, split)
+    if os.path.exists(path):
+        with np.load(path) as f:
+            index = dict(f)
+        if str(index['list_sha1']) == hash_list_file(get_list_path(root_dir, split)):
+            return TileIndex(index, path=path)
+    if not build:
+        return None
+    return build_tile_index(root_dir, split, num_workers=num_workers)
+
+
+class TileIndex():
+    """
+    Per-tile statistics of a split (see build_tile_index)
+    """
+    def __init__(self, index, path=None):
+        self.path = path
+        self.list_sha1 = str(index['list_sha1'])
+        self.names = index['names']
+        self.exists = index['exists']
+        self.size = index['size']
+        self.size_match = index['size_match']
+        self.hist = index['hist']
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def valid(self):
+        # A, B and label present, readable and of the same size
+        return self.exists.all(1) & self.size_match
+
+    @property
+    def num_pixels(self):
+        return self.hist.sum(1)
+
+    @property
+    def change_ratio(self):
+        # fraction of label pixels > 0 per tile (0 for tiles without a label)
+        return self.hist[:, 1:].sum(1) / np.maximum(self.num_pixels, 1)
+
+    def class_counts(self, label_transform=None):
+        """
+        Pixel count of every class over the split, as the labels are read by CDDataset
+        (label_transform 'norm': value // 255); pixels of the ignore class (255) are added to the background
+        """
+        values = np.arange(256)
+        if label_transform == 'norm':
+            values = values // 255
+        values[values == 255] = 0
+        counts = np.bincount(values, weights=self.hist.sum(0), minlength=values.max() + 1).astype(np.int64)
+        num_classes = int(np.nonzero(counts)[0].max()) + 1 if counts.any() else 1
+        return counts[:num_classes].tolist()
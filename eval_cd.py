@@ -1,7 +1,6 @@
 from argparse import ArgumentParser
 import torch
 from models.evaluator import *
-print(torch.cuda.is_available())
 
 
 """
@@ -29,22 +28,54 @@ def main():
     parser.add_argument('--split', default="test", type=str)
 
     parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--materialize', default='off', type=str,
+                        help='off | uint8 | float: evaluation samples written once (<root_dir>/materialized) '
+                             'and read in contiguous batches')
 
     # model
     parser.add_argument('--n_class', default=2, type=int)
-    parser.add_argument('--dec_embed_dim', default=256, type=int)
+    parser.add_argument('--arch', default='base', type=str,
+                        help='architecture preset: tiny | small | base (the flags below override single values); '
+                             'checkpoints that store their architecture are rebuilt from it')
+    parser.add_argument('--enc_channels', default=None, type=str, help='encoder channels per stage, e.g. 64,96,128,256')
+    parser.add_argument('--depths', default=None, type=str, help='encoder blocks per stage, e.g. 3,3,4,3')
+    parser.add_argument('--heads', default=None, type=str, help='ELGCA heads per stage (>= 4), e.g. 4,4,4,4')
+    parser.add_argument('--mlp_ratios', default=None, type=str, help='MLP expansion per stage, e.g. 4,4,4,4')
+    parser.add_argument('--dec_embed_dim', default=None, type=int, help='decoder channels (default: from --arch)')
+    parser.add_argument('--stack_siamese', action='store_true',
+                        help='encode pre- and post-change images in a single batched pass')
+    parser.add_argument('--amp', default='off', type=str,
+                        help='mixed precision of the forward pass and loss: off | bf16 | fp16')
+    parser.add_argument('--compile', default='off', type=str,
+                        help='compiled forward pass for full batches: off | compile (torch.compile, falls back to script) | script (frozen TorchScript)')
+    parser.add_argument('--compile_cache', default=None, type=str,
+                        help='folder of the cached compiled artifacts (default: <checkpoints root>/compile_cache)')
+    parser.add_argument('--low_memory_decoder', action='store_true',
+                        help='fuse the decoder scales without concatenating them (lower peak memory)')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='channels_last (NHWC) memory format for the weights and activations')
+    parser.add_argument('--uint8_input', action='store_true',
+                        help='uint8 images from the loaders to the model, normalized in its first convolution '
+                             '(same weights, 1/4 of the input bytes)')
     parser.add_argument('--net_G', default='ELGCNet', type=str,
                         help='ELGCNet')
+    parser.add_argument('--backend', default='torch', type=str,
+                        help='inference backend: torch | onnx (onnxruntime on CPU, the checkpoint is exported to .onnx next to it)')
 
     # parser.add_argument('--checkpoint_name', default='checkpoint_best.pt', type=str)
-    parser.add_argument('--checkpoint_name', default='best_ckpt.pt', type=str)
+    parser.add_argument('--checkpoint_name', default='best_ckpt.pt', type=str,
+                        help='training checkpoint, inference weights exported by export_cd.py (*.weights) '
+                             'or an onnx model (*.onnx, --backend onnx)')
 
     args = parser.parse_args()
+    print(torch.cuda.is_available())
     utils.get_device(args)
     print(args.gpu_ids)
 
     #  checkpoints dir
     args.checkpoint_dir = os.path.join(args.checkpoints_root, args.project_name)
+    if args.compile_cache is None:
+        args.compile_cache = os.path.join(args.checkpoints_root, 'compile_cache')
     os.makedirs(args.checkpoint_dir, exist_ok=True)
     #  visualize dir
     args.vis_dir = os.path.join(args.vis_root, args.project_name)
@@ -52,7 +83,8 @@ def main():
 
     dataloader = utils.get_loader(args.data_name, img_size=args.img_size,
                                   batch_size=args.batch_size, is_train=False,
-                                  split=args.split)
+                                  split=args.split, dataset=args.dataset, materialize=args.materialize,
+                                  uint8=args.uint8_input)
     model = CDEvaluator(args=args, dataloader=dataloader)
     model.eval_models(checkpoint_name=args.checkpoint_name)
 
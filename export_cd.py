@@ -0,0 +1,82 @@
+from argparse import ArgumentParser
+import os
+import sys
+import torch
+
+from models.networks import define_G
+from models.export import export_weights, WEIGHTS_SUFFIX
+from models.onnx_backend import export_onnx, check_onnx_parity, OnnxCDModel, ONNX_SUFFIX
+
+
+"""
+export the inference weights (net_G only) of a training checkpoint,
+or an ONNX model for onnxruntime (--format onnx, checked against the torch model)
+"""
+
+def check_onnx(net_G, path, img_size, atol=1e-4, rtol=1e-3, iters=5):
+    """
+    parity (check_onnx_parity, raises ValueError on a mismatch) and per-batch latency of torch vs
+    onnxruntime at a few dynamic shapes
+    """
+    from misc.benchmark_tool import time_fn, format_latency
+
+    model = OnnxCDModel(path)
+    net_G.eval()
+    for shape, diff, agreement in check_onnx_parity(net_G, model, img_size, atol=atol, rtol=rtol):
+        x = torch.zeros(shape, dtype=torch.uint8 if net_G.uint8_input else torch.float32)
+        with torch.no_grad():
+            t_torch = time_fn(lambda: net_G(x, x), warmup=1, iters=iters)
+        t_onnx = time_fn(lambda: model(x, x), warmup=1, iters=iters)
+        print('%s: max diff %.2e, argmax agreement %.4f%% | torch %s | onnxruntime %s' % (
+            shape, diff, 100 * agreement, format_latency(t_torch), format_latency(t_onnx)))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--checkpoint', type=str, default='./checkpoints/elgcnet_levir/best_ckpt.pt')
+    parser.add_argument('--out', type=str, default=None,
+                        help='output file (defaults to the checkpoint path with a %s suffix)' % WEIGHTS_SUFFIX)
+    parser.add_argument('--format', default='weights', type=str,
+                        help='weights (inference weights for load_model) | onnx (onnxruntime, fp32)')
+    parser.add_argument('--dtype', default='fp32', type=str, help='fp32 | fp16 | bf16')
+    parser.add_argument('--img_size', default=256, type=int,
+                        help='onnx: size of the example input (height and width are dynamic, multiples of 64)')
+    parser.add_argument('--atol', default=1e-4, type=float, help='onnx: absolute tolerance of the parity check')
+    parser.add_argument('--rtol', default=1e-3, type=float, help='onnx: relative tolerance of the parity check')
+
+    # model
+    parser.add_argument('--n_class', default=2, type=int)
+    parser.add_argument('--dec_embed_dim', default=256, type=int)
+    parser.add_argument('--net_G', default='ELGCNet', type=str,
+                        help='ELGCNet')
+
+    args = parser.parse_args()
+    if args.format not in ['weights', 'onnx']:
+        raise NotImplementedError('export format [%s] is not implemented' % args.format)
+    out = args.out
+    if out is None:
+        out = os.path.splitext(args.checkpoint)[0] + (ONNX_SUFFIX if args.format == 'onnx' else WEIGHTS_SUFFIX)
+
+    checkpoint = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
+    net_G = define_G(args=args, gpu_ids=[], config=checkpoint.get('arch'))
+    net_G.load_state_dict(checkpoint['model_G_state_dict'])
+
+    if args.format == 'onnx':
+        export_onnx(net_G, out, img_size=args.img_size)
+        print('exported onnx model to %s (%.2f MB)' % (out, os.path.getsize(out) / 2**20))
+        try:
+            check_onnx(net_G, out, args.img_size, atol=args.atol, rtol=args.rtol)
+        except ValueError as e:
+            # a mismatching model must not be picked up by --backend onnx
+            os.remove(out)
+            print('%s\nremoved %s' % (e, out))
+            sys.exit(1)
+        return
+
+    export_weights(net_G.state_dict(), net_G.get_config(), out, dtype=args.dtype)
+    print('exported %s weights to %s (%.2f MB, checkpoint %.2f MB)' %
+          (args.dtype, out, os.path.getsize(out) / 2**20, os.path.getsize(args.checkpoint) / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+from argparse import ArgumentParser
+
+import data_config
+from datasets.tile_index import build_tile_index
+
+
+"""
+index the splits of a CD dataset: per-tile class counts, change ratio, image sizes and file checks
+(read by get_alpha, analyze_dataset.py and colab/prepare_data_balanced.py)
+"""
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train,val,test', type=str, help='comma separated list of splits')
+    parser.add_argument('--num_workers', default=None, type=int, help='indexing processes (default: cpu count)')
+    args = parser.parse_args()
+
+    root_dir = args.root_dir
+    if root_dir is None:
+        root_dir = data_config.DataConfig().get_data_config(args.data_name).root_dir
+    for split in args.split.split(','):
+        build_tile_index(root_dir, split, num_workers=args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
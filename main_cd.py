@@ -2,12 +2,15 @@ from argparse import ArgumentParser
 import torch
 from models.trainer import *
 import os
-print(torch.cuda.is_available())
 
 
 def train(args):
     dataloaders = utils.get_loaders(args)
-    model = CDTrainer(args=args, dataloaders=dataloaders)
+    if args.teacher is not None:
+        from models.distill import DistillCDTrainer
+        model = DistillCDTrainer(args=args, dataloaders=dataloaders)
+    else:
+        model = CDTrainer(args=args, dataloaders=dataloaders)
     model.train_models()
 
 
@@ -15,7 +18,8 @@ def test(args):
     from models.evaluator import CDEvaluator
     dataloader = utils.get_loader(args.data_name, img_size=args.img_size,
                                   batch_size=args.batch_size, is_train=False,
-                                  split='test')
+                                  split='test', dataset=args.dataset, materialize=args.val_materialize,
+                                  uint8=args.uint8_input)
     model = CDEvaluator(args=args, dataloader=dataloader)
 
     model.eval_models()
@@ -34,22 +38,84 @@ if __name__ == '__main__':
     # data
     parser.add_argument('--num_workers', default=8, type=int)
     parser.add_argument('--dataset', default='CDDataset', type=str)
+    parser.add_argument('--persistent_workers', action='store_true',
+                        help='keep the DataLoader workers alive between epochs')
+    parser.add_argument('--prefetch_factor', default=None, type=int, help='batches in flight per DataLoader worker')
+    parser.add_argument('--pin_memory', action='store_true', help='DataLoader batches in pinned memory (CUDA)')
+    parser.add_argument('--prefetch_batches', default=0, type=int,
+                        help='batches staged on the training device by a background thread (0: off)')
     parser.add_argument('--data_name', default='LEVIR', type=str)
     parser.add_argument('--batch_size', default=32, type=int)
     parser.add_argument('--split', default="train", type=str)
     parser.add_argument('--split_val', default="val", type=str)
 
     parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--augm_backend', default='pil', type=str,
+                        help='pil (per-sample PIL augmentation) | tensor (batched tensor augmentation)')
+    parser.add_argument('--augm_in_main', action='store_true',
+                        help='run the tensor augmentation in the main process on the training device')
+    parser.add_argument('--no_train_augm', action='store_true',
+                        help='no random augmentation of the training samples (only resized)')
+    parser.add_argument('--cache_mb', default=0, type=float,
+                        help='shared-memory cache of decoded tiles per cached split in MB (0: off, CDDataset only)')
+    parser.add_argument('--cache_splits', default='val', type=str, help='cached splits: val | train | train,val')
+    parser.add_argument('--val_materialize', default='off', type=str,
+                        help='off | uint8 | float: evaluation samples of the val/test split written once '
+                             '(<root_dir>/materialized) and read in contiguous batches')
+    parser.add_argument('--val_batch_size', default=None, type=int, help='val batch size (default: --batch_size)')
+    parser.add_argument('--sampler', default='uniform', type=str,
+                        help='uniform | change (training tiles drawn by change ratio, see datasets.change_sampler)')
+    parser.add_argument('--sampler_temperature', default=1.0, type=float,
+                        help='change sampler: 1 proportional to the change ratio, larger is closer to uniform')
+    parser.add_argument('--sampler_floor', default=0.01, type=float,
+                        help='change sampler: change ratio given to empty tiles')
+    parser.add_argument('--epoch_samples', default=None, type=int,
+                        help='training tiles per epoch (default: size of the split)')
 
     # model
     parser.add_argument('--n_class', default=2, type=int)
-    parser.add_argument('--dec_embed_dim', default=256, type=int)
+    parser.add_argument('--arch', default='base', type=str,
+                        help='architecture preset: tiny | small | base (the flags below override single values)')
+    parser.add_argument('--enc_channels', default=None, type=str, help='encoder channels per stage, e.g. 64,96,128,256')
+    parser.add_argument('--depths', default=None, type=str, help='encoder blocks per stage, e.g. 3,3,4,3')
+    parser.add_argument('--heads', default=None, type=str, help='ELGCA heads per stage (>= 4), e.g. 4,4,4,4')
+    parser.add_argument('--mlp_ratios', default=None, type=str, help='MLP expansion per stage, e.g. 4,4,4,4')
+    parser.add_argument('--dec_embed_dim', default=None, type=int, help='decoder channels (default: from --arch)')
     parser.add_argument('--pretrain', default=None, type=str)
 
+    parser.add_argument('--stack_siamese', action='store_true',
+                        help='encode pre- and post-change images in a single batched pass')
+    parser.add_argument('--amp', default='off', type=str,
+                        help='mixed precision of the forward pass and loss: off | bf16 | fp16')
+    parser.add_argument('--compile', default='off', type=str,
+                        help='compiled forward pass for full batches: off | compile (torch.compile)')
+    parser.add_argument('--compile_cache', default=None, type=str,
+                        help='folder of the cached compiled artifacts (default: <checkpoints root>/compile_cache)')
+    parser.add_argument('--low_memory_decoder', action='store_true',
+                        help='fuse the decoder scales without concatenating them (lower peak memory)')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='channels_last (NHWC) memory format for the weights and activations')
+    parser.add_argument('--uint8_input', action='store_true',
+                        help='uint8 images from the loaders to the model, normalized in its first convolution '
+                             '(same weights, 1/4 of the input bytes)')
+    parser.add_argument('--grad_checkpoint_stages', default='', type=str,
+                        help='encoder stages trained with activation checkpointing: all | e.g. 1,2 (default: none)')
+    parser.add_argument('--grad_checkpoint_every', default=1, type=int,
+                        help='number of encoder blocks per checkpointed segment')
     parser.add_argument('--net_G', default='ELGCNet', type=str,
                         help='ELGCNet|elgcnet')
     parser.add_argument('--loss', default='ce', type=str)
 
+    # distillation (net_G is the student)
+    parser.add_argument('--teacher', default=None, type=str,
+                        help='checkpoint or exported weights of a trained teacher ELGCNet (enables distillation)')
+    parser.add_argument('--distill_alpha', default=1.0, type=float, help='weight of the logit (KL) term')
+    parser.add_argument('--distill_temperature', default=4.0, type=float, help='temperature of the logit term')
+    parser.add_argument('--distill_beta', default=0.0, type=float,
+                        help='weight of the encoder feature term (0: off)')
+    parser.add_argument('--distill_cache', action='store_true',
+                        help='cache the teacher logits per sample (needs --no_train_augm and --distill_beta 0)')
+
     # optimizer
     parser.add_argument('--optimizer', default='adamw', type=str)
     parser.add_argument('--lr', default=0.00031, type=float)
@@ -57,13 +123,18 @@ if __name__ == '__main__':
     parser.add_argument('--lr_policy', default='linear', type=str,
                         help='linear | step')
     parser.add_argument('--lr_decay_iters', default=[100], type=int)
+    parser.add_argument('--target_mf1', default=None, type=float,
+                        help='log the optimizer steps until the val mF1 first reaches this value')
     
     args = parser.parse_args()
+    print(torch.cuda.is_available())
     utils.get_device(args)
     print(args.gpu_ids)
     
     #  checkpoints dir
     args.checkpoint_dir = os.path.join(args.checkpoint_root, args.project_name)
+    if args.compile_cache is None:
+        args.compile_cache = os.path.join(args.checkpoint_root, 'compile_cache')
     os.makedirs(args.checkpoint_dir, exist_ok=True)
     #  visualize dir
     args.vis_dir = os.path.join(args.vis_root, args.project_name)
@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+import torch
+
+
+def sync(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, warmup=3, iters=10, device='cpu'):
+    """
+    Run fn() warmup + iters times and return the per-call latencies (in seconds) of the timed calls
+    """
+    for _ in range(warmup):
+        fn()
+    sync(device)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        sync(device)
+        times.append(time.perf_counter() - start)
+    return np.asarray(times)
+
+
+def format_latency(times):
+    times = np.asarray(times) * 1000
+    return 'mean: %.2fms, p50: %.2fms, min: %.2fms' % (times.mean(), np.median(times), times.min())
+
+
+def read_proc_status(key):
+    # value in kB of a field of /proc/self/status (Linux)
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1])
+
+
+def measure_peak_memory(fn, device='cpu'):
+    """
+    Peak memory (MB) allocated by fn() on top of what is allocated before the call.
+    CUDA: max_memory_allocated. CPU (Linux): peak resident set size (VmHWM, reset before the call);
+    run with MALLOC_MMAP_THRESHOLD_=65536 so that freed tensors leave the resident set, and
+    preferably in a fresh process.
+    """
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        fn()
+        torch.cuda.synchronize(device)
+        return (torch.cuda.max_memory_allocated(device) - base) / 2**20
+    base = read_proc_status('VmRSS')
+    with open('/proc/self/clear_refs', 'w') as f:
+        # reset the peak resident set size
+        f.write('5')
+    fn()
+    return (read_proc_status('VmHWM') - base) / 1024
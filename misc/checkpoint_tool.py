@@ -0,0 +1,116 @@
+import os
+import queue
+import shutil
+import threading
+
+import torch
+
+
+def snapshot_to_cpu(obj):
+    """
+    Copy every tensor of a (nested) state dict to CPU memory, so that the training loop can keep
+    updating the originals while the copy is written
+    """
+    if torch.is_tensor(obj):
+        obj = obj.detach()
+        return obj.clone() if obj.device.type == 'cpu' else obj.to('cpu')
+    elif isinstance(obj, dict):
+        out = type(obj)((k, snapshot_to_cpu(v)) for k, v in obj.items())
+        # per-module versions of a state_dict, used by load_state_dict for backward-compatible loading
+        if hasattr(obj, '_metadata'):
+            out._metadata = obj._metadata
+        return out
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(v) for v in obj)
+    return obj
+
+
+def _fsync_dir(path):
+    # make the rename itself durable (not supported on every platform)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_save(obj, path):
+    """
+    torch.save through a temporary file synced to disk and a rename, a crash or power loss never leaves a
+    partial file at path
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+def atomic_copy(src, dst):
+    tmp_path = dst + '.tmp'
+    with open(src, 'rb') as f_src, open(tmp_path, 'wb') as f:
+        shutil.copyfileobj(f_src, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, dst)
+    _fsync_dir(dst)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread.
+    save() snapshots the state to CPU and returns; at most one write is kept pending, a further
+    save() blocks until the writer catches up.
+    """
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                state, path, copy_to = item
+                atomic_save(state, path)
+                # further copies are derived from the written file instead of serializing again
+                for dst in copy_to:
+                    atomic_copy(path, dst)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('checkpoint writer failed') from error
+
+    def save(self, state, path, copy_to=()):
+        """
+        state: checkpoint dict (tensors may live on any device)
+        path: destination file
+        copy_to: additional destination files receiving a copy of path once it is written
+        """
+        self._check_error()
+        self.queue.put((snapshot_to_cpu(state), path, list(copy_to)))
+
+    def flush(self):
+        """wait until every pending checkpoint is on disk"""
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
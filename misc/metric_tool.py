@@ -1,4 +1,5 @@
 import numpy as np
+import torch
 
 
 ###################       metrics      ###################
@@ -62,6 +63,39 @@ class ConfuseMatrixMeter(AverageMeter):
         return scores_dict
 
 
+class TorchConfuseMatrixMeter(object):
+    """
+    Accumulates the confusion matrix on the device of the predictions.
+    Nothing is copied to the host until a score is requested, so updates do not synchronize.
+    """
+    def __init__(self, n_class):
+        self.n_class = n_class
+        self.val = None
+        self.sum = None
+
+    def update_cm(self, pr, gt):
+        """
+        pr: torch.Tensor of predicted labels (N*H*W)
+        gt: torch.Tensor of ground-truth labels (N*1*H*W or N*H*W), pixels >= n_class are ignored
+        """
+        self.val = get_confuse_matrix_torch(self.n_class, gt, pr)
+        if self.sum is None:
+            self.sum = self.val.clone()
+        else:
+            self.sum += self.val
+
+    def get_running_score(self):
+        """mean F1 of the last batch"""
+        return cm2F1(self.val.cpu().numpy().astype(np.float64))
+
+    def get_scores(self):
+        scores_dict = cm2score(self.sum.cpu().numpy().astype(np.float64))
+        return scores_dict
+
+    def clear(self):
+        self.val = None
+        self.sum = None
+
 
 def harmonic_mean(xs):
     harmonic_mean = len(xs) / sum((x+1e-6)**-1 for x in xs)
@@ -156,6 +190,24 @@ def get_confuse_matrix(num_classes, label_gts, label_preds):
     return confusion_matrix
 
 
+def get_confuse_matrix_torch(num_classes, label_gts, label_preds):
+    """
+    torch counterpart of get_confuse_matrix, the result stays on the device of the inputs
+    """
+    gt = label_gts.flatten().long()
+    pr = label_preds.flatten().long()
+    # ignored pixels (e.g. 255) are counted in an extra bin instead of being masked out,
+    # boolean masking would need the number of valid pixels on the host
+    idx = torch.where(gt < num_classes, num_classes * gt + pr, torch.full_like(gt, num_classes ** 2))
+    if idx.is_cuda:
+        # bincount reads the max value on the host, index_add_ does not synchronize
+        hist = torch.zeros(num_classes ** 2 + 1, dtype=torch.int64, device=idx.device)
+        hist.index_add_(0, idx, torch.ones(1, dtype=torch.int64, device=idx.device).expand(idx.numel()))
+    else:
+        hist = torch.bincount(idx, minlength=num_classes ** 2 + 1)
+    return hist[:num_classes ** 2].view(num_classes, num_classes)
+
+
 def get_mIoU(num_classes, label_gts, label_preds):
     confusion_matrix = get_confuse_matrix(num_classes, label_gts, label_preds)
     score_dict = cm2score(confusion_matrix)
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import warnings
+import contextlib
+
+import torch
+
+
+"""
+Compiled forward pass of ELGCNet for fixed input shapes.
+compile: torch.compile (inductor) with the inductor cache (generated code and built kernels) in the cache dir.
+         If compilation fails (e.g. no C++ compiler), inference falls back to script, training to eager.
+         TORCHINDUCTOR_CACHE_DIR is only set while the compiled function runs (restored afterwards).
+script:  frozen TorchScript trace (inference only, the weights are baked in), saved to the cache dir
+Artifacts are keyed by the model config, input shape, device and torch version, script artifacts also by a
+hash of the weights. Inputs of any other shape (e.g. the last partial batch of an epoch) run through the
+eager model.
+"""
+COMPILE_MODES = ['off', 'compile', 'script']
+
+
+def get_weights_hash(net):
+    # sha1 of the state_dict (names, dtypes, shapes and values)
+    h = hashlib.sha1()
+    for name, t in net.state_dict().items():
+        t = t.detach().cpu().contiguous()
+        h.update(('%s %s %s\n' % (name, t.dtype, list(t.shape))).encode())
+        h.update(t.view(-1).view(torch.uint8).numpy().tobytes() if t.numel() else b'')
+    return h.hexdigest()
+
+
+@contextlib.contextmanager
+def inductor_cache_dir(path):
+    # inductor reads (and sets) TORCHINDUCTOR_CACHE_DIR when it compiles, scope it to the calls of this model
+    original = os.environ.get('TORCHINDUCTOR_CACHE_DIR')
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = path
+    try:
+        yield
+    finally:
+        if original is None:
+            os.environ.pop('TORCHINDUCTOR_CACHE_DIR', None)
+        else:
+            os.environ['TORCHINDUCTOR_CACHE_DIR'] = original
+
+
+def get_cache_key(net, input_shape, mode, device):
+    net = net.module if isinstance(net, torch.nn.DataParallel) else net
+    desc = {'config': net.get_config(), 'stack_siamese': net.stack_siamese,
+            'low_memory_decoder': net.dec.low_memory, 'channels_last': net.channels_last,
+            'uint8_input': net.uint8_input, 'input_shape': list(input_shape), 'mode': mode,
+            'device': torch.device(device).type, 'torch': torch.__version__}
+    if mode == 'script':
+        # the frozen module holds the weights, a model with other weights must not hit its artifact
+        desc['weights'] = get_weights_hash(net)
+    return hashlib.sha1(json.dumps(desc, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class CompiledForward():
+    """
+    Callable with the signature of ELGCNet.forward
+    net: ELGCNet (kept as is, its state_dict and training mode are not touched)
+    input_shape: N x C x H x W shape of each input image batch the compiled path is built for
+    mode: compile | script | off
+    cache_dir: folder of the compiled artifacts (None: no disk cache)
+    trainable: the weights of net change between calls (training), the frozen script mode is not allowed
+    """
+    def __init__(self, net, input_shape, mode='compile', cache_dir=None, device='cpu', trainable=False):
+        if mode not in COMPILE_MODES:
+            raise NotImplementedError('compile mode [%s] is not implemented (choose one from %s)'
+                                      % (mode, COMPILE_MODES))
+        if mode == 'script' and trainable:
+            raise ValueError('the frozen TorchScript mode is inference only, use compile for training')
+        self.net = net
+        self.input_shape = tuple(input_shape)
+        self.device = torch.device(device)
+        self.cache_dir = cache_dir
+        self.trainable = trainable
+        self.cache_hit = False
+        self._calls = 0
+        self._set_mode(mode)
+
+    def _set_mode(self, mode):
+        self.mode = mode
+        self.fn = None
+        self.cache_path = None
+        if self.cache_dir is not None and mode != 'off':
+            os.makedirs(self.cache_dir, exist_ok=True)
+            ext = '.pt' if mode == 'script' else ''
+            self.cache_path = os.path.join(self.cache_dir, '%s_%s%s' % (
+                mode, get_cache_key(self.net, self.input_shape, mode, self.device), ext))
+        if mode == 'compile':
+            if self.cache_path is not None:
+                # the portable cache artifacts of torch.compile do not include the built CPU kernels,
+                # the whole inductor cache of this key is kept instead (read by inductor on every compile)
+                self.cache_hit = os.path.isdir(self.cache_path) and len(os.listdir(self.cache_path)) > 0
+            self.fn = torch.compile(self.net, dynamic=False)
+        elif mode == 'script':
+            self.fn = self._get_script()
+
+    def _get_script(self):
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            self.cache_hit = True
+            return torch.jit.load(self.cache_path, map_location=self.device)
+        was_training = self.net.training
+        self.net.eval()
+        net = self.net.module if isinstance(self.net, torch.nn.DataParallel) else self.net
+        x = torch.zeros(self.input_shape, device=self.device, dtype=torch.uint8 if net.uint8_input else torch.float32)
+        with torch.no_grad():
+            module = torch.jit.freeze(torch.jit.trace(self.net, (x, x)))
+        self.net.train(was_training)
+        if self.cache_path is not None:
+            torch.jit.save(module, self.cache_path)
+        return module
+
+    def _use_compiled(self, x1):
+        if self.fn is None or tuple(x1.shape) != self.input_shape:
+            return False
+        # the frozen TorchScript module is an inference graph of fixed weights
+        return self.mode == 'compile' or not (self.net.training or torch.is_grad_enabled())
+
+    def __call__(self, x1, x2):
+        if not self._use_compiled(x1):
+            return self.net(x1, x2)
+        try:
+            if self.mode == 'compile' and self.cache_path is not None:
+                with inductor_cache_dir(os.path.abspath(self.cache_path)):
+                    out = self.fn(x1, x2)
+            else:
+                out = self.fn(x1, x2)
+        except Exception as e:
+            if self.mode != 'compile' or self._calls > 0:
+                raise
+            fallback = 'off' if self.trainable else 'script'
+            warnings.warn('torch.compile failed (%s), falling back to %s' %
+                          (e, 'the eager model' if fallback == 'off' else 'a frozen TorchScript module'))
+            self._set_mode(fallback)
+            return self(x1, x2)
+        self._calls += 1
+        return out
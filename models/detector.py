@@ -0,0 +1,204 @@
+import time
+import queue
+import asyncio
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from models.export import load_model
+
+
+"""
+Programmatic inference API with dynamic batching.
+Requests submitted from any number of threads or asyncio tasks are queued and coalesced by a
+single worker thread into batches of up to max_batch_size pairs (or whatever arrived within
+max_wait_ms), so the network runs once per batch instead of once per request.
+"""
+
+
+class _Request():
+    __slots__ = ['pre', 'post', 'return_prob', 'future', 'submitted']
+
+    def __init__(self, pre, post, return_prob):
+        self.pre = pre
+        self.post = post
+        self.return_prob = return_prob
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class ChangeDetector():
+    """
+    Thread-safe change detector
+    weights: exported inference weights (*.weights) or a training checkpoint
+    max_batch_size: maximum number of image pairs predicted together
+    max_wait_ms: how long the first request of a batch waits for more requests to arrive
+    latency_window: number of recent requests used for the latency percentiles
+
+    Usage:
+        with ChangeDetector('best_ckpt.weights') as detector:
+            change_map = detector.predict(pre, post)                # blocking
+            change_map = await detector.predict_async(pre, post)    # asyncio
+    """
+
+    def __init__(self, weights, device='cpu', max_batch_size=8, max_wait_ms=5.0, latency_window=10000,
+                 **kwargs):
+        self.device = torch.device(device)
+        self.net_G = load_model(weights, device=self.device, **kwargs)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self._batch_sizes = Counter()
+        self._num_requests = 0
+        self._num_batches = 0
+
+        self._worker = threading.Thread(target=self._run, name='ChangeDetector', daemon=True)
+        self._worker.start()
+
+    def submit(self, pre, post, return_prob=False):
+        """
+        Queue one image pair and return a concurrent.futures.Future
+        pre, post: H x W x 3 uint8 arrays of the same size (H and W multiples of 64)
+        return_prob: resolve to the H x W float32 change probability instead of the uint8 change map
+        """
+        pre, post = np.asarray(pre), np.asarray(post)
+        if pre.shape != post.shape or pre.ndim != 3 or pre.shape[2] != 3:
+            raise ValueError('pre and post must be H x W x 3 arrays of the same size, got %s and %s'
+                             % (pre.shape, post.shape))
+        if pre.shape[0] % 64 != 0 or pre.shape[1] % 64 != 0:
+            # ELGCA pools the 1/32 scale features by 2
+            raise ValueError('H and W must be multiples of 64, got %d x %d' % pre.shape[:2])
+        request = _Request(pre, post, return_prob)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('ChangeDetector is closed')
+            self._queue.put(request)
+        return request.future
+
+    def predict(self, pre, post, return_prob=False, timeout=None):
+        """
+        Blocking prediction of one image pair (see submit)
+        """
+        return self.submit(pre, post, return_prob).result(timeout)
+
+    async def predict_async(self, pre, post, return_prob=False):
+        """
+        Prediction of one image pair awaitable from an asyncio event loop (see submit)
+        """
+        return await asyncio.wrap_future(self.submit(pre, post, return_prob))
+
+    def _next_batch(self):
+        """
+        Block for the first request, then gather requests until the batch is full or
+        max_wait has elapsed. Returns None once the detector is closed.
+        """
+        request = self._queue.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else \
+                    self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # let the loop stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _to_tensor(self, imgs):
+        x = torch.from_numpy(np.stack(imgs)).to(self.device).permute(0, 3, 1, 2)
+        if getattr(self.net_G, 'uint8_input', False):
+            # the model normalizes the uint8 images in its first convolution
+            return x
+        x = x.float().div_(255)
+        # same normalization as CDDataAugmentation (mean=0.5, std=0.5)
+        return x.sub_(0.5).div_(0.5)
+
+    def _predict_group(self, group):
+        with torch.no_grad():
+            pred = self.net_G(self._to_tensor([r.pre for r in group]),
+                              self._to_tensor([r.post for r in group]))[-1]
+            prob = torch.softmax(pred.float(), dim=1)[:, -1].cpu().numpy()
+            label = torch.argmax(pred, dim=1).to(torch.uint8).cpu().numpy()
+        now = time.perf_counter()
+        for i, r in enumerate(group):
+            r.future.set_result(prob[i] if r.return_prob else label[i])
+        return [now - r.submitted for r in group]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            # pairs of different sizes cannot be stacked, run one forward pass per size
+            groups = {}
+            for r in batch:
+                if r.future.set_running_or_notify_cancel():
+                    groups.setdefault(r.pre.shape, []).append(r)
+            for group in groups.values():
+                try:
+                    latencies = self._predict_group(group)
+                except Exception as e:
+                    for r in group:
+                        if not r.future.done():
+                            r.future.set_exception(e)
+                    continue
+                with self._lock:
+                    self._latencies.extend(latencies)
+                    self._batch_sizes[len(group)] += 1
+                    self._num_requests += len(group)
+                    self._num_batches += 1
+
+    def get_metrics(self):
+        """
+        queue_depth: requests waiting for a batch
+        batch_size_hist: {batch size: number of forward passes}
+        latency_p50_ms / latency_p99_ms: submit-to-result latency of the recent requests
+        """
+        with self._lock:
+            latencies = np.asarray(self._latencies) * 1000
+            metrics = {'queue_depth': self._queue.qsize(),
+                       'requests': self._num_requests,
+                       'batches': self._num_batches,
+                       'batch_size_hist': dict(sorted(self._batch_sizes.items()))}
+        metrics['mean_batch_size'] = metrics['requests'] / max(metrics['batches'], 1)
+        metrics['latency_p50_ms'] = float(np.percentile(latencies, 50)) if len(latencies) else 0.0
+        metrics['latency_p99_ms'] = float(np.percentile(latencies, 99)) if len(latencies) else 0.0
+        return metrics
+
+    def reset_metrics(self):
+        with self._lock:
+            self._latencies.clear()
+            self._batch_sizes.clear()
+            self._num_requests = 0
+            self._num_batches = 0
+
+    def close(self):
+        """
+        Stop accepting requests, finish the queued ones and stop the worker thread
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
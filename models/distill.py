@@ -0,0 +1,208 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import utils
+from models.trainer import CDTrainer
+from models.networks import get_arch_config
+from models.export import load_model
+from misc.metric_tool import TorchConfuseMatrixMeter
+
+
+"""
+Knowledge distillation of a compact ELGCNet (the student, net_G) from a trained ELGCNet (the frozen teacher).
+G_loss = pxl_loss(student, label)
+         + distill_alpha * T^2 * KL(teacher || student)       per-pixel change probabilities at temperature T
+         + distill_beta * mean_s relative MSE(adapter_s(student_s), teacher_s)   Encoder.forward_features outputs
+The adapters are 1x1 convolutions from the student to the teacher channels of each stage, trained with
+the student (they are not part of net_G). Teacher logits are cached per sample when the training samples
+are deterministic (--no_train_augm) and the feature term is off.
+"""
+
+
+def kd_loss(student_logits, teacher_logits, temperature=4.0):
+    """
+    KL(teacher || student) of the per-pixel class distributions at the given temperature, mean over
+    pixels, scaled by T^2 to keep the gradient magnitude of the soft targets independent of T
+    """
+    log_p_s = F.log_softmax(student_logits.float() / temperature, dim=1)
+    log_p_t = F.log_softmax(teacher_logits.float() / temperature, dim=1)
+    kl = F.kl_div(log_p_s, log_p_t, reduction='none', log_target=True).sum(1)
+    return kl.mean() * temperature ** 2
+
+
+class FeatureAdapters(nn.Module):
+    """
+    1x1 convolutions mapping the student encoder features of each stage to the teacher channels.
+    The loss of a stage is the MSE relative to the mean square of the teacher features (scale free).
+    """
+    def __init__(self, student_channels, teacher_channels):
+        super(FeatureAdapters, self).__init__()
+        self.proj = nn.ModuleList([nn.Conv2d(c_s, c_t, 1) for c_s, c_t in zip(student_channels, teacher_channels)])
+
+    def forward(self, student_feats, teacher_feats):
+        loss = 0
+        for proj, f_s, f_t in zip(self.proj, student_feats, teacher_feats):
+            f_t = f_t.float()
+            loss = loss + F.mse_loss(proj(f_s).float(), f_t) / f_t.pow(2).mean().clamp_min(1e-6)
+        return loss / len(self.proj)
+
+
+class EncoderFeatures():
+    """
+    Records the Encoder.forward_features outputs of every encoder call of a network (two calls per
+    forward pass, one with stack_siamese)
+    """
+    def __init__(self, net):
+        net = net.module if isinstance(net, nn.DataParallel) else net
+        self.outputs = []
+        self.handle = net.enc.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        self.outputs.append(output)
+
+    def pop(self):
+        outputs, self.outputs = self.outputs, []
+        return outputs
+
+
+def is_deterministic(dataset):
+    # the samples of a dataset do not change between epochs (no random or batched augmentation)
+    augm = getattr(dataset, 'augm', None)
+    if augm is None or not getattr(dataset, 'normalize', True) or getattr(dataset, 'batch_augm', None) is not None:
+        return False
+    return not any([augm.with_random_hflip, augm.with_random_vflip, augm.with_random_rot, augm.with_random_crop,
+                    augm.with_scale_random_crop, augm.with_random_blur, augm.random_color_tf])
+
+
+class DistillCDTrainer(CDTrainer):
+    """
+    CDTrainer of net_G (the student, e.g. --arch tiny) with the distillation terms of a teacher
+    args.teacher: training checkpoint or exported weights (*.weights) of the teacher ELGCNet
+    args.distill_alpha: weight of the logit (KL) term
+    args.distill_temperature: softmax temperature of the logit term
+    args.distill_beta: weight of the feature term (0: off, no adapters)
+    args.distill_cache: cache the teacher logits of deterministic training samples
+    """
+    def __init__(self, args, dataloaders):
+        self.distill_alpha = getattr(args, 'distill_alpha', 1.0)
+        self.distill_temperature = getattr(args, 'distill_temperature', 4.0)
+        self.distill_beta = getattr(args, 'distill_beta', 0.0)
+
+        # frozen teacher, architecture from its checkpoint
+        self.teacher = load_model(args.teacher, channels_last=getattr(args, 'channels_last', False),
+                                  uint8_input=getattr(args, 'uint8_input', False),
+                                  stack_siamese=getattr(args, 'stack_siamese', False))
+        for p in self.teacher.parameters():
+            p.requires_grad_(False)
+
+        # the adapters are trained with net_G (see _get_trainable_parameters)
+        self.adapters = None
+        if self.distill_beta > 0:
+            self.adapters = FeatureAdapters(get_arch_config(args)['enc_channels'],
+                                            self.teacher.get_config()['enc_channels'])
+
+        super(DistillCDTrainer, self).__init__(args, dataloaders)
+
+        self.teacher.to(self.device)
+        self.teacher_features = None
+        self.student_features = None
+        if self.adapters is not None:
+            self.adapters.to(self.device)
+            self.teacher_features = EncoderFeatures(self.teacher)
+            self.student_features = EncoderFeatures(self.net_G)
+
+        # teacher logits per sample name, only valid if a sample is the same in every epoch
+        self.teacher_cache = None
+        if getattr(args, 'distill_cache', False):
+            if self.adapters is not None:
+                self.logger.write('teacher cache disabled: the feature term needs the teacher forward pass\n')
+            elif not is_deterministic(dataloaders['train'].dataset):
+                self.logger.write('teacher cache disabled: the training samples are augmented (see --no_train_augm)\n')
+            else:
+                self.teacher_cache = {}
+
+        # teacher scores on the val set (computed in the first val epoch, the val samples are fixed)
+        self.teacher_metric = TorchConfuseMatrixMeter(n_class=2)
+        self.teacher_val_mf1 = None
+        self.teacher_pred = None
+        self.kd_loss = torch.zeros(())
+        self.feat_loss = torch.zeros(())
+        self.distill_loss_sum = [0.0, 0.0, 0]
+
+        self.logger.write('distillation from %s, teacher %s, student %s\n' %
+                          (args.teacher, self.teacher.get_config(), self._net_G_config()))
+        self.logger.write('alpha %.3f, temperature %.2f, beta %.3f, teacher cache %s\n\n' %
+                          (self.distill_alpha, self.distill_temperature, self.distill_beta,
+                           self.teacher_cache is not None))
+
+    def _get_trainable_parameters(self):
+        params = list(self.net_G.parameters())
+        if self.adapters is not None:
+            params += list(self.adapters.parameters())
+        return params
+
+    def _checkpoint_state(self):
+        state = super(DistillCDTrainer, self)._checkpoint_state()
+        if self.adapters is not None:
+            state['distill_adapters_state_dict'] = self.adapters.state_dict()
+        return state
+
+    def _restore_checkpoint_state(self, checkpoint):
+        if self.adapters is not None and 'distill_adapters_state_dict' in checkpoint:
+            self.adapters.load_state_dict(checkpoint['distill_adapters_state_dict'])
+        super(DistillCDTrainer, self)._restore_checkpoint_state(checkpoint)
+
+    def _teacher_forward(self, batch):
+        names = batch['name']
+        if self.teacher_cache is not None and all(name in self.teacher_cache for name in names):
+            return torch.stack([self.teacher_cache[name] for name in names]).to(self.device)
+        with torch.no_grad(), utils.get_autocast(self.device, self.amp):
+            pred = self.teacher(batch['A'].to(self.device), batch['B'].to(self.device))[-1]
+        if self.teacher_cache is not None:
+            # half precision on the CPU (2 x H x W per sample)
+            for name, p in zip(names, pred.detach().to('cpu', torch.float16)):
+                self.teacher_cache[name] = p
+        return pred
+
+    def _forward_pass(self, batch):
+        super(DistillCDTrainer, self)._forward_pass(batch)
+        if self.is_training:
+            self.teacher_pred = self._teacher_forward(self.batch)
+        elif self.teacher_val_mf1 is None:
+            # teacher val scores of the first epoch, for the side by side log
+            with torch.no_grad(), utils.get_autocast(self.device, self.amp):
+                pred = self.teacher(self.batch['A'].to(self.device), self.batch['B'].to(self.device))[-1]
+            self.teacher_metric.update_cm(pr=torch.argmax(pred, dim=1), gt=self.batch['L'].to(self.device))
+        if self.student_features is not None and not self.is_training:
+            self.student_features.pop()
+            self.teacher_features.pop()
+
+    def _backward_G(self):
+        gt = self.batch['L'].to(self.device).float()
+        with utils.get_autocast(self.device, self.amp):
+            pxl_loss = self._pxl_loss(self.G_pred[-1], gt)
+            self.kd_loss = kd_loss(self.G_pred[-1], self.teacher_pred.to(self.G_pred[-1].dtype),
+                                   self.distill_temperature)
+            self.G_loss = pxl_loss + self.distill_alpha * self.kd_loss
+            if self.adapters is not None:
+                student_feats, teacher_feats = self.student_features.pop(), self.teacher_features.pop()
+                self.feat_loss = sum(self.adapters(f_s, f_t) for f_s, f_t in zip(student_feats, teacher_feats))
+                self.feat_loss = self.feat_loss / len(student_feats)
+                self.G_loss = self.G_loss + self.distill_beta * self.feat_loss
+
+        self.distill_loss_sum[0] += self.kd_loss.item()
+        self.distill_loss_sum[1] += float(self.feat_loss)
+        self.distill_loss_sum[2] += 1
+        self.scaler.scale(self.G_loss).backward()
+
+    def _collect_epoch_states(self):
+        super(DistillCDTrainer, self)._collect_epoch_states()
+        if self.is_training:
+            kd, feat, n = self.distill_loss_sum
+            self.logger.write('distillation: kd_loss %.5f, feat_loss %.5f\n\n' % (kd / max(n, 1), feat / max(n, 1)))
+            self.distill_loss_sum = [0.0, 0.0, 0]
+            return
+        if self.teacher_val_mf1 is None:
+            self.teacher_val_mf1 = self.teacher_metric.get_scores()['mf1']
+        self.logger.write('val mF1: student %.5f, teacher %.5f\n\n' % (self.epoch_acc, self.teacher_val_mf1))
@@ -1,17 +1,25 @@
-import types
 import math
+import warnings
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from functools import partial
-from scipy.io import savemat
+from torch.nn.init import trunc_normal_
+from torch.utils.checkpoint import checkpoint
 
-import timm
-from timm.models.layers import DropPath, to_2tuple, trunc_normal_
+
+# input normalization of the data sets (CDDataAugmentation): (x / 255 - mean) / std
+INPUT_MEAN = 0.5
+INPUT_STD = 0.5
 
 
 ######################################################################
+def to_2tuple(x):
+    if isinstance(x, (list, tuple)):
+        return tuple(x)
+    return (x, x)
+
+
 def resize(input,
            size=None,
            scale_factor=None,
@@ -33,6 +41,11 @@ def resize(input,
                         f'out size {(output_h, output_w)} is `nx+1`')
     return F.interpolate(input, size, scale_factor, mode, align_corners)
 
+
+def is_channels_last(x):
+    # NHWC strides (tensors that are contiguous in both formats, e.g. 1x1 maps, count as NCHW)
+    return x.dim() == 4 and not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last)
+
 ###########  Network Modules ###############
 class ConvLayer(nn.Module):
     def __init__(self, in_channels, out_channels, kernel_size, stride, padding):
@@ -59,16 +72,20 @@ class ResidualBlock(torch.nn.Module):
     """
     Residual convolutional block for feature enhancement in decoder
     """
-    def __init__(self, channels):
+    def __init__(self, channels, res_scale=0.1):
         super(ResidualBlock, self).__init__()
         self.conv1 = ConvLayer(channels, channels, kernel_size=3, stride=1, padding=1)
         self.conv2 = ConvLayer(channels, channels, kernel_size=3, stride=1, padding=1)
         self.relu = nn.ReLU()
+        # scale of the residual branch (set to 1 once it is folded into conv2, see models.fuse)
+        self.res_scale = res_scale
 
     def forward(self, x):
         residual = x
         out = self.relu(self.conv1(x))
-        out = self.conv2(out) * 0.1
+        out = self.conv2(out)
+        if self.res_scale != 1:
+            out = out * self.res_scale
         out = torch.add(out, residual)
         return out
 
@@ -79,14 +96,16 @@ class OverlapPatchEmbed(nn.Module):
     embed_dim: number of channels for output features
     patch_size: kernel size of the convolution
     stride: stride value of convolution
+    raw_input: inputs are raw 0-255 (e.g. uint8) images, the input normalization is folded into proj
     """
 
-    def __init__(self, patch_size=7, stride=4, in_chans=3, embed_dim=768):
+    def __init__(self, patch_size=7, stride=4, in_chans=3, embed_dim=768, raw_input=False):
         super().__init__()
 
         patch_size = to_2tuple(patch_size)
         self.proj = nn.Conv2d(in_chans, embed_dim, kernel_size=patch_size, stride=stride,
                               padding=(patch_size[0] // 2, patch_size[1] // 2))
+        self.raw_input = raw_input
         self.apply(self._init_weights)
 
     def _init_weights(self, m):
@@ -101,8 +120,19 @@ class OverlapPatchEmbed(nn.Module):
             if m.bias is not None:
                 m.bias.data.zero_()
 
+    def _proj_raw(self, x):
+        # proj((x / 255 - mean) / std) = conv(x, W / (255 * std), b - sum(W) * mean / std); the zero padding
+        # of the normalized input is the raw value 255 * mean
+        weight = self.proj.weight * (1.0 / (255 * INPUT_STD))
+        bias = -self.proj.weight.sum((1, 2, 3)) * (INPUT_MEAN / INPUT_STD)
+        if self.proj.bias is not None:
+            bias = bias + self.proj.bias
+        ph, pw = self.proj.padding
+        x = F.pad(x.to(weight.dtype), (pw, pw, ph, ph), value=255 * INPUT_MEAN)
+        return F.conv2d(x, weight, bias, self.proj.stride)
+
     def forward(self, x):
-        x = self.proj(x)
+        x = self._proj_raw(x) if self.raw_input else self.proj(x)
         _, _, H, W = x.shape
         return x, H, W
 
@@ -147,10 +177,12 @@ class ELGCA(nn.Module):
     """
     Efficient local global context aggregation module
     dim: number of channels of input
-    heads: number of heads utilized in computing attention
+    heads: number of heads utilized in computing attention (key, value, local feature and >= 1 query heads)
     """
     def __init__(self, dim, heads=4):
         super().__init__()
+        if heads < 4 or dim % 4 != 0:
+            raise ValueError('ELGCA needs heads >= 4 and dim divisible by 4, got heads=%d, dim=%d' % (heads, dim))
         self.heads = heads
         self.dwconv = nn.Conv2d(dim//2, dim//2, 3, padding=1, groups=dim//2)
         self.qkvl = nn.Conv2d(dim//2, (dim//4)*self.heads, 1, padding=0)
@@ -158,8 +190,13 @@ class ELGCA(nn.Module):
         self.pool_k = nn.MaxPool2d(kernel_size=2, stride=2, padding=0)
         
         self.act = nn.GELU()
+        # NHWC path for NHWC inputs, set by ELGCNet(channels_last=True); other NHWC inputs (e.g. the outputs
+        # of quantized convolutions, which wrap qkvl) take the default path
+        self.channels_last = False
 
     def forward(self, x):
+        if self.channels_last and is_channels_last(x) and isinstance(self.qkvl, nn.Conv2d):
+            return self._forward_channels_last(x)
         B, C, H, W = x.shape
         
         x1, x2 = torch.split(x, [C//2, C//2], dim=1)
@@ -181,7 +218,8 @@ class ELGCA(nn.Module):
         lfeat = x2[:,-1,:,:,:]
         
         qk = torch.matmul(q.flatten(2), k.flatten(2).transpose(1,2))
-        qk = torch.softmax(qk, dim=1).transpose(1,2)
+        # softmax in fp32 under autocast (no-op for fp32 inputs)
+        qk = torch.softmax(qk.float(), dim=1).to(v.dtype).transpose(1,2)
 
         x2 = torch.matmul(qk, v).reshape(B, C//4, H, W)
         
@@ -189,6 +227,44 @@ class ELGCA(nn.Module):
 
         return x
 
+    def _forward_channels_last(self, x):
+        """
+        Same as forward for NHWC inputs, computed on the B x H x W x C view: the heads are slices of
+        the last dim, so no head reshape or matmul operand is copied back to NCHW.
+        The split for the depth-wise convolution is the only copy (a dense NHWC half).
+        """
+        B, C, H, W = x.shape
+        C4 = C//4
+        xl = x.permute(0, 2, 3, 1)
+
+        # sliced on the NHWC view (its gradient is then allocated NHWC as well)
+        x1 = xl[..., :C//2].permute(0, 3, 1, 2)
+        x1 = self.act(self.dwconv(x1)).permute(0, 2, 3, 1)
+
+        # 1x1 projection as a linear layer on the strided NHWC half
+        x2 = self.act(F.linear(xl[..., C//2:], self.qkvl.weight.flatten(1), self.qkvl.bias))
+
+        q = x2[..., :-3*C4].unflatten(-1, (self.heads - 3, C4)).sum(-2)
+        q = self.pool_q(q.permute(0, 3, 1, 2)).permute(0, 2, 3, 1)
+        # 2x2 max pooling (pool_k) on the strided NHWC slice
+        k = x2[..., -3*C4:-2*C4][:, :H//2*2, :W//2*2]
+        k = k.unflatten(1, (H//2, 2)).unflatten(3, (W//2, 2)).amax(dim=(2, 4))
+
+        v = x2[..., -2*C4:-C4].flatten(1, 2)
+        lfeat = x2[..., -C4:]
+
+        # transpose of forward's qk, with N x C4 operands: the gradient of q (the right operand)
+        # stays NHWC for the pooling backward
+        kq = torch.matmul(k.flatten(1, 2).transpose(1, 2), q.flatten(1, 2))
+        kq = torch.softmax(kq.float(), dim=2).to(v.dtype)
+
+        # transpose of forward's qk^T @ v: HW x C4, i.e. NHWC
+        x2 = torch.matmul(v, kq.transpose(1, 2)).unflatten(1, (H, W))
+
+        x = torch.cat([x1, lfeat, x2], dim=-1)
+
+        return x.permute(0, 3, 1, 2)
+
 
 class EncoderBlock(nn.Module):
     """
@@ -248,16 +324,27 @@ class LayerNorm(nn.Module):
         if self.data_format not in ["channels_last", "channels_first"]:
             raise NotImplementedError 
         self.normalized_shape = (normalized_shape, )
+        # channels_first: NHWC path for NHWC inputs, set by ELGCNet(channels_last=True)
+        self.channels_last = False
     
     def forward(self, x):
         if self.data_format == "channels_last":
             return F.layer_norm(x, self.normalized_shape, self.weight, self.bias, self.eps)
         elif self.data_format == "channels_first":
+            # statistics in fp32 for fp16/bf16 inputs (autocast), in the input dtype otherwise
+            dtype = x.dtype
+            stat_dtype = torch.float32 if dtype in (torch.float16, torch.bfloat16) else dtype
+            x = x.to(stat_dtype)
+            weight, bias = self.weight.to(stat_dtype), self.bias.to(stat_dtype)
+            if self.channels_last and is_channels_last(x):
+                # NHWC: channels are the last dim of the permuted view
+                x = F.layer_norm(x.permute(0, 2, 3, 1), self.normalized_shape, weight, bias, self.eps)
+                return x.permute(0, 3, 1, 2).to(dtype)
             u = x.mean(1, keepdim=True)
             s = (x - u).pow(2).mean(1, keepdim=True)
             x = (x - u) / torch.sqrt(s + self.eps)
-            x = self.weight[:, None, None] * x + self.bias[:, None, None]
-            return x
+            x = weight[:, None, None] * x + bias[:, None, None]
+            return x.to(dtype)
 
 
 ################## Encoder #########################
@@ -265,11 +352,18 @@ class LayerNorm(nn.Module):
 class Encoder(nn.Module):
     def __init__(self, patch_size=3, in_chans=3, num_classes=2, embed_dims=[32, 64, 128, 256],
                  num_heads=[2, 2, 4, 8], mlp_ratios=[4, 4, 4, 4], drop_path_rate=0., heads=[4, 4, 4, 4],
-                 depths=[3, 3, 4, 3]):
+                 depths=[3, 3, 4, 3], checkpoint_stages=(), checkpoint_every=1):
         super().__init__()
         self.num_classes    = num_classes
         self.depths         = depths
         self.embed_dims     = embed_dims
+        # heads: ELGCA heads of each stage (num_heads is not used by ELGCA)
+        self.heads          = heads
+        self.mlp_ratios     = mlp_ratios
+        # activation checkpointing: stages (1-4) whose blocks are recomputed in the backward pass,
+        # in segments of checkpoint_every blocks
+        self.checkpoint_stages = tuple(checkpoint_stages)
+        self.checkpoint_every  = checkpoint_every
 
         # patch embedding definitions
         self.patch_embed1 = OverlapPatchEmbed(patch_size=7, stride=4, in_chans=in_chans, embed_dim=embed_dims[0])
@@ -283,28 +377,28 @@ class Encoder(nn.Module):
 
         self.block1 = nn.ModuleList()
         for i in range(depths[0]):
-            self.block1.append(EncoderBlock(dim=embed_dims[0], mlp_ratio=mlp_ratios[0]))
+            self.block1.append(EncoderBlock(dim=embed_dims[0], mlp_ratio=mlp_ratios[0], heads=heads[0]))
         
         ############# Stage-2 (x1/8 scale)
         #cur += depths[0]
 
         self.block2 = nn.ModuleList()
         for i in range(depths[1]):
-            self.block2.append(EncoderBlock(dim=embed_dims[1], mlp_ratio=mlp_ratios[1]))
+            self.block2.append(EncoderBlock(dim=embed_dims[1], mlp_ratio=mlp_ratios[1], heads=heads[1]))
        
        ############# Stage-3 (x1/16 scale)
         #cur += depths[1]
         
         self.block3 = nn.ModuleList()
         for i in range(depths[2]):
-            self.block3.append(EncoderBlock(dim=embed_dims[2], mlp_ratio=mlp_ratios[2]))
+            self.block3.append(EncoderBlock(dim=embed_dims[2], mlp_ratio=mlp_ratios[2], heads=heads[2]))
         
         ############# Stage-4 (x1/32 scale)
         #cur += depths[2]
 
         self.block4 = nn.ModuleList()
         for i in range(depths[3]):
-            self.block4.append(EncoderBlock(dim=embed_dims[3], mlp_ratio=mlp_ratios[3]))
+            self.block4.append(EncoderBlock(dim=embed_dims[3], mlp_ratio=mlp_ratios[3], heads=heads[3]))
 
         self.apply(self._init_weights)
 
@@ -326,32 +420,44 @@ class Encoder(nn.Module):
             if m.bias is not None:
                 m.bias.data.zero_()
     
+    def _run_blocks(self, blocks, x, H, W, stage):
+        if stage not in self.checkpoint_stages or not (self.training and torch.is_grad_enabled()):
+            for blk in blocks:
+                x = blk(x, H, W)
+            return x
+
+        def segment(x, start):
+            for blk in blocks[start:start + self.checkpoint_every]:
+                x = blk(x, H, W)
+            return x
+
+        # only the segment inputs are kept, the block activations are recomputed in backward
+        for start in range(0, len(blocks), self.checkpoint_every):
+            x = checkpoint(segment, x, start, use_reentrant=False)
+        return x
+
     def forward_features(self, x):
         B = x.shape[0]
         outs = []
     
         # stage 1
         x1, H1, W1 = self.patch_embed1(x)
-        for i, blk in enumerate(self.block1):
-            x1 = blk(x1, H1, W1)
+        x1 = self._run_blocks(self.block1, x1, H1, W1, stage=1)
         outs.append(x1)
 
         # stage 2
         x1, H1, W1 = self.patch_embed2(x1)
-        for i, blk in enumerate(self.block2):
-            x1 = blk(x1, H1, W1)
+        x1 = self._run_blocks(self.block2, x1, H1, W1, stage=2)
         outs.append(x1)
 
         # stage 3
         x1, H1, W1 = self.patch_embed3(x1)
-        for i, blk in enumerate(self.block3):
-            x1 = blk(x1, H1, W1)
+        x1 = self._run_blocks(self.block3, x1, H1, W1, stage=3)
         outs.append(x1)
 
         # stage 4
         x1, H1, W1 = self.patch_embed4(x1)
-        for i, blk in enumerate(self.block4):
-            x1 = blk(x1, H1, W1)
+        x1 = self._run_blocks(self.block4, x1, H1, W1, stage=4)
         outs.append(x1)
         
         return outs
@@ -363,11 +469,15 @@ class Encoder(nn.Module):
 class Decoder(nn.Module):
     """
     Transformer Decoder
+    low_memory: apply linear_fuse to each scale separately (coarse scales before upsampling) and sum,
+                instead of concatenating the upsampled features of all scales
     """
-    def __init__(self, in_channels = [32, 64, 128, 256], embedding_dim=64, output_nc=2, align_corners=True):
+    def __init__(self, in_channels = [32, 64, 128, 256], embedding_dim=64, output_nc=2, align_corners=True,
+                 low_memory=False):
         super(Decoder, self).__init__()
         
         #settings
+        self.low_memory      = low_memory
         self.align_corners   = align_corners
         self.in_channels     = in_channels
         self.embedding_dim   = embedding_dim
@@ -409,34 +519,75 @@ class Decoder(nn.Module):
         c1_2, c2_2, c3_2, c4_2 = inputs2        # len=4, 1/4, 1/8, 1/16, 1/32
 
         ############## MLP decoder on C1-C4 ###########
-        n, _, h, w = c4_1.shape
-
-        outputs = []
         # Stage 4: x1/32 scale
         _c4_1 = self.linear_c4(c4_1)
         _c4_2 = self.linear_c4(c4_2)
         _c4   = self.diff_c4([_c4_1, _c4_2])
-        _c4_up= resize(_c4, size=c1_2.size()[2:], mode='bilinear', align_corners=False)
 
         # Stage 3: x1/16 scale
         _c3_1 = self.linear_c3(c3_1)
         _c3_2 = self.linear_c3(c3_2)
         _c3   = self.diff_c3([_c3_1, _c3_2])
-        _c3_up= resize(_c3, size=c1_2.size()[2:], mode='bilinear', align_corners=False)
 
         # Stage 2: x1/8 scale
         _c2_1 = self.linear_c2(c2_1)
         _c2_2 = self.linear_c2(c2_2)
         _c2   = self.diff_c2([_c2_1, _c2_2])
-        _c2_up= resize(_c2, size=c1_2.size()[2:], mode='bilinear', align_corners=False)
 
         # Stage 1: x1/4 scale
         _c1_1 = self.linear_c1(c1_1)
         _c1_2 = self.linear_c1(c1_2)
         _c1   = self.diff_c1([_c1_1, _c1_2])
 
-        #Linear Fusion of difference image from all scales
-        _c = self.linear_fuse(torch.cat([_c4_up, _c3_up, _c2_up, _c1],dim=1))
+        return self._predict(_c4, _c3, _c2, _c1)
+
+    def forward_stacked(self, inputs):
+        """
+        Same as forward but takes the features of pre- and post-change images stacked along
+        the batch dimension ([x1; x2]). The channel projections run once on the stacked
+        features and the two branches are split only at the fusion blocks.
+        """
+        c1, c2, c3, c4 = inputs                 # len=4, 1/4, 1/8, 1/16, 1/32
+
+        # Stage 4: x1/32 scale
+        _c4 = self.diff_c4(self.linear_c4(c4).chunk(2, dim=0))
+
+        # Stage 3: x1/16 scale
+        _c3 = self.diff_c3(self.linear_c3(c3).chunk(2, dim=0))
+
+        # Stage 2: x1/8 scale
+        _c2 = self.diff_c2(self.linear_c2(c2).chunk(2, dim=0))
+
+        # Stage 1: x1/4 scale
+        _c1 = self.diff_c1(self.linear_c1(c1).chunk(2, dim=0))
+
+        return self._predict(_c4, _c3, _c2, _c1)
+
+    def _fuse_low_memory(self, _c4, _c3, _c2, _c1):
+        """
+        Same as linear_fuse(cat[up(_c4), up(_c3), up(_c2), _c1]) without the 4*embedding_dim concat.
+        The 1x1 conv is split into one conv per scale; as it commutes with bilinear upsampling,
+        the coarse scales are projected at their own resolution and then upsampled.
+        """
+        conv = self.linear_fuse[0]
+        w4, w3, w2, w1 = conv.weight.chunk(4, dim=1)
+        _c = F.conv2d(_c1, w1, conv.bias)
+        for x, w in [(_c2, w2), (_c3, w3), (_c4, w4)]:
+            _c = _c + resize(F.conv2d(x, w), size=_c1.size()[2:], mode='bilinear', align_corners=False)
+        return self.linear_fuse[1:](_c)
+
+    def _predict(self, _c4, _c3, _c2, _c1):
+        outputs = []
+        if self.low_memory:
+            _c = self._fuse_low_memory(_c4, _c3, _c2, _c1)
+        else:
+            # upsample the difference features of coarse scales to x1/4 scale
+            _c4_up= resize(_c4, size=_c1.size()[2:], mode='bilinear', align_corners=False)
+            _c3_up= resize(_c3, size=_c1.size()[2:], mode='bilinear', align_corners=False)
+            _c2_up= resize(_c2, size=_c1.size()[2:], mode='bilinear', align_corners=False)
+
+            #Linear Fusion of difference image from all scales
+            _c = self.linear_fuse(torch.cat([_c4_up, _c3_up, _c2_up, _c1],dim=1))
 
         #Upsampling x2 (x1/2 scale)
         x = self.convd2x(_c)
@@ -458,27 +609,71 @@ class Decoder(nn.Module):
 # ELGCNet
 class ELGCNet(nn.Module):
 
+    """
+    stack_siamese: encode pre- and post-change images in a single pass by stacking them along the
+                   batch dimension (produces the same change maps as encoding them separately)
+    low_memory_decoder: fuse the decoder scales without materializing their concatenation
+                        (see Decoder._fuse_low_memory)
+    checkpoint_stages: encoder stages (1-4) trained with activation checkpointing
+    checkpoint_every: number of encoder blocks per checkpointed segment
+    channels_last: NHWC (channels_last) weights and activations, the inputs are converted in forward
+    uint8_input: the inputs are unnormalized uint8 images, the normalization is folded into enc.patch_embed1
+                 (the weights are the same as in the normalized mode)
+    """
     def __init__(self, input_nc=3, output_nc=2, depths=[3, 3, 4, 3], heads=[4, 4, 4, 4],
-                 enc_channels=[64, 96, 128, 256], decoder_softmax=False, dec_embed_dim=256):
+                 enc_channels=[64, 96, 128, 256], decoder_softmax=False, dec_embed_dim=256, mlp_ratios=[4, 4, 4, 4],
+                 stack_siamese=False, low_memory_decoder=False, checkpoint_stages=(), checkpoint_every=1,
+                 channels_last=False, uint8_input=False):
         super(ELGCNet, self).__init__()
 
+        self.input_nc   = input_nc
+        self.output_nc  = output_nc
         self.embed_dims = enc_channels
         self.depths     = depths
+        self.heads      = heads
+        self.mlp_ratios = mlp_ratios
         self.embedding_dim = dec_embed_dim
         self.drop_path_rate = 0.1 
+        self.stack_siamese = stack_siamese
 
         # shared encoder
         self.enc = Encoder(patch_size=7, in_chans=input_nc, num_classes=output_nc, embed_dims=self.embed_dims,
-                                         heads=heads, mlp_ratios=[4, 4, 4, 4], drop_path_rate=self.drop_path_rate, depths=self.depths)
+                                         heads=heads, mlp_ratios=self.mlp_ratios, drop_path_rate=self.drop_path_rate, depths=self.depths,
+                                         checkpoint_stages=checkpoint_stages, checkpoint_every=checkpoint_every)
         
         # decoder
         self.dec = Decoder(in_channels=self.embed_dims, embedding_dim= self.embedding_dim, output_nc=output_nc, 
-                           align_corners=False)
+                           align_corners=False, low_memory=low_memory_decoder)
+
+        self.uint8_input = uint8_input
+        self.enc.patch_embed1.raw_input = uint8_input
+
+        self.channels_last = channels_last
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+        for m in self.modules():
+            if isinstance(m, (ELGCA, LayerNorm)):
+                m.channels_last = channels_last
+
+    def get_config(self):
+        """
+        architecture hyperparameters, ELGCNet(**config) rebuilds the same network
+        """
+        return {'input_nc': self.input_nc, 'output_nc': self.output_nc, 'depths': list(self.depths),
+                'heads': list(self.heads), 'enc_channels': list(self.embed_dims),
+                'dec_embed_dim': self.embedding_dim, 'mlp_ratios': list(self.mlp_ratios)}
 
     def forward(self, x1, x2):
-
-        fx1, fx2 = [self.enc(x1), self.enc(x2)]
-        change_map = self.dec(fx1, fx2)
+        if self.channels_last:
+            x1 = x1.contiguous(memory_format=torch.channels_last)
+            x2 = x2.contiguous(memory_format=torch.channels_last)
+
+        if self.stack_siamese:
+            fx = self.enc(torch.cat([x1, x2], dim=0))
+            change_map = self.dec.forward_stacked(fx)
+        else:
+            fx1, fx2 = [self.enc(x1), self.enc(x2)]
+            change_map = self.dec(fx1, fx2)
 
         return change_map
 
@@ -1,12 +1,15 @@
 import os
-import cv2
 import time
 import numpy as np
-import matplotlib.pyplot as plt
+import torch
 
-from models.networks import *
-from misc.metric_tool import ConfuseMatrixMeter
+from models.networks import define_G
+from models.elgcnet import ELGCNet
+from misc.metric_tool import TorchConfuseMatrixMeter
 from misc.logger_tool import Logger
+from models.export import load_exported, WEIGHTS_SUFFIX
+from models.compile import CompiledForward
+from models.onnx_backend import export_onnx, check_onnx_parity, OnnxCDModel, ONNX_SUFFIX
 from utils import de_norm
 import utils
 from collections import OrderedDict
@@ -27,7 +30,22 @@ class CDEvaluator():
         print(self.device)
 
         # define some other vars to record the training states
-        self.running_metric = ConfuseMatrixMeter(n_class=self.n_class)
+        self.running_metric = TorchConfuseMatrixMeter(n_class=self.n_class)
+
+        # mixed precision inference (--amp)
+        self.amp = getattr(args, 'amp', 'off')
+
+        # compiled forward pass (--compile), built once the weights are loaded
+        self.compile = getattr(args, 'compile', 'off')
+        self.compile_cache = getattr(args, 'compile_cache', None)
+        self.input_shape = (args.batch_size, 3, args.img_size, args.img_size)
+        self.forward_G = None
+
+        # inference backend (--backend): torch | onnx (onnxruntime on CPU)
+        self.backend = getattr(args, 'backend', 'torch')
+        self.img_size = args.img_size
+        self.forward_time = 0.0
+        self.num_pairs = 0
 
         # define logger file
         logger_path = os.path.join(args.checkpoint_dir, 'log_test.txt')
@@ -58,9 +76,39 @@ class CDEvaluator():
             os.mkdir(self.vis_dir)
 
 
+    def _load_exported(self, checkpoint_name):
+        # inference-only weights (see export_cd.py), the network is rebuilt from their header
+        self.logger.write('loading exported weights...\n')
+        net_G = self.net_G.module if isinstance(self.net_G, torch.nn.DataParallel) else self.net_G
+        net_G, config = load_exported(os.path.join(self.checkpoint_dir, checkpoint_name), device=self.device,
+                                      stack_siamese=net_G.stack_siamese,
+                                      low_memory_decoder=net_G.dec.low_memory,
+                                      channels_last=net_G.channels_last, uint8_input=net_G.uint8_input)
+        if isinstance(self.net_G, torch.nn.DataParallel):
+            net_G = torch.nn.DataParallel(net_G, self.net_G.device_ids)
+        self.net_G = net_G
+        self.logger.write('Eval exported model %s\n' % config)
+        self.logger.write('\n')
+
+    def _rebuild_net_G(self, config):
+        # the architecture stored in a checkpoint takes precedence over the --arch flags
+        net_G = self.net_G.module if isinstance(self.net_G, torch.nn.DataParallel) else self.net_G
+        if config is None or config == net_G.get_config():
+            return
+        self.logger.write('rebuilding net_G with the checkpoint architecture %s\n' % config)
+        net_G = ELGCNet(**config, stack_siamese=net_G.stack_siamese, low_memory_decoder=net_G.dec.low_memory,
+                        channels_last=net_G.channels_last, uint8_input=net_G.uint8_input).to(self.device)
+        if isinstance(self.net_G, torch.nn.DataParallel):
+            net_G = torch.nn.DataParallel(net_G, self.net_G.device_ids)
+        self.net_G = net_G
+
     def _load_checkpoint(self, checkpoint_name='best_ckpt.pt'):
 
-        if os.path.exists(os.path.join(self.checkpoint_dir, checkpoint_name)):
+        if checkpoint_name.endswith(WEIGHTS_SUFFIX) and \
+                os.path.exists(os.path.join(self.checkpoint_dir, checkpoint_name)):
+            self._load_exported(checkpoint_name)
+
+        elif os.path.exists(os.path.join(self.checkpoint_dir, checkpoint_name)):
             self.logger.write('loading last checkpoint...\n')
             # load the entire checkpoint
             # checkpoint = torch.load(os.path.join(self.checkpoint_dir, checkpoint_name), map_location='cpu')
@@ -80,6 +128,7 @@ class CDEvaluator():
             checkpoint['model_G_state_dict'] = state_dict_new
             '''
             
+            self._rebuild_net_G(checkpoint.get('arch'))
             if isinstance(self.net_G, torch.nn.DataParallel):
                 msg = self.net_G.module.load_state_dict(checkpoint['model_G_state_dict'])
             else:
@@ -92,14 +141,36 @@ class CDEvaluator():
             self.best_val_acc = checkpoint['best_val_acc']
             self.best_epoch_id = checkpoint['best_epoch_id']
 
-            self.logger.write('Eval Historical_best_acc = %.4f (at epoch %d)\n' %
-                  (self.best_val_acc, self.best_epoch_id))
+            self.logger.write('Eval Historical_best_acc = %.4f (at epoch %d, trained with amp=%s)\n' %
+                  (self.best_val_acc, self.best_epoch_id, checkpoint.get('amp', 'off')))
             self.logger.write('\n')
 
         else:
             raise FileNotFoundError('no such checkpoint %s' % checkpoint_name)
 
 
+    def _get_onnx_model(self, checkpoint_name):
+        """
+        onnx model given as checkpoint, or exported next to the torch checkpoint (re-exported if older)
+        """
+        path = os.path.join(self.checkpoint_dir, checkpoint_name)
+        if not checkpoint_name.endswith(ONNX_SUFFIX):
+            self._load_checkpoint(checkpoint_name)
+            net_G = self.net_G.module if isinstance(self.net_G, torch.nn.DataParallel) else self.net_G
+            # --uint8_input: the exported graph takes unnormalized images (cast to float by OnnxCDModel)
+            onnx_path = os.path.splitext(path)[0] + ('_uint8' if net_G.uint8_input else '') + ONNX_SUFFIX
+            if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(path):
+                self.logger.write('exporting %s to %s...\n' % (checkpoint_name, onnx_path))
+                export_onnx(net_G, onnx_path, img_size=self.img_size)
+                try:
+                    check_onnx_parity(net_G, OnnxCDModel(onnx_path), img_size=self.img_size)
+                except ValueError:
+                    os.remove(onnx_path)
+                    raise
+            path = onnx_path
+        self.logger.write('Eval onnx model %s with onnxruntime\n' % path)
+        return OnnxCDModel(path)
+
     def _visualize_pred(self):
         pred = torch.argmax(self.G_pred, dim=1, keepdim=True)
         pred_vis = pred * 255
@@ -114,20 +185,25 @@ class CDEvaluator():
         G_pred = self.G_pred.detach()
         G_pred = torch.argmax(G_pred, dim=1)
 
-        current_score = self.running_metric.update_cm(pr=G_pred.cpu().numpy(), gt=target.cpu().numpy())
-        return current_score
+        # accumulated on the device, scores are only computed when logged
+        self.running_metric.update_cm(pr=G_pred, gt=target)
 
     def _collect_running_batch_states(self):
 
-        running_acc = self._update_metric()
+        self._update_metric()
 
         m = len(self.dataloader)
 
         if np.mod(self.batch_id, 100) == 1:
+            running_acc = self.running_metric.get_running_score()
             message = 'Is_training: %s. [%d,%d],  running_mf1: %.5f\n' %\
                       (self.is_training, self.batch_id, m, running_acc)
             self.logger.write(message)
 
+        # visualization dependencies are imported on first use only
+        import cv2
+        import matplotlib.pyplot as plt
+
         #if np.mod(self.batch_id, 100) == 1:
         vis_input = utils.make_numpy_grid(de_norm(self.batch['A']))
         vis_input2 = utils.make_numpy_grid(de_norm(self.batch['B']))
@@ -161,22 +237,41 @@ class CDEvaluator():
         for k, v in scores_dict.items():
             message += '%s: %.5f ' % (k, v)
         self.logger.write('%s\n' % message)  # save the message
+        if self.num_pairs > 0:
+            self.logger.write('%s backend: %.1f pairs/s, %.1f ms/batch\n' % (
+                self.backend, self.num_pairs / self.forward_time, 1000 * self.forward_time / (self.batch_id + 1)))
 
         self.logger.write('\n')
 
     def _clear_cache(self):
         self.running_metric.clear()
+        self.forward_time = 0.0
+        self.num_pairs = 0
 
     def _forward_pass(self, batch):
         self.batch = batch
         img_in1 = batch['A'].to(self.device)
         img_in2 = batch['B'].to(self.device)
-        self.G_pred = self.net_G(img_in1, img_in2)[-1]
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        start = time.perf_counter()
+        with utils.get_autocast(self.device, self.amp):
+            self.G_pred = self.forward_G(img_in1, img_in2)[-1]
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self.forward_time += time.perf_counter() - start
+        self.num_pairs += img_in1.shape[0]
         
 
     def eval_models(self,checkpoint_name='best_ckpt.pt'):
 
-        self._load_checkpoint(checkpoint_name)
+        if self.backend == 'onnx':
+            self.forward_G = self._get_onnx_model(checkpoint_name)
+        elif self.backend == 'torch':
+            self._load_checkpoint(checkpoint_name)
+        else:
+            raise NotImplementedError('backend [%s] is not implemented (choose one from [torch, onnx])'
+                                      % self.backend)
 
         ################## Eval ##################
         ##########################################
@@ -184,6 +279,11 @@ class CDEvaluator():
         self._clear_cache()
         self.is_training = False
         self.net_G.eval()
+        if self.backend == 'torch':
+            self.forward_G = self.net_G
+        if self.backend == 'torch' and self.compile != 'off':
+            self.forward_G = CompiledForward(self.net_G, self.input_shape, mode=self.compile,
+                                             cache_dir=self.compile_cache, device=self.device)
 
         # Iterate over data.
         for self.batch_id, batch in enumerate(self.dataloader, 0):
@@ -0,0 +1,139 @@
+import os
+import json
+import inspect
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from models.elgcnet import ELGCNet
+
+
+"""
+Inference-only weights of ELGCNet in a flat, memory-mappable file:
+    [8 bytes: header length (little-endian uint64)][JSON header][padding][tensor data]
+The header stores the architecture config and, for every tensor of the state dict, its dtype,
+shape and byte offset (relative to the start of the data, aligned on ALIGNMENT bytes).
+"""
+MAGIC = 'elgcnet-weights'
+VERSION = 1
+ALIGNMENT = 64
+WEIGHTS_SUFFIX = '.weights'
+
+# bfloat16 has no numpy dtype, it is stored as raw 16-bit words
+NUMPY_DTYPES = {'float32': np.float32, 'float16': np.float16, 'bfloat16': np.uint16,
+                'int64': np.int64}
+TORCH_DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def _dtype_name(dtype):
+    return str(dtype).replace('torch.', '')
+
+
+def export_weights(state_dict, config, out_path, dtype='fp32'):
+    """
+    state_dict: state dict of net_G (without optimizer or training states)
+    config: architecture hyperparameters (ELGCNet.get_config())
+    dtype: storage precision of floating point tensors: fp32 | fp16 | bf16
+    """
+    if dtype not in TORCH_DTYPES:
+        raise NotImplementedError('export dtype [%s] is not supported (fp32 | fp16 | bf16)' % dtype)
+    tensors = []
+    entries = {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu()
+        if tensor.is_floating_point():
+            tensor = tensor.to(TORCH_DTYPES[dtype])
+        tensor = tensor.contiguous()
+        nbytes = tensor.numel() * tensor.element_size()
+        entries[name] = {'dtype': _dtype_name(tensor.dtype), 'shape': list(tensor.shape),
+                         'offset': offset, 'nbytes': nbytes}
+        tensors.append(tensor)
+        offset += nbytes + (-nbytes % ALIGNMENT)
+
+    header = json.dumps({'format': MAGIC, 'version': VERSION, 'config': config,
+                         'tensors': entries}).encode('utf-8')
+    data_start = 8 + len(header)
+    data_start += -data_start % ALIGNMENT
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        f.write(b'\0' * (data_start - 8 - len(header)))
+        for tensor, entry in zip(tensors, entries.values()):
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            f.write(tensor.numpy().tobytes())
+            f.write(b'\0' * (-entry['nbytes'] % ALIGNMENT))
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def read_exported(path):
+    """
+    Return (state_dict, config); the tensors are copy-on-write views of the memory-mapped file
+    """
+    with open(path, 'rb') as f:
+        header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    if header.get('format') != MAGIC:
+        raise ValueError('%s is not an exported ELGCNet weights file' % path)
+    data_start = 8 + header_len
+    data_start += -data_start % ALIGNMENT
+
+    buf = np.memmap(path, dtype=np.uint8, mode='c')
+    state_dict = {}
+    for name, entry in header['tensors'].items():
+        start = data_start + entry['offset']
+        arr = buf[start:start + entry['nbytes']].view(NUMPY_DTYPES[entry['dtype']]).reshape(entry['shape'])
+        tensor = torch.from_numpy(arr)
+        if entry['dtype'] == 'bfloat16':
+            tensor = tensor.view(torch.bfloat16)
+        state_dict[name] = tensor
+    return state_dict, header['config']
+
+
+def load_exported(path, device='cpu', dtype=torch.float32, **kwargs):
+    """
+    Build ELGCNet from the header of an exported weights file and load its weights.
+    With fp32 storage on CPU the parameters share memory with the mapped file (no copy).
+    dtype: precision of the returned model (None keeps the storage precision)
+    kwargs: additional (non architecture) arguments of ELGCNet, e.g. stack_siamese, low_memory_decoder
+    """
+    state_dict, config = read_exported(path)
+    if dtype is not None:
+        state_dict = {k: v.to(dtype) if v.is_floating_point() else v for k, v in state_dict.items()}
+
+    config = dict(config, **kwargs)
+    if 'assign' in inspect.signature(nn.Module.load_state_dict).parameters:
+        # skip the random initialization, parameters are replaced by the mapped tensors
+        with torch.device('meta'):
+            net = ELGCNet(**config)
+        net.load_state_dict(state_dict, assign=True)
+    else:
+        net = ELGCNet(**config)
+        net.load_state_dict(state_dict)
+    if net.channels_last:
+        # the assigned (mapped) tensors are NCHW
+        net.to(memory_format=torch.channels_last)
+    net.to(device)
+    net.eval()
+    return net, config
+
+
+def load_model(path, device='cpu', **kwargs):
+    """
+    Load an evaluation model from exported weights (*.weights) or from a training checkpoint
+    kwargs: additional (non architecture) arguments of ELGCNet, e.g. stack_siamese, low_memory_decoder
+    """
+    if path.endswith(WEIGHTS_SUFFIX):
+        return load_exported(path, device=device, **kwargs)[0]
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+    # architecture stored by the trainer (older checkpoints: the default ELGCNet)
+    net = ELGCNet(**dict(checkpoint.get('arch', {}), **kwargs))
+    net.load_state_dict(checkpoint['model_G_state_dict'])
+    net.to(device)
+    net.eval()
+    return net
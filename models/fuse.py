@@ -0,0 +1,82 @@
+import copy
+
+import torch
+import torch.nn as nn
+
+from models.elgcnet import ResidualBlock
+
+
+"""
+Offline folding of the linear chains of the ELGCNet decoder for inference:
+- linear_c* (1x1 conv per temporal branch) into split input weights of the Fusion_Block 1x1 conv,
+- BatchNorm2d of linear_fuse into its 1x1 conv,
+- the 0.1 scale of the ResidualBlock branches into their conv2.
+The folded network computes the same change maps with fewer layers and FLOPs.
+"""
+
+
+def fold_linear_into_fusion(linear, fusion):
+    """
+    fusion(cat[linear(x1), linear(x2)]) == folded(cat[x1, x2])
+    linear: 1x1 Conv2d (C -> E), fusion: 1x1 Conv2d (2E -> E). Returns a 1x1 Conv2d (2C -> E)
+    """
+    w_l = linear.weight.flatten(1)                      # E x C
+    w_1, w_2 = fusion.weight.flatten(1).chunk(2, dim=1)  # E x E each
+    b_l = linear.bias if linear.bias is not None else torch.zeros_like(w_l[:, 0])
+    b_f = fusion.bias if fusion.bias is not None else torch.zeros_like(w_1[:, 0])
+
+    folded = nn.Conv2d(2 * w_l.shape[1], w_1.shape[0], 1, stride=1, padding=0, bias=True)
+    folded = folded.to(device=w_l.device, dtype=w_l.dtype)
+    with torch.no_grad():
+        folded.weight.copy_(torch.cat([w_1 @ w_l, w_2 @ w_l], dim=1)[:, :, None, None])
+        folded.bias.copy_(b_f + (w_1 + w_2) @ b_l)
+    return folded
+
+
+def fold_bn_into_conv(conv, bn):
+    """
+    bn(conv(x)) == folded(x) with the running statistics of bn (eval mode)
+    """
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+
+    folded = copy.deepcopy(conv)
+    if folded.bias is None:
+        folded.bias = nn.Parameter(torch.zeros_like(bn.running_mean))
+    with torch.no_grad():
+        folded.weight.mul_(scale.view(-1, 1, 1, 1))
+        folded.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return folded
+
+
+def fold_residual_scale(block):
+    with torch.no_grad():
+        block.conv2.conv2d.weight.mul_(block.res_scale)
+        block.conv2.conv2d.bias.mul_(block.res_scale)
+    block.res_scale = 1
+
+
+def fuse_for_inference(net_G):
+    """
+    Return an equivalent inference-only copy of an ELGCNet with the decoder linear chains folded.
+    The copy is in eval mode; its state_dict no longer matches ELGCNet (it cannot be trained or
+    loaded from checkpoints).
+    """
+    net = copy.deepcopy(net_G).eval()
+    dec = net.dec
+    for i in range(1, 5):
+        linear, fusion = getattr(dec, 'linear_c%d' % i), getattr(dec, 'diff_c%d' % i)
+        fusion.proj = fold_linear_into_fusion(linear.proj, fusion.proj)
+        setattr(dec, 'linear_c%d' % i, nn.Identity())
+
+    if isinstance(dec.linear_fuse[1], nn.BatchNorm2d):
+        dec.linear_fuse[0] = fold_bn_into_conv(dec.linear_fuse[0], dec.linear_fuse[1])
+        dec.linear_fuse[1] = nn.Identity()
+
+    for m in net.modules():
+        if isinstance(m, ResidualBlock) and m.res_scale != 1:
+            fold_residual_scale(m)
+    if getattr(net, 'channels_last', False):
+        # the folded 1x1 convs are created in NCHW
+        net.to(memory_format=torch.channels_last)
+    return net
@@ -22,6 +22,15 @@ def cross_entropy(input, target, weight=None, reduction='mean',ignore_index=255)
 
 #Focal Loss
 def get_alpha(supervised_loader):
+    # class occurrences from the tile index of the split (datasets.tile_index), built once if missing
+    dataset = supervised_loader.dataset
+    if hasattr(dataset, 'root_dir') and hasattr(dataset, 'split'):
+        from datasets.tile_index import load_tile_index
+        index = load_tile_index(dataset.root_dir, dataset.split)
+        return index.class_counts(getattr(dataset, 'label_transform', None))
+    return count_classes(supervised_loader)
+
+def count_classes(supervised_loader):
     # get number of classes
     num_labels = 0
     for batch in supervised_loader:
@@ -37,9 +37,65 @@ def get_scheduler(optimizer, args):
     return scheduler
 
 
-def define_G(args, gpu_ids=[]):
+# architecture hyperparameters of ELGCNet (see ELGCNet.get_config), base is the published model
+ARCH_PRESETS = {
+    'tiny': {'enc_channels': [32, 48, 64, 128], 'depths': [2, 2, 2, 2], 'heads': [4, 4, 4, 4],
+             'mlp_ratios': [2, 2, 2, 2], 'dec_embed_dim': 64},
+    'small': {'enc_channels': [48, 64, 96, 192], 'depths': [2, 2, 3, 2], 'heads': [4, 4, 4, 4],
+              'mlp_ratios': [4, 4, 4, 4], 'dec_embed_dim': 128},
+    'base': {'enc_channels': [64, 96, 128, 256], 'depths': [3, 3, 4, 3], 'heads': [4, 4, 4, 4],
+             'mlp_ratios': [4, 4, 4, 4], 'dec_embed_dim': 256},
+}
+
+
+def get_arch_config(args):
+    """
+    architecture hyperparameters: the preset args.arch (default base) with the explicitly set
+    --enc_channels, --depths, --heads, --mlp_ratios (comma separated, one value per stage) and --dec_embed_dim
+    """
+    arch = getattr(args, 'arch', None) or 'base'
+    if arch not in ARCH_PRESETS:
+        raise NotImplementedError('architecture preset [%s] is not implemented (choose one from %s)'
+                                  % (arch, list(ARCH_PRESETS)))
+    config = dict(ARCH_PRESETS[arch])
+    for key in ['enc_channels', 'depths', 'heads', 'mlp_ratios']:
+        value = getattr(args, key, None)
+        if value:
+            values = [int(v) for v in value.split(',')] if isinstance(value, str) else list(value)
+            if len(values) != 4:
+                raise ValueError('--%s needs one value per encoder stage (4), got %s' % (key, value))
+            config[key] = values
+    if getattr(args, 'dec_embed_dim', None):
+        config['dec_embed_dim'] = args.dec_embed_dim
+    config['output_nc'] = getattr(args, 'n_class', 2)
+    return config
+
+
+def get_checkpoint_stages(args):
+    """encoder stages trained with activation checkpointing: '' (none) | 'all' | comma separated, e.g. '1,2'"""
+    stages = getattr(args, 'grad_checkpoint_stages', '')
+    if stages == 'all':
+        return (1, 2, 3, 4)
+    stages = tuple(int(s) for s in stages.split(',') if s)
+    if any(s not in (1, 2, 3, 4) for s in stages):
+        raise ValueError('checkpoint stages must be in 1-4, got %s' % (stages,))
+    return stages
+
+
+def define_G(args, gpu_ids=[], config=None):
+    """
+    config: architecture hyperparameters (ELGCNet.get_config(), e.g. stored in a checkpoint),
+            by default from the args (see get_arch_config)
+    """
     if args.net_G.lower() == 'ELGCNet'.lower():
-        net = ELGCNet(dec_embed_dim=args.dec_embed_dim)
+        config = get_arch_config(args) if config is None else config
+        net = ELGCNet(**config,
+                      stack_siamese=getattr(args, 'stack_siamese', False),
+                      low_memory_decoder=getattr(args, 'low_memory_decoder', False),
+                      checkpoint_stages=get_checkpoint_stages(args),
+                      checkpoint_every=getattr(args, 'grad_checkpoint_every', 1),
+                      channels_last=getattr(args, 'channels_last', False),
+                      uint8_input=getattr(args, 'uint8_input', False))
     else:
         raise NotImplementedError('Generator model name [%s] is not recognized' % args.net_G)
 
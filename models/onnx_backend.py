@@ -0,0 +1,113 @@
+import os
+import inspect
+
+import numpy as np
+
+
+"""
+ONNX export of ELGCNet and an onnxruntime runner with the call signature of the torch model.
+The runner only needs numpy and onnxruntime; torch is imported only to export or when it is
+called with torch tensors.
+Batch, height and width are dynamic axes; height and width must be multiples of 64
+(ELGCA pools the 1/32 scale features by 2).
+"""
+ONNX_SUFFIX = '.onnx'
+INPUT_NAMES = ['pre', 'post']
+OUTPUT_NAMES = ['change']
+
+
+def export_onnx(net_G, out_path, img_size=256, opset=17):
+    """
+    Export net_G (ELGCNet) to ONNX with dynamic batch and spatial axes
+    img_size: spatial size of the example input used for tracing
+    """
+    import torch
+
+    dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in INPUT_NAMES + OUTPUT_NAMES}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript-based exporter handles the dynamic reshapes of ELGCA
+        kwargs['dynamo'] = False
+
+    device = next(net_G.parameters()).device
+    x = torch.zeros(1, 3, img_size, img_size, device=device)
+    was_training = net_G.training
+    net_G.eval()
+    with torch.no_grad():
+        torch.onnx.export(net_G, (x, x), out_path, input_names=INPUT_NAMES, output_names=OUTPUT_NAMES,
+                          dynamic_axes=dynamic_axes, opset_version=opset, **kwargs)
+    net_G.train(was_training)
+    return out_path
+
+
+def check_onnx_parity(net_G, model, img_size=256, atol=1e-4, rtol=1e-3, min_agreement=0.999):
+    """
+    Compare the outputs of net_G and of the onnxruntime model at a few dynamic shapes.
+    The logits must match within atol + rtol * |torch logits| and the predicted classes must agree on at
+    least min_agreement of the pixels, a ValueError is raised otherwise.
+    Returns [(shape, max abs diff, argmax agreement)].
+    """
+    import torch
+
+    device = next(net_G.parameters()).device
+    uint8_input = getattr(net_G, 'uint8_input', False)
+    was_training = net_G.training
+    net_G.eval()
+    results, errors = [], []
+    generator = torch.Generator().manual_seed(0)
+    for shape in [(1, 3, img_size, img_size), (2, 3, img_size, img_size + 64)]:
+        if uint8_input:
+            x1, x2 = [torch.randint(0, 256, shape, generator=generator, dtype=torch.uint8) for _ in range(2)]
+        else:
+            x1, x2 = [torch.randn(shape, generator=generator) for _ in range(2)]
+        with torch.no_grad():
+            ref = net_G(x1.to(device), x2.to(device))[-1].float().cpu()
+        out = model(x1, x2)[-1].float().cpu()
+        diff = (out - ref).abs().max().item()
+        agreement = (out.argmax(1) == ref.argmax(1)).float().mean().item()
+        results.append((list(shape), diff, agreement))
+        if not torch.allclose(out, ref, atol=atol, rtol=rtol):
+            errors.append('%s: max abs diff %.2e exceeds atol %.0e + rtol %.0e' % (list(shape), diff, atol, rtol))
+        if agreement < min_agreement:
+            errors.append('%s: predictions agree on %.4f%% of the pixels (< %.4f%%)'
+                          % (list(shape), 100 * agreement, 100 * min_agreement))
+    net_G.train(was_training)
+    if errors:
+        raise ValueError('onnx model %s does not match the torch model:\n  %s' % (model.path, '\n  '.join(errors)))
+    return results
+
+
+class OnnxCDModel():
+    """
+    onnxruntime session of an exported model, callable like ELGCNet: model(x1, x2) -> [change logits]
+    Inputs are N x 3 x H x W float arrays (numpy or torch, normalized as for the torch model).
+    num_threads: intra-op threads of onnxruntime (None: onnxruntime default)
+    """
+    def __init__(self, path, num_threads=None, providers=('CPUExecutionProvider',)):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError('onnxruntime is required for the onnx backend (pip install onnxruntime)')
+        if not os.path.exists(path):
+            raise FileNotFoundError('no such onnx model %s' % path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=list(providers))
+
+    def __call__(self, x1, x2):
+        is_tensor = hasattr(x1, 'detach')
+        feed = {INPUT_NAMES[0]: self._to_numpy(x1), INPUT_NAMES[1]: self._to_numpy(x2)}
+        out = self.session.run(OUTPUT_NAMES, feed)[0]
+        if is_tensor:
+            import torch
+            return [torch.from_numpy(out).to(x1.device)]
+        return [out]
+
+    @staticmethod
+    def _to_numpy(x):
+        if hasattr(x, 'detach'):
+            x = x.detach().float().cpu().numpy()
+        return np.ascontiguousarray(x, dtype=np.float32)
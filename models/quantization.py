@@ -0,0 +1,105 @@
+import copy
+
+import torch
+import torch.nn as nn
+from torch.ao import quantization as tq
+
+
+"""
+Post-training static INT8 quantization of ELGCNet for CPU inference (eager mode).
+Every Conv2d / ConvTranspose2d is wrapped between a quantize and a dequantize stub, so the
+convolutions run on quantized kernels while the channels-first LayerNorm, GELU, pooling and the
+matmul/softmax of ELGCA stay in float. The BatchNorm of the decoder fusion layer is folded into
+its convolution before quantization (unless already done by models.fuse.fuse_for_inference).
+"""
+QUANTIZED_MODULES = (nn.Conv2d, nn.ConvTranspose2d)
+
+
+def get_qconfig(module, backend):
+    if isinstance(module, nn.ConvTranspose2d):
+        # quantized transposed convolutions only support per-tensor weight quantization
+        return tq.QConfig(activation=tq.HistogramObserver.with_args(reduce_range=backend == 'fbgemm'),
+                          weight=tq.default_weight_observer)
+    return tq.get_default_qconfig(backend)
+
+
+def _wrap_convs(module, backend, skip, prefix=''):
+    for name, child in module.named_children():
+        full_name = prefix + name
+        if full_name in skip:
+            continue
+        if isinstance(child, QUANTIZED_MODULES):
+            wrapper = tq.QuantWrapper(child)
+            wrapper.qconfig = get_qconfig(child, backend)
+            setattr(module, name, wrapper)
+        else:
+            _wrap_convs(child, backend, skip, prefix=full_name + '.')
+
+
+def prepare_quantization(net_G, backend='fbgemm', skip=()):
+    """
+    Return an observed float copy of net_G, ready for calibration
+    backend: fbgemm (x86) | qnnpack (ARM)
+    skip: names of modules kept in float (e.g. 'dec.change_probability')
+    The model must be built without uint8_input and channels_last: both read the float weights of wrapped
+    convolutions (OverlapPatchEmbed._proj_raw, the NHWC path of ELGCA).
+    """
+    for flag in ['uint8_input', 'channels_last']:
+        if getattr(net_G, flag, False):
+            raise ValueError('quantization does not support models built with %s=True, '
+                             'build net_G without it (the weights are the same)' % flag)
+    if backend not in torch.backends.quantized.supported_engines:
+        raise NotImplementedError('quantization backend [%s] is not supported by this build of torch '
+                                  '(supported: %s)' % (backend, torch.backends.quantized.supported_engines))
+    torch.backends.quantized.engine = backend
+
+    net = copy.deepcopy(net_G).cpu().eval()
+    # the low-memory decoder reads the float weights of linear_fuse, the quantized copy uses the concat path
+    net.dec.low_memory = False
+    if isinstance(net.dec.linear_fuse[1], nn.BatchNorm2d):
+        tq.fuse_modules(net.dec.linear_fuse, [['0', '1']], inplace=True)
+    _wrap_convs(net, backend, set(skip))
+    tq.prepare(net, inplace=True)
+    return net
+
+
+def calibrate(net, dataloader, num_batches=32):
+    """
+    Run num_batches batches of (A, B) pairs through an observed model to collect activation ranges
+    """
+    with torch.no_grad():
+        for i, batch in enumerate(dataloader):
+            if i >= num_batches:
+                break
+            net(batch['A'], batch['B'])
+    return net
+
+
+def convert_quantized(net):
+    tq.convert(net, inplace=True)
+    return net
+
+
+def check_quantized(net, img_size=64):
+    """
+    Forward pass of a converted model on a small input (H and W multiples of 64), so that modules that
+    cannot run on quantized layers fail here instead of in the first evaluation batch
+    """
+    x = torch.zeros(1, net.input_nc, img_size, img_size)
+    try:
+        with torch.no_grad():
+            net(x, x)
+    except Exception as e:
+        raise RuntimeError('the quantized model fails on a %dx%d input' % (img_size, img_size)) from e
+    return net
+
+
+def quantize_model(net_G, dataloader, num_batches=32, backend='fbgemm', skip=()):
+    """
+    Post-training static quantization: prepare, calibrate on num_batches batches of dataloader, convert,
+    then check the converted model with a forward pass (check_quantized).
+    Returns a quantized copy, net_G is left unchanged.
+    """
+    net = prepare_quantization(net_G, backend=backend, skip=skip)
+    calibrate(net, dataloader, num_batches=num_batches)
+    return check_quantized(convert_quantized(net))
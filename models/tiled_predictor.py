@@ -0,0 +1,194 @@
+import os
+import time
+import tempfile
+
+import numpy as np
+import torch
+
+
+"""
+Sliding-window inference on large bitemporal scenes.
+Windows are read lazily from memory-mapped rasters, predicted in batches and blended into
+on-disk accumulators, so peak memory depends on tile size and batch size, not on scene size.
+"""
+
+
+def open_raster(path):
+    """
+    Open a H x W x C raster without reading it into memory.
+    Supported formats: .npy (memory-mapped) and .tif/.tiff (memory-mapped if uncompressed,
+    otherwise read tile by tile through zarr)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r')
+    elif ext in ['.tif', '.tiff']:
+        try:
+            import tifffile
+        except ImportError:
+            raise ImportError('tifffile is required to read %s' % path)
+        try:
+            return tifffile.memmap(path, mode='r')
+        except ValueError:
+            # compressed or non-contiguous TIFF: decode only the tiles touched by each window
+            import zarr
+            return zarr.open(tifffile.imread(path, aszarr=True), mode='r')
+    else:
+        raise NotImplementedError('raster format [%s] is not supported' % ext)
+
+
+def get_window_starts(length, tile_size, stride):
+    """
+    Start offsets of windows along one axis; the last window is aligned with the border
+    """
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+
+def get_blend_weights(tile_size, overlap, mode='gaussian'):
+    """
+    2D weight map used to blend overlapping windows
+    mode: gaussian | linear | none
+    """
+    if mode == 'gaussian':
+        sigma = tile_size / 4.0
+        idx = np.arange(tile_size, dtype=np.float64) - (tile_size - 1) / 2.0
+        w = np.exp(-idx ** 2 / (2 * sigma ** 2))
+    elif mode == 'linear':
+        idx = np.arange(tile_size, dtype=np.float64)
+        ramp = max(overlap, 1) + 1
+        w = np.minimum(np.minimum((idx + 1) / ramp, (tile_size - idx) / ramp), 1.0)
+    elif mode == 'none':
+        w = np.ones(tile_size, dtype=np.float64)
+    else:
+        raise NotImplementedError('blend mode [%s] is not implemented' % mode)
+    w = np.outer(w, w)
+    w = np.maximum(w / w.max(), 1e-3)
+    return w.astype(np.float32)
+
+
+class TiledPredictor():
+    """
+    Predict change maps of arbitrarily large scenes with overlapping windows
+    net_G: change detection network returning a list of logits (ELGCNet)
+    tile_size: spatial size of the windows fed to the network (multiple of 64)
+    overlap: number of pixels shared by neighbouring windows
+    batch_size: number of windows predicted together
+    blend: weighting of overlapping windows: gaussian | linear | none
+    """
+    def __init__(self, net_G, device, tile_size=256, overlap=64, batch_size=8, blend='gaussian'):
+        if tile_size % 64 != 0:
+            # ELGCA pools the 1/32 scale features by 2
+            raise ValueError('tile_size must be a multiple of 64, got %d' % tile_size)
+        if overlap >= tile_size:
+            raise ValueError('overlap (%d) must be smaller than tile_size (%d)' % (overlap, tile_size))
+        self.net_G = net_G
+        self.device = device
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.stride = tile_size - overlap
+        self.batch_size = batch_size
+        self.blend = blend
+        self.weights = get_blend_weights(tile_size, overlap, blend)
+
+    def _read_window(self, raster, y, x):
+        t = self.tile_size
+        win = np.asarray(raster[y:y + t, x:x + t])
+        if win.ndim == 2:
+            win = win[:, :, None]
+        h, w = win.shape[:2]
+        if h != t or w != t:
+            # scene smaller than a window
+            win = np.pad(win, ((0, t - h), (0, t - w), (0, 0)), mode='edge')
+        return win
+
+    def _to_tensor(self, wins):
+        x = torch.from_numpy(np.stack(wins)).to(self.device).permute(0, 3, 1, 2)
+        net_G = self.net_G.module if isinstance(self.net_G, torch.nn.DataParallel) else self.net_G
+        if getattr(net_G, 'uint8_input', False):
+            # the model normalizes the uint8 images in its first convolution
+            return x
+        x = x.float().div_(255)
+        # same normalization as CDDataAugmentation (mean=0.5, std=0.5)
+        return x.sub_(0.5).div_(0.5)
+
+    def _predict_batch(self, wins_A, wins_B):
+        with torch.no_grad():
+            pred = self.net_G(self._to_tensor(wins_A), self._to_tensor(wins_B))[-1]
+            pred = torch.softmax(pred.float(), dim=1)
+        return pred.cpu().numpy()
+
+    def _finalize_rows(self, y0, y1, prob_sum, weight_sum, out_prob, out_label):
+        if y1 <= y0:
+            return
+        prob = prob_sum[:, y0:y1] / weight_sum[y0:y1][None]
+        out_label[y0:y1] = np.argmax(prob, axis=0).astype(np.uint8)
+        out_prob[y0:y1] = prob[-1]
+
+    def predict(self, pre, post, out_dir, work_dir=None):
+        """
+        pre, post: H x W x 3 uint8 arrays (e.g. returned by open_raster)
+        out_dir: folder where prob.npy (change probability, float32) and label.npy (uint8) are written
+        work_dir: folder for the temporary blending accumulators (defaults to out_dir)
+        """
+        if pre.shape[:2] != post.shape[:2]:
+            raise ValueError('pre- and post-change scenes differ in size: %s vs %s'
+                             % (pre.shape, post.shape))
+        H, W = pre.shape[:2]
+        os.makedirs(out_dir, exist_ok=True)
+        work_dir = out_dir if work_dir is None else work_dir
+
+        ys = get_window_starts(H, self.tile_size, self.stride)
+        xs = get_window_starts(W, self.tile_size, self.stride)
+        n_windows = len(ys) * len(xs)
+
+        out_prob = np.lib.format.open_memmap(os.path.join(out_dir, 'prob.npy'), mode='w+',
+                                             dtype=np.float32, shape=(H, W))
+        out_label = np.lib.format.open_memmap(os.path.join(out_dir, 'label.npy'), mode='w+',
+                                              dtype=np.uint8, shape=(H, W))
+
+        self.net_G.eval()
+        start = time.time()
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+            prob_sum, weight_sum = None, np.memmap(os.path.join(tmp_dir, 'weight_sum.dat'),
+                                                   dtype=np.float32, mode='w+', shape=(H, W))
+
+            def flush(batch):
+                nonlocal prob_sum
+                probs = self._predict_batch([b[2] for b in batch], [b[3] for b in batch])
+                if prob_sum is None:
+                    prob_sum = np.memmap(os.path.join(tmp_dir, 'prob_sum.dat'), dtype=np.float32,
+                                         mode='w+', shape=(probs.shape[1], H, W))
+                for (y, x, _, _), p in zip(batch, probs):
+                    h, w = min(self.tile_size, H - y), min(self.tile_size, W - x)
+                    wt = self.weights[:h, :w]
+                    prob_sum[:, y:y + h, x:x + w] += p[:, :h, :w] * wt
+                    weight_sum[y:y + h, x:x + w] += wt
+
+            batch = []
+            done_rows = 0
+            for y in ys:
+                for x in xs:
+                    batch.append((y, x, self._read_window(pre, y, x), self._read_window(post, y, x)))
+                    if len(batch) == self.batch_size:
+                        flush(batch)
+                        batch = []
+                        # windows left to predict start at row y or below, rows above are final
+                        self._finalize_rows(done_rows, y, prob_sum, weight_sum, out_prob, out_label)
+                        done_rows = max(done_rows, y)
+            if batch:
+                flush(batch)
+            for y0 in range(done_rows, H, self.tile_size):
+                self._finalize_rows(y0, min(y0 + self.tile_size, H), prob_sum, weight_sum,
+                                    out_prob, out_label)
+            del prob_sum, weight_sum
+
+        out_prob.flush()
+        out_label.flush()
+        elapsed = time.time() - start
+        return {'height': H, 'width': W, 'windows': n_windows, 'seconds': elapsed,
+                'mpix_per_sec': H * W / 1e6 / elapsed, 'windows_per_sec': n_windows / elapsed}
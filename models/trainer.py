@@ -1,11 +1,10 @@
 import os
-import cv2
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 import utils
-from models.networks import *
+from models.networks import define_G, get_scheduler
 import torch.optim as optim
-from misc.metric_tool import ConfuseMatrixMeter
+from misc.metric_tool import TorchConfuseMatrixMeter
 from models.losses import cross_entropy
 import models.losses as losses
 from models.losses import get_alpha, softmax_helper, FocalLoss, mIoULoss, mmIoULoss
@@ -13,10 +12,11 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from misc.logger_tool import Logger, Timer
+from misc.checkpoint_tool import CheckpointWriter
+from models.compile import CompiledForward
+from datasets.prefetch_loader import PrefetchLoader
 from utils import de_norm
 
-from tqdm import tqdm
-
 class CDTrainer():
 
     def __init__(self, args, dataloaders):
@@ -32,30 +32,51 @@ class CDTrainer():
        
         print(self.device)
 
+        # --prefetch_batches K: batches staged on the device by a background thread
+        if getattr(args, 'prefetch_batches', 0) > 0:
+            self.dataloaders = {k: PrefetchLoader(v, self.device, num_prefetch=args.prefetch_batches)
+                                for k, v in dataloaders.items()}
+
         # Learning rate and Beta1 for Adam optimizers
         self.lr = args.lr
 
         # define optimizers
         if args.optimizer == "sgd":
-            self.optimizer_G = optim.SGD(self.net_G.parameters(), lr=self.lr,
+            self.optimizer_G = optim.SGD(self._get_trainable_parameters(), lr=self.lr,
                                      momentum=0.9,
                                      weight_decay=5e-4)
         elif args.optimizer == "adam":
-            self.optimizer_G = optim.Adam(self.net_G.parameters(), lr=self.lr,
+            self.optimizer_G = optim.Adam(self._get_trainable_parameters(), lr=self.lr,
                                      weight_decay=0)
         elif args.optimizer == "adamw":
-            self.optimizer_G = optim.AdamW(self.net_G.parameters(), lr=self.lr,
+            self.optimizer_G = optim.AdamW(self._get_trainable_parameters(), lr=self.lr,
                                     betas=(0.9, 0.999), weight_decay=0.01)
 
         # define lr schedulers
         self.exp_lr_scheduler_G = get_scheduler(self.optimizer_G, args)
 
-        self.running_metric = ConfuseMatrixMeter(n_class=2)
+        self.running_metric = TorchConfuseMatrixMeter(n_class=2)
+
+        # mixed precision (--amp): forward pass and loss under autocast, loss scaling for fp16
+        self.amp = getattr(args, 'amp', 'off')
+        self.scaler = torch.amp.GradScaler(self.device.type, enabled=self.amp == 'fp16')
+
+        # compiled forward pass for full batches (--compile), net_G itself stays uncompiled
+        self.forward_G = self.net_G
+        if getattr(args, 'compile', 'off') != 'off':
+            self.forward_G = CompiledForward(self.net_G, (args.batch_size, 3, args.img_size, args.img_size),
+                                             mode=args.compile, cache_dir=getattr(args, 'compile_cache', None),
+                                             device=self.device, trainable=True)
 
         # define logger file
         logger_path = os.path.join(args.checkpoint_dir, 'log.txt')
         self.logger = Logger(logger_path)
         self.logger.write_dict_str(args.__dict__)
+        if hasattr(dataloaders['train'].sampler, 'describe'):
+            self.logger.write('\n' + dataloaders['train'].sampler.describe() + '\n')
+
+        # checkpoints are written on a background thread
+        self.checkpoint_writer = CheckpointWriter()
 
         # define timer
         self.timer = Timer()
@@ -70,6 +91,13 @@ class CDTrainer():
 
         self.global_step = 0
         self.steps_per_epoch = len(dataloaders['train'])
+        # optimizer steps over all epochs (resumed runs included), and the steps until --target_mf1
+        self.optimizer_steps = 0
+        self.data_wait = 0.0
+        self.epoch_start = time.perf_counter()
+        self.cache_stats = {}
+        self.target_mf1 = getattr(args, 'target_mf1', None)
+        self.steps_to_target = None
         self.total_steps = (self.max_num_epochs - self.epoch_to_start)*self.steps_per_epoch
 
         self.G_pred = None
@@ -82,6 +110,9 @@ class CDTrainer():
         self.checkpoint_dir = args.checkpoint_dir
         self.vis_dir = args.vis_dir
 
+        # batched augmentation applied in the main process (--augm_backend tensor --augm_in_main)
+        self.batch_augm = getattr(dataloaders['train'].dataset, 'batch_augm', None)
+
         # define the loss functions
         if args.loss == 'ce':
             self._pxl_loss = cross_entropy
@@ -110,6 +141,9 @@ class CDTrainer():
         self.VAL_ACC = np.array([], np.float32)
         if os.path.exists(os.path.join(self.checkpoint_dir, 'val_acc.npy')):
             self.VAL_ACC = np.load(os.path.join(self.checkpoint_dir, 'val_acc.npy'))
+        self.VAL_STEPS = np.array([], np.int64)
+        if os.path.exists(os.path.join(self.checkpoint_dir, 'val_steps.npy')):
+            self.VAL_STEPS = np.load(os.path.join(self.checkpoint_dir, 'val_steps.npy'))
         self.TRAIN_ACC = np.array([], np.float32)
         if os.path.exists(os.path.join(self.checkpoint_dir, 'train_acc.npy')):
             self.TRAIN_ACC = np.load(os.path.join(self.checkpoint_dir, 'train_acc.npy'))
@@ -128,13 +162,15 @@ class CDTrainer():
         if os.path.exists(os.path.join(self.checkpoint_dir, ckpt_name)):
             self.logger.write('loading last checkpoint...\n')
             # load the entire checkpoint
-            checkpoint = torch.load(os.path.join(self.checkpoint_dir, ckpt_name), map_location=self.device)
+            checkpoint = torch.load(os.path.join(self.checkpoint_dir, ckpt_name), map_location=self.device,
+                                    weights_only=False)
 
             # update net_G states
+            if checkpoint.get('arch', self._net_G_config()) != self._net_G_config():
+                raise ValueError('checkpoint architecture %s does not match the model %s (see --arch)' %
+                                 (checkpoint['arch'], self._net_G_config()))
             self.net_G.load_state_dict(checkpoint['model_G_state_dict'], strict=False)
-
-            self.optimizer_G.load_state_dict(checkpoint['optimizer_G_state_dict'])
-            self.exp_lr_scheduler_G.load_state_dict(checkpoint['exp_lr_scheduler_G_state_dict'])
+            self._restore_checkpoint_state(checkpoint)
 
             self.net_G.to(self.device)
 
@@ -142,6 +178,8 @@ class CDTrainer():
             self.epoch_to_start = checkpoint['epoch_id'] + 1
             self.best_val_acc = checkpoint['best_val_acc']
             self.best_epoch_id = checkpoint['best_epoch_id']
+            self.optimizer_steps = checkpoint.get('optimizer_steps', self.epoch_to_start * self.steps_per_epoch)
+            self.steps_to_target = checkpoint.get('steps_to_target', None)
 
             self.total_steps = (self.max_num_epochs - self.epoch_to_start)*self.steps_per_epoch
 
@@ -173,15 +211,41 @@ class CDTrainer():
         pred_vis = pred * 255
         return pred_vis
 
-    def _save_checkpoint(self, ckpt_name):
-        torch.save({
+    def _net_G_config(self):
+        net_G = self.net_G.module if isinstance(self.net_G, torch.nn.DataParallel) else self.net_G
+        return net_G.get_config()
+
+    def _get_trainable_parameters(self):
+        return self.net_G.parameters()
+
+    def _restore_checkpoint_state(self, checkpoint):
+        # optimizer, lr scheduler and loss scaler states of a resumed checkpoint
+        self.optimizer_G.load_state_dict(checkpoint['optimizer_G_state_dict'])
+        self.exp_lr_scheduler_G.load_state_dict(checkpoint['exp_lr_scheduler_G_state_dict'])
+        if 'scaler_state_dict' in checkpoint and self.scaler.is_enabled():
+            self.scaler.load_state_dict(checkpoint['scaler_state_dict'])
+        if checkpoint.get('amp', 'off') != self.amp:
+            self.logger.write('checkpoint was trained with amp=%s, resuming with amp=%s\n' %
+                              (checkpoint.get('amp', 'off'), self.amp))
+
+    def _checkpoint_state(self):
+        return {
             'epoch_id': self.epoch_id,
             'best_val_acc': self.best_val_acc,
             'best_epoch_id': self.best_epoch_id,
+            'optimizer_steps': self.optimizer_steps,
+            'steps_to_target': self.steps_to_target,
             'model_G_state_dict': self.net_G.state_dict(),
+            'arch': self._net_G_config(),
             'optimizer_G_state_dict': self.optimizer_G.state_dict(),
             'exp_lr_scheduler_G_state_dict': self.exp_lr_scheduler_G.state_dict(),
-        }, os.path.join(self.checkpoint_dir, ckpt_name))
+            'amp': self.amp,
+            'scaler_state_dict': self.scaler.state_dict(),
+        }
+
+    def _save_checkpoint(self, ckpt_name, copy_to=()):
+        self.checkpoint_writer.save(self._checkpoint_state(), os.path.join(self.checkpoint_dir, ckpt_name),
+                                    copy_to=[os.path.join(self.checkpoint_dir, name) for name in copy_to])
 
     def _update_lr_schedulers(self):
         self.exp_lr_scheduler_G.step()
@@ -195,12 +259,12 @@ class CDTrainer():
 
         G_pred = torch.argmax(G_pred, dim=1)
 
-        current_score = self.running_metric.update_cm(pr=G_pred.cpu().numpy(), gt=target.cpu().numpy())
-        return current_score
+        # accumulated on the device, scores are only computed when logged
+        self.running_metric.update_cm(pr=G_pred, gt=target)
 
     def _collect_running_batch_states(self):
 
-        running_acc = self._update_metric()
+        self._update_metric()
 
         m = len(self.dataloaders['train'])
         if self.is_training is False:
@@ -208,6 +272,7 @@ class CDTrainer():
 
         imps, est = self._timer_update()
         if np.mod(self.batch_id, 100) == 1:
+            running_acc = self.running_metric.get_running_score()
             message = 'Is_training: %s. [%d,%d][%d,%d], imps: %.2f, est: %.2fh, G_loss: %.5f, running_mf1: %.5f\n' %\
                       (self.is_training, self.epoch_id, self.max_num_epochs-1, self.batch_id, m,
                      imps*self.batch_size, est,
@@ -216,6 +281,10 @@ class CDTrainer():
 
 
         if np.mod(self.batch_id, 500) == 1:
+            # visualization dependencies are imported on first use only
+            import cv2
+            import matplotlib.pyplot as plt
+
             vis_input = utils.make_numpy_grid(de_norm(self.batch['A']))
             vis_input2 = utils.make_numpy_grid(de_norm(self.batch['B']))
             vis_pred = utils.make_numpy_grid(self._visualize_pred())
@@ -241,21 +310,62 @@ class CDTrainer():
         for k, v in scores.items():
             message += '%s: %.5f ' % (k, v)
         self.logger.write(message+'\n')
+        self._log_cache_stats()
+        self._log_data_wait()
         self.logger.write('\n')
 
+    def _iter_timed(self, dataloader):
+        # batches of dataloader, the time spent waiting for them is accumulated in self.data_wait
+        self.data_wait = 0.0
+        self.epoch_start = time.perf_counter()
+        it = iter(dataloader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(it)
+            except StopIteration:
+                return
+            self.data_wait += time.perf_counter() - start
+            yield batch
+
+    def _log_data_wait(self):
+        total = time.perf_counter() - self.epoch_start
+        steps = max(self.batch_id + 1, 1)
+        self.logger.write('data wait: %.2f s of %.2f s (%.1f%%), %.1f ms per step\n' %
+                          (self.data_wait, total, 100 * self.data_wait / max(total, 1e-9),
+                           1000 * self.data_wait / steps))
+
+    def _log_cache_stats(self):
+        # hits and misses of the shared tile cache (--cache_mb) in this epoch, over all loader workers
+        split = 'train' if self.is_training else 'val'
+        cache = getattr(self.dataloaders[split].dataset, 'cache', None)
+        if cache is None:
+            return
+        stats = cache.stats()
+        last = self.cache_stats.get(split, dict.fromkeys(stats, 0))
+        self.cache_stats[split] = stats
+        hits, misses = stats['hits'] - last['hits'], stats['misses'] - last['misses']
+        self.logger.write('tile cache (%s): %d hits, %d misses (hit rate %.1f%%), %d evictions, '
+                          '%d/%d tiles cached (%.1f MB)\n' %
+                          (split, hits, misses, 100 * hits / max(hits + misses, 1),
+                           stats['evictions'] - last['evictions'], stats['cached'], stats['slots'],
+                           stats['nbytes'] / 2 ** 20))
+
     def _update_checkpoints(self):
 
-        # save current model
-        self._save_checkpoint(ckpt_name='last_ckpt.pt')
+        # update the best model (based on eval acc)
+        is_best = self.epoch_acc > self.best_val_acc
+        if is_best:
+            self.best_val_acc = self.epoch_acc
+            self.best_epoch_id = self.epoch_id
+
+        # save current model, the best model is a copy of the written last checkpoint
+        self._save_checkpoint(ckpt_name='last_ckpt.pt', copy_to=['best_ckpt.pt'] if is_best else [])
         self.logger.write('Lastest model updated. Epoch_acc=%.4f, Historical_best_acc=%.4f (at epoch %d)\n'
               % (self.epoch_acc, self.best_val_acc, self.best_epoch_id))
         self.logger.write('\n')
 
-        # update the best model (based on eval acc)
-        if self.epoch_acc > self.best_val_acc:
-            self.best_val_acc = self.epoch_acc
-            self.best_epoch_id = self.epoch_id
-            self._save_checkpoint(ckpt_name='best_ckpt.pt')
+        if is_best:
             self.logger.write('*' * 10 + 'Best model updated!\n')
             self.logger.write('\n')
 
@@ -268,28 +378,42 @@ class CDTrainer():
         # update val acc curve
         self.VAL_ACC = np.append(self.VAL_ACC, [self.epoch_acc])
         np.save(os.path.join(self.checkpoint_dir, 'val_acc.npy'), self.VAL_ACC)
+        # optimizer steps of every val point, to compare runs with different epoch lengths
+        self.VAL_STEPS = np.append(self.VAL_STEPS, [self.optimizer_steps])
+        np.save(os.path.join(self.checkpoint_dir, 'val_steps.npy'), self.VAL_STEPS)
+        self.logger.write('val mF1 %.5f after %d optimizer steps\n' % (self.epoch_acc, self.optimizer_steps))
+        if self.target_mf1 is not None and self.steps_to_target is None and self.epoch_acc >= self.target_mf1:
+            self.steps_to_target = self.optimizer_steps
+            self.logger.write('target val mF1 %.5f reached after %d optimizer steps (epoch %d)\n' %
+                              (self.target_mf1, self.steps_to_target, self.epoch_id))
 
     def _clear_cache(self):
         self.running_metric.clear()
 
 
     def _forward_pass(self, batch):
+        if self.is_training and self.batch_augm is not None:
+            batch = self.batch_augm({k: v.to(self.device) if torch.is_tensor(v) else v
+                                     for k, v in batch.items()})
         self.batch = batch
         img_in1 = batch['A'].to(self.device)
         img_in2 = batch['B'].to(self.device)
-        self.G_pred = self.net_G(img_in1, img_in2)
+        with utils.get_autocast(self.device, self.amp):
+            self.G_pred = self.forward_G(img_in1, img_in2)
 
         self.G_final_pred = self.G_pred[-1]
 
             
     def _backward_G(self):
         gt = self.batch['L'].to(self.device).float()
-        self.G_loss = self._pxl_loss(self.G_pred[-1], gt)
+        with utils.get_autocast(self.device, self.amp):
+            self.G_loss = self._pxl_loss(self.G_pred[-1], gt)
 
-        self.G_loss.backward()
+        self.scaler.scale(self.G_loss).backward()
 
 
     def train_models(self):
+        from tqdm import tqdm
 
         self._load_checkpoint()
 
@@ -304,12 +428,15 @@ class CDTrainer():
             # Iterate over data.
             total = len(self.dataloaders['train'])
             self.logger.write('lr: %0.7f\n \n' % self.optimizer_G.param_groups[0]['lr'])
-            for self.batch_id, batch in tqdm(enumerate(self.dataloaders['train'], 0), total=total):
+            batches = self._iter_timed(self.dataloaders['train'])
+            for self.batch_id, batch in tqdm(enumerate(batches, 0), total=total):
                 self._forward_pass(batch)
                 # update G
                 self.optimizer_G.zero_grad()
                 self._backward_G()
-                self.optimizer_G.step()
+                self.scaler.step(self.optimizer_G)
+                self.scaler.update()
+                self.optimizer_steps += 1
                 self._collect_running_batch_states()
                 self._timer_update()
 
@@ -326,7 +453,7 @@ class CDTrainer():
             self.net_G.eval()
 
             # Iterate over data.
-            for self.batch_id, batch in enumerate(self.dataloaders['val'], 0):
+            for self.batch_id, batch in enumerate(self._iter_timed(self.dataloaders['val']), 0):
                 with torch.no_grad():
                     self._forward_pass(batch)
                 self._collect_running_batch_states()
@@ -337,3 +464,10 @@ class CDTrainer():
             self._update_val_acc_curve()
             self._update_checkpoints()
 
+        if self.target_mf1 is not None and self.steps_to_target is None:
+            self.logger.write('target val mF1 %.5f not reached in %d optimizer steps (best %.5f)\n' %
+                              (self.target_mf1, self.optimizer_steps, self.best_val_acc))
+
+        # wait for the last checkpoints to be written
+        self.checkpoint_writer.close()
+
@@ -0,0 +1,27 @@
+from argparse import ArgumentParser
+
+import data_config
+from datasets.packed_dataset import pack_split
+
+
+"""
+pack the splits of a CD dataset into memory-mappable shards (read by PackedCDDataset)
+"""
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--root_dir', default=None, type=str, help='overrides the root_dir of data_config')
+    parser.add_argument('--split', default='train,val,test', type=str, help='comma separated list of splits')
+    parser.add_argument('--shard_size_mb', default=512, type=int)
+    args = parser.parse_args()
+
+    root_dir = args.root_dir
+    if root_dir is None:
+        root_dir = data_config.DataConfig().get_data_config(args.data_name).root_dir
+    for split in args.split.split(','):
+        pack_split(root_dir, split, shard_size_mb=args.shard_size_mb)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+from argparse import ArgumentParser
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+from models.export import load_model, WEIGHTS_SUFFIX
+
+
+"""
+predict the change map of one image pair.
+Only the model and PIL are imported, none of the training or visualization dependencies.
+"""
+
+def load_image(path):
+    img = np.array(Image.open(path).convert('RGB'))
+    img = torch.from_numpy(img).permute(2, 0, 1).float().div(255)
+    # same normalization as CDDataAugmentation (mean=0.5, std=0.5)
+    return img.sub(0.5).div(0.5).unsqueeze(dim=0)
+
+
+def predict(net, pre, post):
+    """
+    pre, post: normalized 1*3*H*W tensors
+    return: H*W uint8 change map (0: no change, 1: change)
+    """
+    device = next(net.parameters()).device
+    with torch.no_grad():
+        pred = net(pre.to(device), post.to(device))[-1]
+    return torch.argmax(pred, dim=1)[0].to(torch.uint8).cpu().numpy()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--pre', type=str, required=True, help='pre-change image')
+    parser.add_argument('--post', type=str, required=True, help='post-change image')
+    parser.add_argument('--weights', type=str, default='./checkpoints/elgcnet_levir/best_ckpt' + WEIGHTS_SUFFIX)
+    parser.add_argument('--out', type=str, default='change_map.png')
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    net = load_model(args.weights, device=args.device)
+    change_map = predict(net, load_image(args.pre), load_image(args.post))
+    Image.fromarray(change_map * 255).save(args.out)
+    print('change map written to %s (%.2f%% changed pixels)' %
+          (os.path.abspath(args.out), 100.0 * change_map.mean()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+from argparse import ArgumentParser
+import os
+import torch
+
+import utils
+from models.networks import define_G
+from models.tiled_predictor import TiledPredictor, open_raster
+
+
+"""
+predict the change map of a large bitemporal scene with overlapping sliding windows
+"""
+
+def main():
+    # ------------
+    # args
+    # ------------
+    parser = ArgumentParser()
+    parser.add_argument('--gpu_ids', type=str, default='-1', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+    parser.add_argument('--pre', type=str, required=True, help='pre-change scene (.npy or .tif, H x W x 3 uint8)')
+    parser.add_argument('--post', type=str, required=True, help='post-change scene (.npy or .tif, H x W x 3 uint8)')
+    parser.add_argument('--out_dir', type=str, default='./predictions')
+    parser.add_argument('--checkpoint', type=str, default='./checkpoints/elgcnet_levir/best_ckpt.pt')
+
+    # tiling
+    parser.add_argument('--tile_size', default=256, type=int)
+    parser.add_argument('--overlap', default=64, type=int)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--blend', default='gaussian', type=str, help='gaussian | linear | none')
+
+    # model
+    parser.add_argument('--n_class', default=2, type=int)
+    parser.add_argument('--dec_embed_dim', default=256, type=int)
+    parser.add_argument('--stack_siamese', action='store_true',
+                        help='encode pre- and post-change images in a single batched pass')
+    parser.add_argument('--net_G', default='ELGCNet', type=str,
+                        help='ELGCNet')
+
+    args = parser.parse_args()
+    utils.get_device(args)
+    device = torch.device("cuda:%s" % args.gpu_ids[0] if torch.cuda.is_available() and len(args.gpu_ids)>0
+                          else "cpu")
+
+    checkpoint = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
+    net_G = define_G(args=args, gpu_ids=args.gpu_ids, config=checkpoint.get('arch'))
+    net_G.load_state_dict(checkpoint['model_G_state_dict'])
+    net_G.to(device)
+
+    predictor = TiledPredictor(net_G, device, tile_size=args.tile_size, overlap=args.overlap,
+                               batch_size=args.batch_size, blend=args.blend)
+    stats = predictor.predict(open_raster(args.pre), open_raster(args.post), args.out_dir)
+
+    print('scene: %d x %d, windows: %d, time: %.2fs' %
+          (stats['height'], stats['width'], stats['windows'], stats['seconds']))
+    print('throughput: %.3f Mpix/s (%.2f windows/s)' % (stats['mpix_per_sec'], stats['windows_per_sec']))
+    print('results written to %s' % os.path.join(args.out_dir, '{prob,label}.npy'))
+
+
+if __name__ == '__main__':
+    main()
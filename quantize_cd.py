@@ -0,0 +1,99 @@
+from argparse import ArgumentParser
+import os
+import time
+
+import numpy as np
+import torch
+
+import utils
+from misc.metric_tool import ConfuseMatrixMeter
+from models.export import load_model
+from models.quantization import quantize_model
+
+
+"""
+post-training INT8 quantization of a CD model for CPU inference:
+calibrate on a few batches, then compare accuracy and latency of the float and quantized models
+"""
+
+def evaluate(net, dataloader, n_class, max_batches=None):
+    """
+    return the scores of ConfuseMatrixMeter and the per-batch latencies (seconds)
+    """
+    running_metric = ConfuseMatrixMeter(n_class=n_class)
+    times = []
+    with torch.no_grad():
+        for i, batch in enumerate(dataloader):
+            if max_batches is not None and i >= max_batches:
+                break
+            start = time.perf_counter()
+            pred = net(batch['A'], batch['B'])[-1]
+            times.append(time.perf_counter() - start)
+            pr = torch.argmax(pred, dim=1).numpy()
+            gt = batch['L'].squeeze(dim=1).numpy()
+            running_metric.update_cm(pr=pr, gt=gt)
+    return running_metric.get_scores(), np.asarray(times)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--project_name', default='elgcnet_levir', type=str)
+    parser.add_argument('--checkpoints_root', default='./checkpoints', type=str)
+    parser.add_argument('--checkpoint_name', default='best_ckpt.pt', type=str,
+                        help='training checkpoint or inference weights exported by export_cd.py (*.weights)')
+
+    # data
+    parser.add_argument('--dataset', default='CDDataset', type=str)
+    parser.add_argument('--data_name', default='LEVIR', type=str)
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--n_class', default=2, type=int)
+    parser.add_argument('--calib_split', default='train', type=str)
+    parser.add_argument('--calib_batches', default=32, type=int)
+    parser.add_argument('--split', default='test', type=str)
+    parser.add_argument('--max_batches', default=None, type=int, help='limit the number of evaluated batches')
+
+    # quantization
+    parser.add_argument('--backend', default='fbgemm', type=str, help='fbgemm (x86) | qnnpack (ARM)')
+    parser.add_argument('--skip', default='dec.change_probability', type=str,
+                        help='comma separated names of modules kept in float')
+    parser.add_argument('--num_threads', default=None, type=int)
+    parser.add_argument('--save_path', default=None, type=str,
+                        help='save the quantized model as a frozen TorchScript module')
+
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    net_G = load_model(os.path.join(args.checkpoints_root, args.project_name, args.checkpoint_name))
+    calib_loader = utils.get_loader(args.data_name, img_size=args.img_size, batch_size=args.batch_size,
+                                    is_train=False, split=args.calib_split, dataset=args.dataset)
+    eval_loader = utils.get_loader(args.data_name, img_size=args.img_size, batch_size=args.batch_size,
+                                   is_train=False, split=args.split, dataset=args.dataset)
+
+    skip = [s for s in args.skip.split(',') if s]
+    start = time.time()
+    net_Q = quantize_model(net_G, calib_loader, num_batches=args.calib_batches, backend=args.backend, skip=skip)
+    print('calibrated on %d batches of %s in %.1fs' % (args.calib_batches, args.calib_split, time.time() - start))
+
+    results = {}
+    for name, net in [('fp32', net_G), ('int8', net_Q)]:
+        results[name] = evaluate(net, eval_loader, args.n_class, max_batches=args.max_batches)
+
+    print('%-6s %8s %8s %8s %12s %12s' % ('model', 'mF1', 'mIoU', 'F1_1', 'p50 (ms)', 'mean (ms)'))
+    for name, (scores, times) in results.items():
+        print('%-6s %8.5f %8.5f %8.5f %12.2f %12.2f' % (name, scores['mf1'], scores['miou'], scores['F1_1'],
+                                                       1000 * np.median(times[1:]), 1000 * times[1:].mean()))
+    speedup = np.median(results['fp32'][1][1:]) / np.median(results['int8'][1][1:])
+    print('speedup: %.2fx, mF1 change: %+.5f' % (speedup, results['int8'][0]['mf1'] - results['fp32'][0]['mf1']))
+
+    if args.save_path is not None:
+        batch = next(iter(eval_loader))
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(net_Q, (batch['A'], batch['B'])))
+        torch.jit.save(traced, args.save_path)
+        print('quantized model saved to %s' % args.save_path)
+
+
+if __name__ == '__main__':
+    main()
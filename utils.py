@@ -1,14 +1,24 @@
+import contextlib
+
 import numpy as np
 import torch
-from torch.utils.data import DataLoader
-from torchvision import utils
+from torch.utils.data import DataLoader, RandomSampler
 
 import data_config
 from datasets.CD_dataset import CDDataset
+from datasets.packed_dataset import PackedCDDataset
+from datasets.change_sampler import ChangeAwareSampler
+from datasets.materialized_dataset import get_materialized_loader
+from datasets.batch_augmentation import get_train_batch_augmentation, BatchAugmentationCollate
 
 
 def get_loader(data_name, img_size=256, batch_size=8, split='test',
-               is_train=False, dataset='CDDataset'):
+               is_train=False, dataset='CDDataset', materialize='off', uint8=False):
+    """
+    materialize: off | uint8 | float, evaluation samples written once and read in contiguous batches
+    (see datasets.materialized_dataset, is_train=False only)
+    uint8: unnormalized uint8 samples, for models built with uint8_input=True
+    """
     dataConfig = data_config.DataConfig().get_data_config(data_name)
     root_dir = dataConfig.root_dir
     label_transform = dataConfig.label_transform
@@ -16,12 +26,19 @@ def get_loader(data_name, img_size=256, batch_size=8, split='test',
     if dataset == 'CDDataset':
         data_set = CDDataset(root_dir=root_dir, split=split,
                                  img_size=img_size, is_train=is_train,
-                                 label_transform=label_transform)
+                                 label_transform=label_transform, uint8=uint8)
+    elif dataset == 'PackedCDDataset':
+        data_set = PackedCDDataset(root_dir=root_dir, split=split,
+                                 img_size=img_size, is_train=is_train,
+                                 label_transform=label_transform, uint8=uint8)
     else:
         raise NotImplementedError(
-            'Wrong dataset name %s (choose one from [CDDataset])'
+            'Wrong dataset name %s (choose one from [CDDataset, PackedCDDataset])'
             % dataset)
 
+    if materialize != 'off' and not is_train:
+        return get_materialized_loader(data_set, batch_size, fmt=materialize, num_workers=4)
+
     shuffle = is_train
     dataloader = DataLoader(data_set, batch_size=batch_size,
                                  shuffle=shuffle, num_workers=4)
@@ -39,27 +56,79 @@ def get_loaders(args):
     split_val = 'val'
     if hasattr(args, 'split_val'):
         split_val = args.split_val
+    augm_backend = getattr(args, 'augm_backend', 'pil')
+    # --no_train_augm: training samples are only resized (deterministic, as for validation)
+    train_augm = not getattr(args, 'no_train_augm', False)
+    # shared-memory cache of decoded tiles per split (CDDataset only, packed shards are memory-mapped)
+    cache_bytes = int(getattr(args, 'cache_mb', 0) * 1024 * 1024)
+    cache_splits = getattr(args, 'cache_splits', 'val').split(',')
+    # --uint8_input: samples stay uint8 up to the model, which normalizes them in its first convolution
+    uint8 = getattr(args, 'uint8_input', False)
     if args.dataset == 'CDDataset':
         training_set = CDDataset(root_dir=root_dir, split=split,
-                                 img_size=args.img_size,is_train=True,
-                                 label_transform=label_transform)
+                                 img_size=args.img_size,is_train=train_augm,
+                                 label_transform=label_transform, augm_backend=augm_backend,
+                                 cache_bytes=cache_bytes if 'train' in cache_splits else 0, uint8=uint8)
         val_set = CDDataset(root_dir=root_dir, split=split_val,
                                  img_size=args.img_size,is_train=False,
-                                 label_transform=label_transform)
+                                 label_transform=label_transform,
+                                 cache_bytes=cache_bytes if 'val' in cache_splits else 0, uint8=uint8)
+    elif args.dataset == 'PackedCDDataset':
+        training_set = PackedCDDataset(root_dir=root_dir, split=split,
+                                 img_size=args.img_size,is_train=train_augm,
+                                 label_transform=label_transform, augm_backend=augm_backend, uint8=uint8)
+        val_set = PackedCDDataset(root_dir=root_dir, split=split_val,
+                                 img_size=args.img_size,is_train=False,
+                                 label_transform=label_transform, uint8=uint8)
     else:
         raise NotImplementedError(
-            'Wrong dataset name %s (choose one from [CDDataset,])'
+            'Wrong dataset name %s (choose one from [CDDataset, PackedCDDataset])'
             % args.dataset)
 
     datasets = {'train': training_set, 'val': val_set}
+    collate_fns = {'train': None, 'val': None}
+    if augm_backend == 'tensor' and train_augm:
+        # batched augmentation either in the trainer (on its device) or in the loader workers
+        batch_augm = get_train_batch_augmentation(args.img_size, normalize=not uint8)
+        if getattr(args, 'augm_in_main', False):
+            training_set.batch_augm = batch_augm
+        else:
+            collate_fns['train'] = BatchAugmentationCollate(batch_augm)
+    # --sampler change: training tiles drawn by change ratio, --epoch_samples: tiles per training epoch
+    samplers = {'train': None, 'val': None}
+    sampler = getattr(args, 'sampler', 'uniform')
+    epoch_samples = getattr(args, 'epoch_samples', None)
+    if sampler == 'change':
+        samplers['train'] = ChangeAwareSampler(training_set, temperature=getattr(args, 'sampler_temperature', 1.0),
+                                               floor=getattr(args, 'sampler_floor', 0.01),
+                                               num_samples=epoch_samples)
+    elif sampler != 'uniform':
+        raise NotImplementedError('sampler [%s] is not implemented (choose one from [uniform, change])' % sampler)
+    elif epoch_samples is not None:
+        samplers['train'] = RandomSampler(training_set, num_samples=epoch_samples)
+    # workers kept alive between epochs (--persistent_workers), batches per worker in flight (--prefetch_factor)
+    worker_kwargs = {}
+    if args.num_workers > 0:
+        worker_kwargs = {'persistent_workers': getattr(args, 'persistent_workers', False),
+                         'prefetch_factor': getattr(args, 'prefetch_factor', None) or 2}
     dataloaders = {x: DataLoader(datasets[x], batch_size=args.batch_size,
-                                 shuffle=True, num_workers=args.num_workers)
+                                 shuffle=samplers[x] is None, sampler=samplers[x],
+                                 num_workers=args.num_workers, collate_fn=collate_fns[x],
+                                 pin_memory=getattr(args, 'pin_memory', False), **worker_kwargs)
                    for x in ['train', 'val']}
+    # --val_materialize: val samples written once, then read in contiguous batches of --val_batch_size
+    val_materialize = getattr(args, 'val_materialize', 'off')
+    if val_materialize != 'off':
+        val_batch_size = getattr(args, 'val_batch_size', None) or args.batch_size
+        dataloaders['val'] = get_materialized_loader(val_set, val_batch_size, fmt=val_materialize,
+                                                     num_workers=args.num_workers)
 
     return dataloaders
 
 
 def make_numpy_grid(tensor_data, pad_value=0,padding=0):
+    from torchvision import utils
+
     tensor_data = tensor_data.detach()
     vis = utils.make_grid(tensor_data, pad_value=pad_value,padding=padding)
     vis = np.array(vis.cpu()).transpose((1,2,0))
@@ -69,9 +138,27 @@ def make_numpy_grid(tensor_data, pad_value=0,padding=0):
 
 
 def de_norm(tensor_data):
+    if tensor_data.dtype == torch.uint8:
+        return tensor_data.float() / 255
     return tensor_data * 0.5 + 0.5
 
 
+AMP_DTYPES = {'off': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def get_autocast(device, amp='off'):
+    """
+    autocast context for the forward pass and loss computation
+    amp: off | bf16 | fp16
+    """
+    if amp not in AMP_DTYPES:
+        raise NotImplementedError('amp mode [%s] is not implemented (choose one from %s)'
+                                  % (amp, list(AMP_DTYPES)))
+    if AMP_DTYPES[amp] is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=AMP_DTYPES[amp])
+
+
 def get_device(args):
     # set gpu ids
     str_ids = args.gpu_ids.split(',')